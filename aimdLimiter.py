@@ -0,0 +1,104 @@
+import asyncio
+from dataclasses import dataclass, field
+import json
+import os
+import time
+
+@dataclass
+class aimdLimiter():
+    ''' Limits the number of requests in flight using Additive Increase / Multiplicative Decrease.
+
+        Every healthy response that came back while the window was full widens it by increase/limit, which works
+        out to about +increase per full window of requests. Responses while the window has room for more leave it
+        alone, since serial traffic says nothing about whether the server would take more at once. A congestion signal (IE: 429, 5xx, or a connection error) cuts the window by
+        decrease, at most once per window so a burst of failures from the same round doesn't collapse it to
+        the minimum. A Retry-After from the server pauses all new requests until it has passed.
+
+        If a stateFile is given, the learned limit is loaded from it on creation and written back with save(),
+        so the next run starts where the last one left off.
+    '''
+    minLimit:float = 1.0
+    maxLimit:float = 16.0
+    startLimit:float = 2.0
+    increase:float = 1.0
+    decrease:float = 0.5
+    stateFile:str = None
+
+    limit:float = field(init=False)
+    inFlight:int = field(init=False, default=0)
+    pausedUntil:float = field(init=False, default=0.0)
+    lastDecrease:float = field(init=False, default=0.0)
+    condition:asyncio.Condition = field(init=False, default=None, repr=False)
+
+    def __post_init__(self):
+        self.limit = self.startLimit
+
+        if ((self.stateFile is not None) and os.path.exists(self.stateFile)):
+            try:
+                with open(self.stateFile, mode='r') as f:
+                    self.limit = float(json.load(f)['limit'])
+            except (OSError, ValueError, KeyError, TypeError):
+                print('Could not read concurrency state from {:s}, starting fresh'.format(self.stateFile))
+
+        self.limit = min(max(self.limit, self.minLimit), self.maxLimit)
+
+    def save(self):
+        ''' Stores the learned limit for the next run
+        '''
+        if (self.stateFile is None):
+            return
+
+        with open(self.stateFile, mode='w') as f:
+            json.dump({'limit': self.limit}, f)
+
+    def _condition(self) -> asyncio.Condition:
+        # Created lazily so it is bound to the loop that actually uses it
+        if (self.condition is None):
+            self.condition = asyncio.Condition()
+
+        return self.condition
+
+    async def acquire(self) -> float:
+        ''' Waits for a free slot in the window. Returns a token that must be passed back to release
+        '''
+        cond = self._condition()
+        async with cond:
+            while True:
+                now = time.monotonic()
+
+                if (self.pausedUntil > now):
+                    try:
+                        await asyncio.wait_for(cond.wait(), timeout=self.pausedUntil - now)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                if (self.inFlight < int(self.limit)):
+                    self.inFlight += 1
+                    return now
+
+                await cond.wait()
+
+    async def release(self, token:float, congested:bool=False, retryAfter:float=None):
+        ''' Frees a slot and feeds the outcome of the request back into the window size
+        '''
+        cond = self._condition()
+        async with cond:
+            # Counted before this request leaves the window
+            saturated = (self.inFlight >= int(self.limit))
+            self.inFlight -= 1
+            now = time.monotonic()
+
+            if (congested):
+                # Only requests sent after the last cut count, the rest were sent with the old window
+                if (token >= self.lastDecrease):
+                    self.limit = max(self.minLimit, self.limit * self.decrease)
+                    self.lastDecrease = now
+                    print('Backing off to {:d} concurrent requests'.format(int(self.limit)))
+
+                if (retryAfter is not None):
+                    self.pausedUntil = max(self.pausedUntil, now + retryAfter)
+            elif (saturated):
+                self.limit = min(self.maxLimit, self.limit + (self.increase / self.limit))
+
+            cond.notify_all()
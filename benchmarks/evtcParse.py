@@ -0,0 +1,171 @@
+'''
+Times reading the encounter facts straight out of arcDPS logs with evtc.py, and the vectorized queries of
+evtcArray.py when numpy is installed, and checks them against what is expected. Run from the repository root:
+
+    python benchmarks/evtcParse.py [--seconds 600] [--fixtures <directory>] [--generated-only]
+
+The generated logs are checked against the values they were built with, which only shows the parser reads back
+what fixtures.makeEvtc writes. Real logs are what actually matter, so the recorded logs in benchmarks/recorded
+(or --fixtures) are checked as well: each <name>.zevtc has the <name>.ei.json EI produced for it next to it, made
+with recordFixture.py. Every fact is compared with what EI made of the same log, and the run fails unless the
+recorded logs include a kill, a fail and a boss in evtc.cmMaxHealth.
+'''
+import json
+import argparse
+import glob
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import dpsReport
+import evtc
+import evtcArray
+import fixtures
+import recordFixture
+
+def check(name:str, expected, actual) -> bool:
+    if (expected != actual):
+        print('  MISMATCH {:s}: expected {!r}, got {!r}'.format(name, expected, actual))
+        return False
+
+    return True
+
+def checkGenerated(seconds:int, eventsPerSecond:int) -> bool:
+    rng = random.Random(0)
+    ok = True
+
+    for (i, (bossId, boss)) in enumerate(fixtures.bosses):
+        success = ((i % 4) != 3)
+        data = fixtures.makeEvtc(rng, bossId=bossId, boss=boss, success=success, fightSeconds=seconds,
+                                 emboldened=(i % 3), eventsPerSecond=eventsPerSecond)
+
+        with tempfile.NamedTemporaryFile(suffix='.zevtc', delete=False) as f:
+            f.write(data)
+            path = f.name
+
+        try:
+            start = time.perf_counter()
+            log = evtc.evtcLog.fromFile(path)
+            loaded = time.perf_counter()
+            facts = log.facts()
+            done = time.perf_counter()
+        finally:
+            os.remove(path)
+
+        print('{:<28s} {:9d} events  load {:8.1f} ms  facts {:8.1f} ms'.format(
+              boss, log.eventCount, (loaded - start) * 1000, (done - loaded) * 1000))
+
+        ok &= check('bossId', bossId, facts.bossId)
+        ok &= check('success', success, facts.success)
+        # A fail runs to the end of the log, which makeEvtc writes 2s after the fight
+        ok &= check('duration', (seconds * 1000) + (0 if success else 2000), facts.duration)
+        ok &= check('emboldened', i % 3, facts.emboldened)
+        ok &= check('players', 10, len(facts.players))
+        ok &= check('isCm', None, facts.isCm)
+        if (success):
+            ok &= check('burned', 100.0, facts.targets[0][1])
+
+        if (evtcArray.np is not None):
+            ok &= checkArray(log, facts)
+
+    return ok
+
+def checkArray(log:evtc.evtcLog, facts:evtc.encounterFacts) -> bool:
+    ''' The array queries should agree with the facts worked out from the statechanges
+    '''
+    start = time.perf_counter()
+    events = evtcArray.evtcArray(log=log)
+    emboldened = events.emboldened()
+    health = events.healthUpdates()
+    lastHits = events.lastHits()
+    elapsed = time.perf_counter() - start
+
+    print('{:<28s} {:>16s}  array queries {:8.1f} ms'.format('', '', elapsed * 1000))
+
+    ok = check('array emboldened', facts.emboldened, emboldened)
+
+    (address, ) = events.targetAddresses()
+    ok &= check('array health', facts.targets[0][1], 100.0 - health[address][1][-1])
+    ok &= check('array last hit', True, lastHits[address][0] <= events.events['time'].max())
+
+    return ok
+
+def checkRecorded(directory:str) -> bool:
+    ok = True
+    checked = 0
+    covered = set()
+
+    for logPath in sorted(glob.glob(os.path.join(directory, '*.zevtc'))):
+        eiPath = logPath[:-len('.zevtc')] + '.ei.json'
+        if (not os.path.exists(eiPath)):
+            print('No EI JSON for {:s}, skipping'.format(logPath))
+            continue
+
+        with open(eiPath, mode='rb') as f:
+            data = f.read()
+        summary = dpsReport.logSummary.fromJson(data)
+        ei = json.loads(data)
+
+        start = time.perf_counter()
+        facts = evtc.evtcLog.fromFile(logPath).facts()
+        elapsed = time.perf_counter() - start
+
+        print('{:<40s} {:8.1f} ms'.format(os.path.basename(logPath), elapsed * 1000))
+        checked += 1
+        covered.add('kill' if ei['success'] else 'fail')
+        if (facts.bossId in evtc.cmMaxHealth):
+            covered.add('CM boss')
+
+        ok &= check('bossId', ei['triggerID'], facts.bossId)
+        ok &= check('success', ei['success'], facts.success)
+        ok &= check('emboldened', summary.emboldened, facts.emboldened)
+        ok &= check('players', sorted(summary.players), sorted(facts.players))
+        ok &= check('timeStart', summary.timeStart, facts.timeStart)
+        ok &= check('timeEnd', summary.timeEnd, facts.timeEnd)
+
+        # Bosses that aren't in evtc.cmMaxHealth can't be told apart locally, anything else has to agree with EI
+        if ((facts.isCm is not None) or (facts.bossId in evtc.cmMaxHealth)):
+            ok &= check('isCm', summary.isCm, facts.isCm)
+
+        # EI trims the start of the fight a little differently, so only expect the duration to be close
+        if (abs(summary.duration - facts.duration) > 1000):
+            ok &= check('duration', summary.duration, facts.duration)
+
+        # Health comes from the last update arcDPS wrote, which EI rounds slightly differently
+        eiTargets = {id: burned for (id, burned) in summary.targets}
+        for (species, burned) in facts.targets:
+            if (species not in eiTargets):
+                ok &= check('target {:d}'.format(species), 'in EI targets', 'missing')
+            elif (abs(eiTargets[species] - burned) > 0.5):
+                ok &= check('target {:d} burned'.format(species), eiTargets[species], burned)
+
+    if (checked == 0):
+        print('No recorded logs with EI JSON in {:s}, the parser is unchecked against real logs'.format(directory))
+        return False
+
+    missing = [c for c in ('kill', 'fail', 'CM boss') if (c not in covered)]
+    if (len(missing) > 0):
+        print('Recorded logs in {:s} have no {:s}'.format(directory, ', '.join(missing)))
+        return False
+
+    return ok
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local arcDPS log parsing benchmark')
+    parser.add_argument('--seconds', type=int, default=300, help='Length of the generated fights')
+    parser.add_argument('--events-per-second', dest='eventsPerSecond', type=int, default=1000, help='Combat events per second of fight')
+    parser.add_argument('--fixtures', default=recordFixture.recordedDir, help='Directory of recorded <name>.zevtc / <name>.ei.json pairs to check against')
+    parser.add_argument('--generated-only', dest='generatedOnly', action='store_true', help='Only time and check the generated logs')
+
+    args = parser.parse_args()
+
+    ok = checkGenerated(args.seconds, args.eventsPerSecond)
+    if (not args.generatedOnly):
+        ok &= checkRecorded(args.fixtures)
+
+    print('All facts match' if ok else 'Some facts did not match or could not be checked')
+    sys.exit(0 if ok else 1)
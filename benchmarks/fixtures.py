@@ -0,0 +1,208 @@
+'''
+Synthetic dps.report responses for the benchmarks, shaped like the real ones. Recorded responses can be used
+instead by saving them as <name>.meta.json (getUploadMetadata) and <name>.ei.json (getJson) in a directory and
+loading it with loadRecorded. makeEvtc builds arcDPS logs to go with them.
+'''
+import glob
+import io
+import json
+import os
+import random
+import sys
+from typing import List,Tuple
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import dpsReport
+import evtc
+
+# (boss ID, boss name) of the encounters the fixtures cycle through
+bosses = [(15438, 'Vale Guardian'), (15429, 'Gorseval the Multifarious'), (15375, 'Sabetha the Saboteur'),
+          (16123, 'Slothasor'), (16115, 'Matthias Gabrel'), (16235, 'Keep Construct')]
+
+def makeMetadata(i:int, rng:random.Random, bossId:int=15438, boss:str='Vale Guardian', success:bool=True,
+                 encounterTime:int=1673813000) -> dict:
+    ''' Builds a getUploadMetadata response. The same squad of accounts shows up over and over, like it
+        would in a real history
+    '''
+    players = {}
+    for p in range(10):
+        account = 'Player {:d}.{:04d}'.format(p, p * 37)
+        players[account] = {
+            'display_name': account,
+            'character_name': 'Character {:d}'.format(rng.randrange(3) + p * 3),
+            'profession': rng.randrange(1, 10),
+            'elite_spec': rng.randrange(0, 70),
+        }
+
+    return {
+        'id': 'abcd-20230115-2015{:04d}_vg'.format(i),
+        'permalink': 'https://dps.report/abcd-20230115-2015{:04d}_vg'.format(i),
+        'uploadTime': encounterTime + 600,
+        'encounterTime': encounterTime,
+        'generator': 'Elite Insights',
+        'generatorId': 1,
+        'generatorVersion': 2,
+        'language': 'en',
+        'languageId': 0,
+        'evtc': {'type': 'EVTC', 'version': 'EVTC20230110', 'bossId': bossId},
+        'players': players,
+        'encounter': {
+            'uniqueId': 'abcd',
+            'success': success,
+            'duration': 245,
+            'compDps': 250000,
+            'numberOfPlayers': 10,
+            'numberOfGroups': 2,
+            'bossId': bossId,
+            'boss': boss,
+            'isCm': False,
+            'gw2Build': 141374,
+            'jsonAvailable': True,
+        },
+    }
+
+def makeLog(rng:random.Random, numPlayers:int=10, numBuffs:int=200, numPhases:int=12, fightSeconds:int=600,
+            bossId:int=15438, boss:str='Vale Guardian', success:bool=True) -> dict:
+    ''' Builds an EI JSON shaped like a long wing fight, with the bulky per second arrays that make the real
+        ones many megabytes
+    '''
+    buffIds = [dpsReport.emboldenedID] + rng.sample(range(700, 80000), numBuffs - 1)
+    rng.shuffle(buffIds)
+
+    players = []
+    for p in range(numPlayers):
+        players.append({
+            'account': 'Player {:d}.{:04d}'.format(p, p * 37),
+            'name': 'Character {:d}'.format(p),
+            'friendlyNPC': False,
+            'buffUptimes': [{'id': b, 'buffData': [{'uptime': rng.random() * 5, 'presence': 0} for _ in range(numPhases)],
+                             'states': [[t * 1000, rng.randrange(5)] for t in range(0, fightSeconds, 10)]}
+                            for b in buffIds],
+            'dpsTargets': [[{'dps': rng.randrange(50000), 'damage': rng.randrange(10**7)} for _ in range(numPhases)]],
+            'damage1S': [[rng.randrange(10**7) for _ in range(fightSeconds)]],
+            'rotation': [{'id': rng.randrange(50000), 'skills': [{'castTime': t * 1000, 'duration': 500}
+                                                                 for t in range(0, fightSeconds, 3)]}
+                         for _ in range(20)],
+        })
+
+    burned = 100.0 if success else (rng.random() * 100)
+    targets = [{'id': bossId, 'name': boss, 'healthPercentBurned': burned,
+                'damage1S': [[rng.randrange(10**7) for _ in range(fightSeconds)]]}]
+    targets += [{'id': -1, 'name': 'Trash', 'healthPercentBurned': rng.random() * 100} for _ in range(30)]
+
+    return {
+        'eliteInsightsVersion': '2.50.0.0',
+        'triggerID': bossId,
+        'fightName': boss,
+        'duration': '{:02d}m {:02d}s {:03d}ms'.format(fightSeconds // 60, fightSeconds % 60, rng.randrange(1000)),
+        'timeStart': '2023-01-15 20:15:34 -05',
+        'timeEnd': '2023-01-15 20:25:34 -05',
+        'timeStartStd': '2023-01-15 20:15:34 -05:00',
+        'timeEndStd': '2023-01-15 20:25:34 -05:00',
+        'isCM': False,
+        'success': success,
+        'targets': targets,
+        'players': players,
+        'phases': [{'name': 'Phase {:d}'.format(i), 'start': i * 1000, 'end': (i + 1) * 1000} for i in range(numPhases)],
+    }
+
+def makeFixtures(count:int=12, seed:int=0, **logArgs) -> List[Tuple[dict, bytes]]:
+    ''' Builds (metadata, raw EI JSON) pairs cycling through the bosses, with one fail for every three kills
+    '''
+    rng = random.Random(seed)
+
+    fixtures = []
+    for i in range(count):
+        (bossId, boss) = bosses[i % len(bosses)]
+        success = ((i % 4) != 3)
+        fightSeconds = rng.randrange(120, 480)
+
+        metadata = makeMetadata(i, rng, bossId=bossId, boss=boss, success=success, encounterTime=1673813000 + (i * 600))
+        ei = makeLog(rng, bossId=bossId, boss=boss, success=success, fightSeconds=fightSeconds, **logArgs)
+        fixtures.append((metadata, json.dumps(ei).encode()))
+
+    return fixtures
+
+def loadRecorded(directory:str) -> List[Tuple[dict, bytes]]:
+    ''' Loads recorded (metadata, raw EI JSON) pairs from a directory
+    '''
+    fixtures = []
+    for metaPath in sorted(glob.glob(os.path.join(directory, '*.meta.json'))):
+        eiPath = metaPath[:-len('.meta.json')] + '.ei.json'
+        if (not os.path.exists(eiPath)):
+            print('No EI JSON for {:s}, skipping'.format(metaPath))
+            continue
+
+        with open(metaPath, mode='r') as f:
+            metadata = json.load(f)
+        with open(eiPath, mode='rb') as f:
+            ei = f.read()
+
+        fixtures.append((metadata, ei))
+
+    return fixtures
+
+def makeEvtc(rng:random.Random, bossId:int=15438, boss:str='Vale Guardian', success:bool=True, fightSeconds:int=300,
+             numPlayers:int=10, emboldened:int=0, eventsPerSecond:int=1000, encounterTime:int=1673813734,
+             gw2Build:int=141374, zipped:bool=True) -> bytes:
+    ''' Builds an arcDPS log of a fight against a single boss. Most of the events are plain damage events
+        between the players and the boss, which is what makes up the bulk of a real log
+    '''
+    bossAddress = 1000
+    playerAddresses = [2000 + p for p in range(numPlayers)]
+
+    out = io.BytesIO()
+    out.write(evtc.headerStruct.pack(b'EVTC', b'20230110', 1, bossId))
+
+    out.write(evtc.countStruct.pack(numPlayers + 1))
+    out.write(evtc.agentStruct.pack(bossAddress, bossId, evtc.nonPlayerElite, 0, 0, 0, 0, 0, 0, boss.encode()))
+    for (p, address) in enumerate(playerAddresses):
+        name = 'Character {:d}\0:Player {:d}.{:04d}\0{:d}'.format(p, p, p * 37, (p // 5) + 1).encode()
+        out.write(evtc.agentStruct.pack(address, rng.randrange(1, 10), rng.randrange(0, 70), 0, 0, 0, 0, 0, 0, name))
+
+    skills = [(dpsReport.emboldenedID, 'Emboldened')] + [(rng.randrange(700, 80000), 'Skill') for _ in range(50)]
+    out.write(evtc.countStruct.pack(len(skills)))
+    for (id, name) in skills:
+        out.write(evtc.skillStruct.pack(id, name.encode()))
+
+    def event(time:int, src:int=0, dst:int=0, value:int=0, skillId:int=0, stateChange:int=0):
+        out.write(evtc.eventStruct.pack(time, src, dst, value, 0, 0, skillId, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
+                                        stateChange, 0, 0, 0))
+
+    start = 5000
+    end = start + (fightSeconds * 1000)
+
+    event(start, src=bossId, value=encounterTime, stateChange=evtc.stateChangeLogStart)
+    event(start, src=gw2Build, stateChange=evtc.stateChangeGwBuild)
+    event(start, src=bossAddress, dst=22021440, stateChange=evtc.stateChangeMaxHealthUpdate)
+    for address in playerAddresses:
+        for _ in range(emboldened):
+            event(start, src=address, skillId=dpsReport.emboldenedID, stateChange=evtc.stateChangeBuffInitial)
+
+    # Health drops evenly over the fight, all the way to zero on a kill
+    remaining = 0 if success else rng.randrange(1000, 9000)
+    for second in range(fightSeconds):
+        time = start + (second * 1000)
+        for i in range(eventsPerSecond):
+            event(time + (i * 1000 // eventsPerSecond), src=rng.choice(playerAddresses), dst=bossAddress,
+                  value=rng.randrange(10000), skillId=skills[rng.randrange(1, len(skills))][0])
+
+        health = 10000 - ((10000 - remaining) * (second + 1) // fightSeconds)
+        event(time + 999, src=bossAddress, dst=health, stateChange=evtc.stateChangeHealthUpdate)
+
+    if (success):
+        event(end, src=bossAddress, stateChange=evtc.stateChangeDead)
+        event(end, dst=55821, value=1, stateChange=evtc.stateChangeReward)
+    event(end + 2000, src=bossId, value=encounterTime + fightSeconds + 2, stateChange=evtc.stateChangeLogEnd)
+
+    data = out.getvalue()
+    if (not zipped):
+        return data
+
+    zipOut = io.BytesIO()
+    with zipfile.ZipFile(zipOut, mode='w', compression=zipfile.ZIP_DEFLATED) as z:
+        z.writestr('log.evtc', data)
+
+    return zipOut.getvalue()
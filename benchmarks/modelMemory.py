@@ -0,0 +1,50 @@
+'''
+Measures the time and memory it takes to turn dps.report metadata into dpsReportObj, for a history the size
+of a typical encounterDb. Run from the repository root:
+
+    python benchmarks/modelMemory.py [numLogs]
+'''
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import dpsReport
+import fixtures
+
+def measure(parser:dpsReport.dpsReport, bodies, touchPlayers:bool):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    logs = [parser.jsonToObject(json.loads(b)) for b in bodies]
+    if (touchPlayers):
+        for l in logs:
+            len(l.players)
+
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    (current, _) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    del logs
+    return (elapsed, current)
+
+if __name__ == '__main__':
+    numLogs = int(sys.argv[1]) if (len(sys.argv) > 1) else 10000
+
+    rng = random.Random(0)
+    bodies = [json.dumps(fixtures.makeMetadata(i, rng)) for i in range(numLogs)]
+
+    parser = dpsReport.dpsReport(cacheDir=None)
+
+    for (name, touchPlayers) in (('metadata only', False), ('with players', True)):
+        (elapsed, retained) = measure(parser, bodies, touchPlayers)
+        print('{:<14s} {:d} logs: {:7.1f} ms, {:7.2f} MiB retained'.format(name, numLogs, elapsed * 1000, retained / (1024 * 1024)))
+
+    parser.close()
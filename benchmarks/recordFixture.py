@@ -0,0 +1,54 @@
+'''
+Records real arcDPS logs as fixtures for evtcParse.py. Each log is uploaded to dps.report, and the EI JSON it
+produces is saved next to a copy of the log in benchmarks/recorded. Run from the repository root:
+
+    python benchmarks/recordFixture.py <name>=<path to .zevtc> [<name>=<path> ...] [--token <userToken>]
+
+IE: raidKill=...\\20230115-201534.zevtc raidFail=... fractalCm=...
+
+Keep the logs small (short fights) since they are checked in. A raid kill, a fail and a CM of a boss in
+evtc.cmMaxHealth cover the success, duration, Emboldened and CM checks.
+'''
+import argparse
+import json
+import os
+import shutil
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import dpsReport
+
+recordedDir = os.path.join(os.path.dirname(__file__), 'recorded')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Record arcDPS logs and their EI JSON as parser fixtures')
+    parser.add_argument('logs', nargs='+', help='<name>=<path to .zevtc> of each log to record')
+    parser.add_argument('--token', help='dps.report userToken to upload with')
+    parser.add_argument('--out', default=recordedDir, help='Directory to write the fixtures to')
+
+    args = parser.parse_args()
+    os.makedirs(args.out, exist_ok=True)
+
+    # No cache, the JSON has to come from dps.report's parse of this exact upload
+    logParser = dpsReport.dpsReport(token=args.token, cacheDir=None)
+
+    for spec in args.logs:
+        (name, sep, path) = spec.partition('=')
+        if (not sep):
+            parser.error('{:s} is not <name>=<path>'.format(spec))
+
+        [(_, obj)] = logParser.uploadLogs([path])
+        if (obj is None):
+            print('{:s} was rejected by dps.report, skipping'.format(path))
+            continue
+
+        data = logParser.getJson(link=obj.permalink)
+
+        shutil.copyfile(path, os.path.join(args.out, name + '.zevtc'))
+        with open(os.path.join(args.out, name + '.ei.json'), mode='w') as f:
+            json.dump(data, f)
+
+        print('Recorded {:s} as {:s} ({:s})'.format(path, name, obj.permalink))
+
+    logParser.close()
@@ -0,0 +1,216 @@
+'''
+Times the main stages of posting a session against the local dps.report stand-in (see standin.py), and stores
+the results so runs can be compared. Run from the repository root:
+
+    python benchmarks/runBenchmarks.py --logs 100 --latency 0.1 --error-rate 0.02
+    python benchmarks/runBenchmarks.py --compare benchmarks/results/<earlier run>.json
+
+Stages:
+    upload            uploadLogs of freshly generated files
+    summaries         getSummaries with an empty JSON cache
+    getJsons          getJsons with an empty JSON cache, on the first --json-logs logs
+    getJsons cached   the same again, served from the JSON cache
+    fillFromLogs      sorting the logs into an encounterSet
+    prepareMessage    building the webhook post from the summaries
+    encounterDb       importLogs into an empty database
+    pipeline          upload, summaries and import streamed together through pipeline.py, on new files
+'''
+import argparse
+import contextlib
+from datetime import datetime
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import dpsReport
+import encounterDb
+import encounterSet as es
+import fixtures
+import pipeline
+import postUtils
+import standin
+
+encounterFormat = {'W1': ['vg', 'gors', 'sab'], 'W2': ['sloth', 'matt'], 'W3': ['kc']}
+
+postConfig = {'useTitleExtrapolate': True, 'defaultSuccess': 'Benchmark', 'defaultFail': 'Fails', 'compTime': 'PB',
+              'includeTotalTime': True, 'botName': 'Benchmark', 'webhook': ''}
+globalConfig = {'pbEmote': ':pb:', 'emboldenedEmote': ':emboldened:'}
+
+@contextlib.contextmanager
+def quiet(enabled:bool):
+    ''' Hides the progress prints of the code being timed
+    '''
+    if (enabled):
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+    else:
+        yield
+
+def timed(results:Dict, name:str, count:int, func, hideOutput:bool):
+    ''' Runs func once and records the time it took and the rate over count items
+    '''
+    with quiet(hideOutput):
+        start = time.perf_counter()
+        rtn = func()
+        elapsed = time.perf_counter() - start
+
+    results[name] = {'seconds': elapsed, 'count': count, 'perSecond': (count / elapsed) if (elapsed > 0) else None}
+    print('{:<18s} {:9.3f} s  {:10.1f} /s  ({:d})'.format(name, elapsed, results[name]['perSecond'] or 0, count))
+
+    return rtn
+
+def gitCommit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(results:Dict, previousFile:str):
+    with open(previousFile, mode='r') as f:
+        previous = json.load(f)
+
+    print('Compared to {:s} ({}):'.format(previousFile, previous.get('commit')))
+    for (name, r) in results.items():
+        if (name not in previous['results']):
+            continue
+
+        before = previous['results'][name]['seconds']
+        change = ((r['seconds'] - before) / before * 100) if (before > 0) else 0
+        print('{:<18s} {:9.3f} s -> {:9.3f} s  ({:+.1f}%)'.format(name, before, r['seconds'], change))
+
+def run(args) -> Dict:
+    if (args.fixtures is not None):
+        responses = fixtures.loadRecorded(args.fixtures)
+    else:
+        responses = fixtures.makeFixtures(numBuffs=args.buffs)
+
+    server = standin.standInServer(fixtures=responses, latency=args.latency, jitter=args.jitter,
+                                   errorRate=args.errorRate, malformedRate=args.malformedRate)
+    baseUrl = server.start()
+
+    workDir = tempfile.mkdtemp(prefix='otterlogger-bench-')
+    results = {}
+    hideOutput = (not args.verbose)
+
+    try:
+        # Log files with distinct contents, so the upload ledger can't dedupe them
+        logDir = os.path.join(workDir, 'logs')
+        os.makedirs(logDir)
+        paths = []
+        for i in range(args.logs):
+            path = os.path.join(logDir, '20230115-{:06d}.zevtc'.format(i))
+            with open(path, mode='wb') as f:
+                f.write(os.urandom(args.logSize))
+            paths.append(path)
+
+        parser = dpsReport.dpsReport(cacheDir=os.path.join(workDir, 'cache'), maxConcurrency=args.concurrency,
+                                     baseUrl=baseUrl)
+        parser.backoffFactor = 0
+
+        uploaded = timed(results, 'upload', len(paths), lambda: parser.uploadLogs(paths), hideOutput)
+        logs = [obj for (_, obj) in uploaded if obj is not None]
+
+        timed(results, 'summaries', len(logs), lambda: parser.getSummaries(logs), hideOutput)
+
+        # A separate cache, so the summaries above don't warm it up
+        jsonParser = dpsReport.dpsReport(cacheDir=os.path.join(workDir, 'cache-json'), maxConcurrency=args.concurrency,
+                                         baseUrl=baseUrl)
+        jsonParser.backoffFactor = 0
+
+        jsonLogs = [dpsReport.dpsReportObj(permalink=l.permalink, generatorVersion=l.generatorVersion) for l in logs[:args.jsonLogs]]
+        timed(results, 'getJsons', len(jsonLogs), lambda: jsonParser.getJsons(jsonLogs), hideOutput)
+        for l in jsonLogs:
+            l.encounter.json = None
+        timed(results, 'getJsons cached', len(jsonLogs), lambda: jsonParser.getJsons(jsonLogs), hideOutput)
+        for l in jsonLogs:
+            l.encounter.json = None
+
+
+        encounters = es.encounterSet.fromFormat(format=encounterFormat)
+        timed(results, 'fillFromLogs', len(logs), lambda: encounters.fillFromLogs(logs=logs, includeFailures=True), hideOutput)
+        timed(results, 'prepareMessage', len(logs),
+              lambda: postUtils.prepareMessage(logParser=parser, globalConfig=globalConfig, config=postConfig,
+                                               encounterSet=encounters),
+              hideOutput)
+
+        db = encounterDb.encounterDb(filename=os.path.join(workDir, 'encounters.db'))
+        timed(results, 'encounterDb', len(logs), lambda: db.importLogs(logs=logs, parser=parser), hideOutput)
+        db.db.close()
+
+        # The same upload, summaries and import again, but overlapped. New files, cache and db so nothing is reused
+        pipelinePaths = []
+        for p in paths:
+            path = p.replace('.zevtc', '-p.zevtc')
+            with open(path, mode='wb') as f:
+                f.write(os.urandom(args.logSize))
+            pipelinePaths.append(path)
+
+        pipelineParser = dpsReport.dpsReport(cacheDir=os.path.join(workDir, 'cache-pipeline'), maxConcurrency=args.concurrency,
+                                             baseUrl=baseUrl)
+        pipelineParser.backoffFactor = 0
+        pipelineDb = encounterDb.encounterDb(filename=os.path.join(workDir, 'encounters-pipeline.db'))
+        timed(results, 'pipeline', len(pipelinePaths),
+              lambda: pipeline.logPipeline(logParser=pipelineParser, db=pipelineDb).run(pipelinePaths), hideOutput)
+        pipelineDb.db.close()
+
+        # Retries, malformed JSON and cache hits seen by the client, see metrics.py
+        clientCounters = (parser.metrics.report()['counters'] + jsonParser.metrics.report()['counters'] +
+                          pipelineParser.metrics.report()['counters'])
+
+        parser.close()
+        jsonParser.close()
+        pipelineParser.close()
+    finally:
+        server.stop()
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    print('Stand-in served: {}'.format(server.counts))
+
+    return {
+        'label': args.label,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': gitCommit(),
+        'params': {k: v for (k, v) in vars(args).items() if k not in ('compare', 'output', 'verbose', 'label')},
+        'server': server.counts,
+        'client': clientCounters,
+        'results': results,
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='OtterLogger pipeline benchmarks against a local dps.report stand-in')
+    parser.add_argument('--logs', type=int, default=100, help='Number of logs to upload and process')
+    parser.add_argument('--log-size', dest='logSize', type=int, default=256 * 1024, help='Size of each generated log file in bytes')
+    parser.add_argument('--json-logs', dest='jsonLogs', type=int, default=20, help='Number of logs to fetch the full EI JSON for')
+    parser.add_argument('--buffs', type=int, default=80, help='Buffs per player in the generated EI JSONs, which sets their size')
+    parser.add_argument('--fixtures', help='Directory of recorded <name>.meta.json / <name>.ei.json pairs to serve')
+    parser.add_argument('--concurrency', type=int, default=16, help='maxConcurrency of the client')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds the stand-in adds to every request')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Up to this many extra seconds per request, at random')
+    parser.add_argument('--error-rate', dest='errorRate', type=float, default=0.0, help='Fraction of requests that fail with a 503')
+    parser.add_argument('--malformed-rate', dest='malformedRate', type=float, default=0.0, help='Fraction of JSON responses cut short')
+    parser.add_argument('--label', default='', help='Free text stored with the results')
+    parser.add_argument('--output', default=os.path.join(os.path.dirname(__file__), 'results'), help='Directory the results are written to')
+    parser.add_argument('--compare', help='Results file of an earlier run to compare against')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Show the output of the code being timed')
+
+    args = parser.parse_args()
+
+    report = run(args)
+
+    os.makedirs(args.output, exist_ok=True)
+    outFile = os.path.join(args.output, '{:s}.json'.format(datetime.now().strftime('%Y%m%d-%H%M%S')))
+    with open(outFile, mode='w') as f:
+        json.dump(report, f, indent=2)
+    print('Results written to {:s}'.format(outFile))
+
+    if (args.compare is not None):
+        compare(report['results'], args.compare)
@@ -0,0 +1,237 @@
+'''
+A local stand-in for dps.report, for benchmarking without touching the real servers. Implements uploadContent,
+getUploadMetadata, getJson and getUploads on top of fixture responses, with configurable latency and error
+rates. Point a dpsReport at it with dpsReport(baseUrl=server.baseUrl), or run it on its own with:
+
+    python benchmarks/standin.py --port 8080 --latency 0.2 --error-rate 0.05
+
+and set "baseUrl": "http://127.0.0.1:8080/" in the dpsReport section of config.json.
+'''
+import argparse
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import random
+import sys
+import threading
+import time
+from typing import Dict,List,Tuple
+from urllib.parse import parse_qs, urlparse
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import dpsReport
+import fixtures
+
+@dataclass
+class standInServer():
+    ''' Serves fixture (metadata, raw EI JSON) pairs. Every upload is handed the next fixture in turn under a
+        new ID, with the encounter time moved along so the uploads spread out like a session.
+
+        Each request waits latency seconds plus up to jitter more. With probability errorRate it then fails
+        with a 503 (retryable), and with probability malformedRate a JSON response is cut short.
+    '''
+    fixtures:List[Tuple[dict, bytes]]
+    latency:float = 0.0
+    jitter:float = 0.0
+    errorRate:float = 0.0
+    malformedRate:float = 0.0
+    host:str = '127.0.0.1'
+    port:int = 0
+    seed:int = 0
+
+    # Log ID -> (fixture index, metadata served for it)
+    logs:Dict[str, Tuple[int, dict]] = field(init=False, default_factory=dict)
+
+    # Requests served per endpoint, and how many were failed on purpose
+    counts:Dict[str, int] = field(init=False, default_factory=dict)
+
+    server:ThreadingHTTPServer = field(init=False, default=None, repr=False)
+    lock:threading.Lock = field(init=False, default_factory=threading.Lock, repr=False)
+    rng:random.Random = field(init=False, default=None, repr=False)
+
+    @property
+    def baseUrl(self) -> str:
+        return 'http://{:s}:{:d}/'.format(self.host, self.server.server_address[1])
+
+    def start(self) -> str:
+        ''' Starts serving on a background thread and returns the base URL
+        '''
+        self.rng = random.Random(self.seed)
+
+        standIn = self
+
+        class handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                standIn._handle(self, 'GET')
+
+            def do_POST(self):
+                standIn._handle(self, 'POST')
+
+        self.server = ThreadingHTTPServer((self.host, self.port), handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        return self.baseUrl
+
+    def stop(self):
+        if (self.server is not None):
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def _count(self, key:str):
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def _roll(self) -> Tuple[float, bool, bool]:
+        ''' Returns (delay, fail, malform) for a request
+        '''
+        with self.lock:
+            delay = self.latency + (self.rng.random() * self.jitter)
+            fail = (self.rng.random() < self.errorRate)
+            malform = (self.rng.random() < self.malformedRate)
+
+        return (delay, fail, malform)
+
+    def _lookup(self, params:Dict[str, List[str]]) -> Tuple[int, dict]:
+        ''' Finds the log a request is for. Logs that weren't uploaded here still get a fixture, picked by ID,
+            so lists of real permalinks can be replayed against the stand-in
+        '''
+        if ('id' in params):
+            id = params['id'][0]
+        elif ('permalink' in params):
+            id = dpsReport.permalinkToId(params['permalink'][0])
+        else:
+            return None
+
+        with self.lock:
+            if (id not in self.logs):
+                index = zlib.crc32(id.encode()) % len(self.fixtures)
+                self.logs[id] = (index, self._metadata(index, id, self.fixtures[index][0]['encounterTime']))
+
+            return self.logs[id]
+
+    def _metadata(self, index:int, id:str, encounterTime:int) -> dict:
+        ''' The metadata of a fixture, served under a different ID and time
+        '''
+        metadata = dict(self.fixtures[index][0])
+        metadata['id'] = id
+        metadata['permalink'] = 'https://dps.report/{:s}'.format(id)
+        metadata['encounterTime'] = encounterTime
+        metadata['uploadTime'] = encounterTime + 600
+
+        return metadata
+
+    def _handle(self, request:BaseHTTPRequestHandler, method:str):
+        url = urlparse(request.path)
+        endpoint = url.path.strip('/')
+        params = parse_qs(url.query)
+
+        # Uploads need the body read before anything is sent back
+        if (method == 'POST'):
+            length = int(request.headers.get('Content-Length', 0))
+            request.rfile.read(length)
+
+        self._count(endpoint)
+
+        (delay, fail, malform) = self._roll()
+        if (delay > 0):
+            time.sleep(delay)
+
+        if (fail):
+            self._count('errors')
+            self._send(request, HTTPStatus.SERVICE_UNAVAILABLE, b'{"error": "stand-in failure"}', {'Retry-After': '0'})
+            return
+
+        if ((method == 'POST') and (endpoint == 'uploadContent')):
+            body = json.dumps(self._upload()).encode()
+        elif ((method == 'GET') and (endpoint == 'getUploadMetadata')):
+            log = self._lookup(params)
+            if (log is None):
+                self._send(request, HTTPStatus.BAD_REQUEST, b'{"error": "no id or permalink"}')
+                return
+            body = json.dumps(log[1]).encode()
+        elif ((method == 'GET') and (endpoint == 'getJson')):
+            log = self._lookup(params)
+            if (log is None):
+                self._send(request, HTTPStatus.BAD_REQUEST, b'{"error": "no id or permalink"}')
+                return
+            body = self.fixtures[log[0]][1]
+        elif ((method == 'GET') and (endpoint == 'getUploads')):
+            body = json.dumps(self._uploads(int(params.get('page', ['1'])[0]))).encode()
+        else:
+            self._send(request, HTTPStatus.NOT_FOUND, b'{"error": "unknown endpoint"}')
+            return
+
+        if (malform):
+            self._count('malformed')
+            body = body[:len(body) // 2]
+
+        self._send(request, HTTPStatus.OK, body)
+
+    def _upload(self) -> dict:
+        with self.lock:
+            n = len(self.logs)
+            index = n % len(self.fixtures)
+            id = 'standin-{:08d}_{:s}'.format(n, dpsReport.dpsReportIds.idToShortName(self.fixtures[index][0]['encounter']['bossId']))
+
+            # Keep the session moving forward in time, a few minutes per upload
+            encounterTime = self.fixtures[0][0]['encounterTime'] + (n * 300)
+
+            metadata = self._metadata(index, id, encounterTime)
+            self.logs[id] = (index, metadata)
+
+            return metadata
+
+    def _uploads(self, page:int, perPage:int=25) -> dict:
+        with self.lock:
+            uploads = [m for (_, m) in self.logs.values()]
+
+        pages = max(1, (len(uploads) + perPage - 1) // perPage)
+        start = (page - 1) * perPage
+
+        return {'pages': pages, 'totalUploads': len(uploads), 'uploads': uploads[start:start + perPage]}
+
+    @staticmethod
+    def _send(request:BaseHTTPRequestHandler, status:int, body:bytes, headers:Dict[str, str]={}):
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(body)))
+        for (k, v) in headers.items():
+            request.send_header(k, v)
+        request.end_headers()
+        request.wfile.write(body)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local dps.report stand-in for benchmarking')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every request')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Up to this many extra seconds, at random')
+    parser.add_argument('--error-rate', dest='errorRate', type=float, default=0.0, help='Fraction of requests that fail with a 503')
+    parser.add_argument('--malformed-rate', dest='malformedRate', type=float, default=0.0, help='Fraction of JSON responses cut short')
+    parser.add_argument('--fixtures', help='Directory of recorded <name>.meta.json / <name>.ei.json pairs')
+
+    args = parser.parse_args()
+
+    if (args.fixtures is not None):
+        responses = fixtures.loadRecorded(args.fixtures)
+    else:
+        responses = fixtures.makeFixtures()
+
+    server = standInServer(fixtures=responses, latency=args.latency, jitter=args.jitter, errorRate=args.errorRate,
+                           malformedRate=args.malformedRate, host=args.host, port=args.port)
+    print('Serving {:d} fixtures on {:s}'.format(len(responses), server.start()))
+
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        server.stop()
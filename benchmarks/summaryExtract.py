@@ -0,0 +1,69 @@
+'''
+Compares ways of getting the values posts need (duration, CM, target health, Emboldened, start and end times)
+out of a large Elite Insights JSON. Run from the repository root:
+
+    python benchmarks/summaryExtract.py [iterations]
+
+'separate walks' is how logUtils used to read the loaded JSON, one walk per value. 'fromDict' visits the
+loaded JSON once. 'fromJson' reduces the raw bytes while they are decoded, and is compared against decoding
+the whole tree first.
+'''
+from datetime import datetime
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import dpsReport
+import fixtures
+
+def separateWalks(data:dict) -> tuple:
+    duration = data['duration']
+    durationMs = int(duration[7:-2]) + (1000 * int(duration[4:6])) + (60 * 1000 * int(duration[:2]))
+
+    health = [100.0 - t['healthPercentBurned'] for t in data['targets'] if (t['id'] >= 0) and (t['id'] in (15438, ))]
+
+    emboldened = 0
+    for player in data['players']:
+        try:
+            if (player['friendlyNPC']):
+                continue
+        except:
+            continue
+
+        for buff in player['buffUptimes']:
+            if (buff['id'] != dpsReport.emboldenedID):
+                continue
+
+            for phase in buff['buffData']:
+                if (phase['uptime'] > emboldened):
+                    emboldened = phase['uptime']
+
+    return (durationMs, data['isCM'], health, round(emboldened),
+            datetime.fromisoformat(data['timeStartStd']), datetime.fromisoformat(data['timeEndStd']))
+
+def bench(name:str, func, iterations:int):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = (time.perf_counter() - start) / iterations
+
+    print('{:<28s} {:9.3f} ms'.format(name, elapsed * 1000))
+
+if __name__ == '__main__':
+    iterations = int(sys.argv[1]) if (len(sys.argv) > 1) else 20
+
+    data = fixtures.makeLog(random.Random(0))
+    raw = json.dumps(data).encode()
+    print('EI JSON: {:.1f} MiB'.format(len(raw) / (1024 * 1024)))
+
+    print('Loaded JSON:')
+    bench('  separate walks', lambda: separateWalks(data), iterations)
+    bench('  logSummary.fromDict', lambda: dpsReport.logSummary.fromDict(data), iterations)
+
+    print('Raw bytes:')
+    bench('  json.loads + walks', lambda: separateWalks(json.loads(raw)), max(1, iterations // 10))
+    bench('  logSummary.fromJson', lambda: dpsReport.logSummary.fromJson(raw), max(1, iterations // 10))
@@ -1,15 +1,21 @@
-from concurrent.futures import as_completed
+import aiohttp
+import asyncio
 from dataclasses import dataclass,field
 from http import HTTPStatus
 from logging import exception
-from typing import Any,List
-import requests
-from requests_futures.sessions import FuturesSession
-from requests.adapters import HTTPAdapter
-from urllib3 import Retry
+from types import MappingProxyType
+from typing import Any,FrozenSet,List,Tuple
 
+from datetime import datetime
+import json
+import os
+import sys
 import time
 
+import aimdLimiter
+import dpsReportCache
+import metrics
+
 '''
 Mapping of boss IDs used in the logs to various other names for arcDPS outputs.
 
@@ -318,24 +324,200 @@ targetIdMap = {
     }
 }
 
+'''
+Reverse lookups into targetIdMap, built once at import so every lookup is a single dictionary access.
+
+bossNames is the name of the boss for each ID. The arcDPS folder names are the in-game names of the bosses, so
+where an encounter has one folder per ID (IE: Bandit Trio) each ID gets its own folder name, otherwise all the
+IDs use the first folder name. bossNameToIdIndex goes the other way and also accepts the pretty names.
+'''
+def _buildIndexes():
+    folderNames = {}
+    ids = {}
+    names = {}
+    nameToId = {}
+    shortNameBossNames = {}
+
+    for (shortName, values) in targetIdMap.items():
+        for folderName in values['FolderNames']:
+            folderNames[folderName] = shortName
+
+        for (idx, id) in enumerate(values['IDs']):
+            ids[id] = shortName
+
+            if (idx < len(values['FolderNames'])):
+                names[id] = values['FolderNames'][idx]
+            else:
+                names[id] = values['FolderNames'][0]
+
+            nameToId.setdefault(names[id], id)
+
+        nameToId.setdefault(values['PrettyName'], values['IDs'][0])
+
+        shortNameBossNames[shortName] = frozenset(values['FolderNames'] + [values['PrettyName']])
+
+    return (MappingProxyType(folderNames), MappingProxyType(ids), MappingProxyType(names),
+            MappingProxyType(nameToId), MappingProxyType(shortNameBossNames))
+
+(folderNameIndex, idIndex, bossNames, bossNameToIdIndex, shortNameToBossNamesIndex) = _buildIndexes()
+
 '''
 Buff ID of Emboldened
 '''
 emboldenedID = 68087
 
-@dataclass
+class logSummary():
+    ''' The handful of values we actually need out of an Elite Insights JSON.
+
+        The raw JSON for a long fight is many megabytes, so rather than keeping it around for every log in a
+        session, it is reduced to this object while it is being decoded. See logSummary.fromJson.
+
+        duration   = Accurate encounter duration in milliseconds
+        isCm       = If the encounter was a CM
+        targets    = Tuple of (target ID, healthPercentBurned) in the order they are in the log
+        emboldened = Max Emboldened stacks seen on any player in any phase
+        timeStart  = Start time of the encounter
+        timeEnd    = End time of the encounter
+        players    = Tuple of the account names of the squad, without NPCs
+    '''
+    __slots__ = ('duration', 'isCm', 'targets', 'emboldened', 'timeStart', 'timeEnd', 'players')
+
+    def __init__(self, duration:int, isCm:bool, targets:tuple, emboldened:int, timeStart:datetime, timeEnd:datetime,
+                 players:tuple=()):
+        self.duration = duration
+        self.isCm = isCm
+        self.targets = targets
+        self.emboldened = emboldened
+        self.timeStart = timeStart
+        self.timeEnd = timeEnd
+        self.players = players
+
+    def __repr__(self):
+        return 'logSummary(duration={}, isCm={}, targets={}, emboldened={}, timeStart={}, timeEnd={}, players={})'.format(
+            self.duration, self.isCm, self.targets, self.emboldened, self.timeStart, self.timeEnd, self.players)
+
+    @staticmethod
+    def _reduce(obj:dict):
+        ''' JSON object hook that collapses every object to the part of it we need as soon as it is decoded.
+
+            The decoder builds objects from the inside out, so by the time a player or the top level object is
+            seen, all of its children have already been reduced. Anything we don't recognize becomes None, which
+            lets the decoder drop the bulk of the log (damage arrays, rotations, mechanics...) as it goes rather
+            than building the whole tree first.
+        '''
+        # Phase entry of a buff uptime
+        if ('uptime' in obj):
+            return obj['uptime']
+
+        # Buff uptime, only Emboldened is kept as the max uptime over all phases
+        if (('buffData' in obj) and ('id' in obj)):
+            if (obj['id'] != emboldenedID):
+                return None
+
+            uptimes = [x for x in obj['buffData'] if x is not None]
+            return max(uptimes, default=0)
+
+        # Player, reduced to (friendlyNPC, max Emboldened stacks, account). Older logs don't have the
+        # friendlyNPC field at all, which is kept as None so those players can be skipped
+        if ('buffUptimes' in obj):
+            stacks = [x for x in obj['buffUptimes'] if x is not None]
+            return (obj.get('friendlyNPC', None), max(stacks, default=0), obj.get('account', None))
+
+        # Target
+        if ('healthPercentBurned' in obj):
+            return (obj['id'], obj['healthPercentBurned'])
+
+        # Top level object
+        if (('targets' in obj) and ('players' in obj) and ('duration' in obj)):
+            return logSummary._fromReduced(obj)
+
+        return None
+
+    @classmethod
+    def _fromReduced(cls, obj:dict):
+        # Encounter time is a string, so parse it out of the JSON
+        # There is technically a durationMS in newer logs, but we'll stick to the old method
+        duration = obj['duration']
+        mins = int(duration[:2])
+        secs = int(duration[4:6])
+        ms   = int(duration[7:-2])
+
+        # Max Emboldened stacks over all players, skipping NPCs
+        emboldened = 0
+        players = []
+        for (friendlyNPC, stacks, account) in obj['players']:
+            if ((friendlyNPC is None) or friendlyNPC):
+                continue
+
+            emboldened = max(emboldened, stacks)
+            if (account is not None):
+                players.append(sys.intern(account))
+
+        # Targets missing the health field were reduced to None by the hook, so skip them
+        targets = tuple(t for t in obj['targets'] if isinstance(t, tuple))
+
+        # Try to fast way first, older logs don't have the standard field so we need to fix them up a bit
+        if (('timeStartStd' in obj) and ('timeEndStd' in obj)):
+            timeStart = datetime.fromisoformat(obj['timeStartStd'])
+            timeEnd = datetime.fromisoformat(obj['timeEndStd'])
+        else:
+            timeStart = datetime.fromisoformat(obj['timeStart'] + ':00')
+            timeEnd = datetime.fromisoformat(obj['timeEnd'] + ':00')
+
+        return cls(duration  = ms + (1000*secs) + (60*1000*mins),
+                   isCm      = obj['isCM'],
+                   targets   = targets,
+                   # Sometimes Emboldened stacks are not quite integers even though they should be
+                   emboldened = round(emboldened),
+                   timeStart = timeStart,
+                   timeEnd   = timeEnd,
+                   players   = tuple(players))
+
+    @classmethod
+    def fromDict(cls, data:dict):
+        ''' Builds the summary from an EI JSON that has already been decoded, IE: by getJson. Each player's buffs
+            are walked once, stopping at Emboldened, instead of once per value that's needed.
+        '''
+        players = []
+        for player in data['players']:
+            stacks = 0
+            for buff in player.get('buffUptimes', ()):
+                if (buff['id'] == emboldenedID):
+                    stacks = max((phase['uptime'] for phase in buff['buffData']), default=0)
+                    break
+
+            players.append((player.get('friendlyNPC', None), stacks, player.get('account', None)))
+
+        targets = [(t['id'], t['healthPercentBurned']) for t in data['targets'] if ('healthPercentBurned' in t)]
+
+        return cls._fromReduced(dict(data, players=players, targets=targets))
+
+    @classmethod
+    def fromJson(cls, data:bytes):
+        ''' Decodes a raw Elite Insights JSON straight into a summary without materializing the full tree.
+
+            Raises a ValueError if the data is not a valid EI JSON.
+        '''
+        summary = json.loads(data, object_hook=cls._reduce)
+
+        if (not isinstance(summary, cls)):
+            raise ValueError('Data is not an Elite Insights JSON')
+
+        return summary
+
+@dataclass(slots=True)
 class dpsReportObjEtvc():
     version: str = ''
     bossId: int = -1
 
-@dataclass
+@dataclass(slots=True)
 class dpsReportObjPlayer():
     displayName: str
     charName: str
     profession: int
     eliteSpec: int
 
-@dataclass
+@dataclass(slots=True)
 class dpsReportObjEncounter():
     uniqueId: str = ''
     success: bool = False
@@ -358,7 +540,11 @@ class dpsReportObjEncounter():
     # that this gets filled from another method, this allows us to shortcut needing to load a JSON
     accurateDuration: int = None
 
-@dataclass
+    # This field isn't in the API. It holds the compact summary of the EI output, which is what
+    # is normally fetched instead of keeping the full json around
+    summary: logSummary = None
+
+@dataclass(slots=True)
 class dpsReportObj():
     id: str = None
     permalink: str = ''
@@ -370,60 +556,263 @@ class dpsReportObj():
     language: str = ''
     languageId: int = -1
     etvc: dpsReportObjEtvc = field(default_factory=dpsReportObjEtvc)
-    players: List[dpsReportObjPlayer] = field(default_factory=list)
     encounter: dpsReportObjEncounter = field(default_factory=dpsReportObjEncounter)
 
+    # The players as (displayName, charName, profession, eliteSpec) tuples. Hardly anything looks at the
+    # players, so they're only turned into dpsReportObjPlayer the first time players is used
+    rawPlayers: Tuple[Tuple[str, str, int, int], ...] = field(default=(), repr=False)
+    _players: List[dpsReportObjPlayer] = field(init=False, default=None, repr=False)
+
     def __post_init__(self):
         if (self.id is None):
-            # Remove the first part of the URL
-            idStr = self.permalink.removeprefix('https://dps.report/')
+            self.id = permalinkToId(self.permalink)
+
+    @property
+    def players(self) -> List[dpsReportObjPlayer]:
+        if (self._players is None):
+            self._players = [dpsReportObjPlayer(*p) for p in self.rawPlayers]
+            self.rawPlayers = ()
+
+        return self._players
+
+def permalinkToId(permalink:str) -> str:
+    ''' Converts a dps.report permalink to the ID of the log
+    '''
+    # Remove the first part of the URL
+    idStr = permalink.removeprefix('https://dps.report/')
+
+    suffixLoc = idStr.rfind('_')
+    return idStr[:suffixLoc]
 
-            suffixLoc = idStr.rfind('_')
-            self.id = idStr[:suffixLoc]
+class dpsReportError(Exception):
+    ''' Raised when dps.report returns an error status that couldn't be resolved by retrying
+    '''
+    def __init__(self, status:int, url:str):
+        super().__init__('dps.report returned {:d} for {:s}'.format(status, url))
+        self.status = status
+        self.url = url
 
 class dpsReport():
-    def __init__(self, token:str=None):
-        self.baseUrl = 'https://dps.report/'
+    def __init__(self, token:str=None, cacheDir:str='cache', cacheMaxBytes:int=1024*1024*1024,
+                 maxConcurrency:int=16, maxConnections:int=16, baseUrl:str='https://dps.report/',
+                 runMetrics:metrics.runMetrics=None):
+        # Can be pointed somewhere else, IE: the stand-in server in benchmarks/standin.py
+        self.baseUrl = baseUrl
+
+        # Request latencies, byte counts, retries and cache hits are recorded here. Pass one in to share it with
+        # the rest of the run
+        self.metrics = runMetrics if (runMetrics is not None) else metrics.runMetrics()
 
         # User Settings
         self.token = token
 
-        # This sets the maximum retries the underlying requests library will attempt for any error
+        # The EI JSONs are large and never change for a given log and generator version, so keep them on disk.
+        # Uploaded files are also tracked there so the same file is never uploaded twice, as is the metadata of
+        # every link that has been looked up. Setting cacheDir to None disables all three.
+        if (cacheDir is not None):
+            self.jsonCache = dpsReportCache.jsonCache(directory=os.path.join(cacheDir, 'ei'), maxBytes=cacheMaxBytes)
+            self.ledger = dpsReportCache.uploadLedger(filename=os.path.join(cacheDir, 'uploads.db'))
+            self.metadataCache = dpsReportCache.metadataCache(filename=os.path.join(cacheDir, 'metadata.db'))
+        else:
+            self.jsonCache = None
+            self.ledger = None
+            self.metadataCache = None
+
+        # This sets the maximum retries for a malformed JSON response
         self.maxRetries = 3
 
-        # From others testing it seems that 4 is around what the dpsReport servers will take safely
-        self.maxThreads = 1
-
-        self.retry = Retry(total=5,
-                           backoff_factor=10,
-                           respect_retry_after_header=True,
-                           status_forcelist=[HTTPStatus.REQUEST_TIMEOUT,        # 408
-                                              HTTPStatus.CONFLICT,              # 409
-                                              HTTPStatus.TOO_MANY_REQUESTS,     # 429
-                                              HTTPStatus.INTERNAL_SERVER_ERROR, # 500
-                                              HTTPStatus.BAD_GATEWAY,           # 502
-                                              HTTPStatus.SERVICE_UNAVAILABLE,   # 503
-                                              HTTPStatus.GATEWAY_TIMEOUT])      # 504
-        # Create a requests session since the dpsReport server occasionally fails, especially if we pack
-        # too many requests in a row. This allows us to automatically retry with the library
-        self.session = FuturesSession(max_workers=self.maxThreads)
-        self.session.mount('https://', adapter=HTTPAdapter(max_retries=self.retry))
+        # From others testing it seems that 4 is around what the dpsReport servers will take safely, but that
+        # changes with server load. Rather than hardcoding it, the number of requests in flight is adjusted at
+        # runtime (see aimdLimiter) between 1 and maxConcurrency. The learned limit is kept between runs.
+        self.maxConcurrency = maxConcurrency
+        self.maxConnections = maxConnections
+
+        if (cacheDir is not None):
+            stateFile = os.path.join(cacheDir, 'concurrency.json')
+        else:
+            stateFile = None
+
+        self.limiter = aimdLimiter.aimdLimiter(maxLimit=maxConcurrency, stateFile=stateFile)
+
+        # The dpsReport server occasionally fails, especially if we pack too many requests in a row.
+        # These statuses are retried with a backoff, honoring the Retry-After header if it is sent. They also
+        # tell the limiter to back off, so the backoff here only needs to be short
+        self.retryTotal = 5
+        self.backoffFactor = 1
+        self.maxBackoff = 30
+        self.retryStatuses = {HTTPStatus.REQUEST_TIMEOUT,        # 408
+                              HTTPStatus.CONFLICT,               # 409
+                              HTTPStatus.TOO_MANY_REQUESTS,      # 429
+                              HTTPStatus.INTERNAL_SERVER_ERROR,  # 500
+                              HTTPStatus.BAD_GATEWAY,            # 502
+                              HTTPStatus.SERVICE_UNAVAILABLE,    # 503
+                              HTTPStatus.GATEWAY_TIMEOUT}        # 504
+
+        # All requests run on this event loop. Anyone else that needs to do async work alongside the
+        # client (IE: posting to the webhook) should use run() so everything shares the one loop
+        self.loop = asyncio.new_event_loop()
+
+        # Created on first use, since it needs to be made from within the event loop
+        self.session = None
+
+    def run(self, coro):
+        ''' Runs a coroutine to completion on the client's event loop
+        '''
+        return self.loop.run_until_complete(coro)
+
+    async def getSession(self) -> aiohttp.ClientSession:
+        ''' Returns the shared HTTP session, creating it if needed
+        '''
+        if (self.session is None):
+            connector = aiohttp.TCPConnector(limit=self.maxConnections)
+            timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=300)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+        return self.session
+
+    def close(self):
+        ''' Closes the HTTP session and the event loop, and stores the learned concurrency limit
+        '''
+        self.limiter.save()
+
+        if (self.ledger is not None):
+            self.ledger.close()
+
+        if (self.metadataCache is not None):
+            self.metadataCache.close()
+
+        if (self.session is not None):
+            self.run(self.session.close())
+            self.session = None
+
+        self.loop.close()
+
+    @staticmethod
+    def _parseRetryAfter(retryAfter:str) -> float:
+        ''' Converts a Retry-After header to seconds. Only the delay-seconds form is handled, an HTTP date
+            returns None and falls back to the normal backoff
+        '''
+        if (retryAfter is None):
+            return None
+
+        try:
+            return max(0.0, float(retryAfter))
+        except ValueError:
+            return None
+
+    def _retryDelay(self, attempt:int, retryAfter:float=None) -> float:
+        ''' How long to wait before the next attempt of a request
+        '''
+        if (retryAfter is not None):
+            return retryAfter
+
+        return min(self.maxBackoff, self.backoffFactor * (2 ** attempt))
+
+    async def _request(self, method:str, endpoint:str, params:dict=None, filePath:str=None) -> Tuple[int, bytes]:
+        ''' Performs a single request against dps.report, retrying on the statuses in retryStatuses and on
+            connection errors. Returns the final status and the response body.
+
+            If a filePath is given, it is sent as the multipart file. The file is only opened while the request
+            is in flight.
+        '''
+        session = await self.getSession()
+        url = self.baseUrl + endpoint
+
+        sentBytes = os.path.getsize(filePath) if (filePath is not None) else 0
+
+        attempt = 0
+        while True:
+            status = None
+            retryAfter = None
+            error = None
+
+            token = await self.limiter.acquire()
+            startTime = time.perf_counter()
+            try:
+                try:
+                    if (filePath is not None):
+                        with open(filePath, mode='rb') as logFile:
+                            data = aiohttp.FormData()
+                            data.add_field('file', logFile, filename=os.path.basename(filePath))
+
+                            async with session.request(method, url, params=params, data=data) as r:
+                                status = r.status
+                                body = await r.read()
+                                retryAfter = r.headers.get('Retry-After')
+                    else:
+                        async with session.request(method, url, params=params) as r:
+                            status = r.status
+                            body = await r.read()
+                            retryAfter = r.headers.get('Retry-After')
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    error = e
+            finally:
+                retryAfter = self._parseRetryAfter(retryAfter)
+                congested = (error is not None) or (status in self.retryStatuses)
+                await self.limiter.release(token, congested=congested, retryAfter=retryAfter)
+
+                result = str(status) if (status is not None) else 'error'
+                self.metrics.observe('dpsreport_request_seconds', time.perf_counter() - startTime, endpoint=endpoint, status=result)
+                if (sentBytes > 0):
+                    self.metrics.inc('dpsreport_sent_bytes_total', sentBytes, endpoint=endpoint)
+                if (status is not None):
+                    self.metrics.inc('dpsreport_received_bytes_total', len(body), endpoint=endpoint)
+
+            # Back off outside of the limiter so other requests can use the slot in the meantime
+            if (error is not None):
+                if (attempt >= self.retryTotal):
+                    raise error
+
+                print('Request to {:s} failed ({}), retrying'.format(url, error))
+                self.metrics.inc('dpsreport_retries_total', endpoint=endpoint, reason='error')
+                await asyncio.sleep(self._retryDelay(attempt))
+                attempt += 1
+                continue
+
+            if ((status not in self.retryStatuses) or (attempt >= self.retryTotal)):
+                return (status, body)
+
+            print('Request to {:s} got {:d}, retrying'.format(url, status))
+            self.metrics.inc('dpsreport_retries_total', endpoint=endpoint, reason=str(status))
+            await asyncio.sleep(self._retryDelay(attempt, retryAfter))
+            attempt += 1
+
+    async def _requestJson(self, endpoint:str, params:dict, parse, retries:int=None):
+        ''' Requests a JSON document and hands the body to parse. Sometimes the JSON gets corrupted, in which
+            case parse should raise a ValueError and the request is tried again, up to retries times. If
+            retries is None, it will keep trying until it succeeds.
+
+            Returns None if all the retries were used up.
+        '''
+        retryCnt = 0
+        while ((retries is None) or (retryCnt < retries)):
+            (status, body) = await self._request('GET', endpoint, params=params)
+
+            # Make sure we were successful
+            if (status != HTTPStatus.OK):
+                raise dpsReportError(status, self.baseUrl + endpoint)
+
+            try:
+                return parse(body)
+            except ValueError:
+                print('JSON malformed, trying again for {}'.format(params))
+                self.metrics.inc('dpsreport_malformed_json_total', endpoint=endpoint)
+                retryCnt += 1
+
+            await asyncio.sleep(self._retryDelay(retryCnt - 1))
+
+        return None
 
     def jsonToObject(self, json):
         ##### Parse Players
-        playerObjs = []
-        for player in json['players'].values():
-            p = dpsReportObjPlayer(
-                displayName = player['display_name'],
-                charName = player['character_name'],
-                profession = player['profession'],
-                eliteSpec = player['elite_spec']
-            )
-            playerObjs.append(p)
+        # Account and character names repeat across a history, so only one copy of each is kept
+        rawPlayers = tuple((sys.intern(player['display_name']), sys.intern(player['character_name']),
+                            player['profession'], player['elite_spec'])
+                           for player in json['players'].values())
 
         ##### Parse ETVC
         etvcObj = dpsReportObjEtvc(
-            version = json['evtc']['version'],
+            version = sys.intern(json['evtc']['version']),
             bossId  = json['evtc']['bossId']
         )
 
@@ -443,7 +832,7 @@ class dpsReport():
             numberOfPlayers = json['encounter']['numberOfPlayers'],
             numberOfGroups = json['encounter']['numberOfGroups'],
             bossId = json['encounter']['bossId'],
-            boss = json['encounter']['boss'],
+            boss = sys.intern(json['encounter']['boss']),
             isCm = isCm,
             gw2Build = json['encounter']['gw2Build'],
             jsonAvailable = json['encounter']['jsonAvailable']
@@ -455,21 +844,41 @@ class dpsReport():
             permalink = json['permalink'],
             uploadTime = json['uploadTime'],
             encounterTime = json['encounterTime'],
-            generator = json['generator'],
+            generator = sys.intern(json['generator']),
             generatorId = json['generatorId'],
             generatorVersion = json['generatorVersion'],
-            language = json['language'],
+            language = sys.intern(json['language']),
             languageId = json['languageId'],
             etvc = etvcObj,
-            players = playerObjs,
-            encounter = encounterObj
+            encounter = encounterObj,
+            rawPlayers = rawPlayers
         )
 
         return rtnObj
 
-    def uploadLogs(self, logs:list[str]) -> list[tuple[str, dpsReportObj]]:
-        """ Uploads a log. Optionally attaches a userToken to it for tracking
+    async def uploadLogAsync(self, log:str) -> dpsReportObj:
+        """ Uploads a single log. Returns None if dps.report rejected it (IE: too short). If the upload didn't
+            get through at all, a dpsReportError (or the connection error) is raised instead, since trying again
+            later may work.
+
+            If the same file has been uploaded before, the stored result from the ledger is returned
+            instead of uploading it again.
         """
+        # Check if this exact file was already uploaded. Hashing is done off the loop since logs can be large
+        if (self.ledger is not None):
+            key = await asyncio.to_thread(dpsReportCache.uploadLedger.hashFile, log)
+            previous = self.ledger.lookup(key)
+
+            if (previous is not None):
+                (status, response) = previous
+                print('Already uploaded {:s}'.format(log))
+                self.metrics.inc('upload_ledger_hits_total')
+
+                if (status != HTTPStatus.OK):
+                    print('Log {:s} got an error code {}'.format(log, status))
+                    return None
+
+                return self.jsonToObject(json.loads(response))
 
         # dps.report recommends we always set this so the response is JSON formatted
         params = {'json': 1}
@@ -478,48 +887,70 @@ class dpsReport():
         if (self.token is not None):
             params['userToken'] = self.token
 
-        # Rate trackers
-        startTime = time.perf_counter()
+        # A malformed response means the upload went through but the reply got cut off. dps.report hands back the
+        # same log for the same file, so it is safe to upload it again
+        for attempt in range(self.maxRetries):
+            print('Queued {:s}'.format(log))
+            (status, body) = await self._request('POST', 'uploadContent', params=params, filePath=log)
+            print('Finished {:s}'.format(log))
+
+            # Check what the error was
+            if (status != HTTPStatus.OK):
+                print('Log {:s} got an error code {}'.format(log, status))
 
-        # Response List
-        futures = []
+                # Client errors mean dps.report looked at the log and refused it (IE: too short), so it
+                # would be refused again next time. Anything else may just be a bad moment for the server
+                if ((400 <= status < 500) and (status not in self.retryStatuses)):
+                    if (self.ledger is not None):
+                        self.ledger.record(key, path=log, status=status, response=None)
 
-        # Open logfile and transmit it
-        for l in logs:
-            logFile = open(l, mode='rb')
-            future = self.session.post(self.baseUrl + 'uploadContent', params=params, files={'file': logFile})
-            future.origFile = l
-            future.logFile = logFile
-            futures.append(future)
-            print('Queued {:s}'.format(l))
+                    return None
 
-        # Collect the finished logs as we get them
-        uploadedLogs = []
-        for future in as_completed(futures):
-            r = future.result()
-            print('Finished {:s}'.format(future.origFile))
+                raise dpsReportError(status, self.baseUrl + 'uploadContent')
 
-            # Close the file handle
-            future.logFile.close()
+            try:
+                obj = self.jsonToObject(json.loads(body))
+                break
+            except ValueError:
+                print('JSON malformed, trying again for {:s}'.format(log))
+                self.metrics.inc('dpsreport_malformed_json_total', endpoint='uploadContent')
+        else:
+            print('Log {:s} upload response was malformed {:d} times'.format(log, self.maxRetries))
+            raise dpsReportError(status, self.baseUrl + 'uploadContent')
 
-            # Check what the error was
-            if (r.status_code != requests.codes['ok']):
-                print('Log {:s} got an error code {}'.format(future.origFile, r.status_code))
-                uploadedLogs.append((future.origFile, None))
-                continue
+        if (self.ledger is not None):
+            self.ledger.record(key, path=log, status=status, response=body.decode())
 
-            uploadedLogs.append((future.origFile, self.jsonToObject(r.json())))
+        # The upload response is the same metadata getUploadMetadata would return for the permalink
+        if (self.metadataCache is not None):
+            self.metadataCache.record([(obj.permalink, body.decode())])
 
-        endTime = time.perf_counter()
-        print('Upload Total Time: {}'.format(endTime - startTime))
+        return obj
 
-        return uploadedLogs
+    async def uploadLogsAsync(self, logs:list[str]) -> list[tuple[str, dpsReportObj]]:
+        """ Uploads a list of logs, as many at a time as the limiter allows. Logs that were rejected or couldn't
+            be uploaded are returned as None
+        """
+        async def upload(log:str) -> dpsReportObj:
+            try:
+                return await self.uploadLogAsync(log)
+            except (dpsReportError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print('Log {:s} failed to upload: {}'.format(log, e))
+                return None
 
-    def getUploadMetaData(self, identifier:str, isId:bool=False) -> dpsReportObj:
-        """ Gets a previous encounter's meta data
-            The identifier can either be the ID or the permalink, both are fairly similar.
-            By default, the function assumes the identifier is the permalink. To treat it
-            as an ID, you must set isId to true.
+        with self.metrics.span('upload'):
+            results = await asyncio.gather(*[upload(l) for l in logs])
+
+        return list(zip(logs, results))
+
+    def uploadLogs(self, logs:list[str]) -> list[tuple[str, dpsReportObj]]:
+        """ Uploads a log. Optionally attaches a userToken to it for tracking
+        """
+        return self.run(self.uploadLogsAsync(logs))
+
+    async def getUploadMetaDataAsync(self, identifier:str, isId:bool=False, retries:int=None) -> dpsReportObj:
+        """ Async version of getUploadMetaData. Malformed JSON is retried up to retries times, maxRetries if
+            retries is None. Returns None if every try was malformed
         """
         # Select the right identifier
         if (isId):
@@ -527,165 +958,231 @@ class dpsReport():
         else:
             params = {'permalink': identifier}
 
-        # Get the data
-        retryCnt = 0
-        while (retryCnt < self.maxRetries):
-            # Queue the Request
-            future = self.session.get(self.baseUrl + 'getUploadMetadata', params=params)
+        if (retries is None):
+            retries = self.maxRetries
 
-            # Wait for response
-            r = future.result()
+        return await self._requestJson('getUploadMetadata', params, parse=lambda b: self.jsonToObject(json.loads(b)),
+                                       retries=retries)
 
-            # Make sure we were successful
-            r.raise_for_status()
+    def getUploadMetaData(self, identifier:str, isId:bool=False) -> dpsReportObj:
+        """ Gets a previous encounter's meta data
+            The identifier can either be the ID or the permalink, both are fairly similar.
+            By default, the function assumes the identifier is the permalink. To treat it
+            as an ID, you must set isId to true.
+        """
+        return self.run(self.getUploadMetaDataAsync(identifier, isId=isId))
 
-            # Sometimes the JSON gets corrupted, in which case we should try again
-            try:
-                respJson = r.json()
-            except:
-                retryCnt+=1
-                continue
+    async def getUploadMetaDatasAsync(self, identifiers:list[str], isId:bool=False) -> list[dpsReportObj]:
+        """ Async version of getUploadMetaDatas
+        """
+        results = {}
 
-            return self.jsonToObject(respJson)
+        # Anything looked up before comes straight from the cache
+        if (self.metadataCache is not None):
+            for (identifier, response) in self.metadataCache.lookup(identifiers).items():
+                results[identifier] = self.jsonToObject(json.loads(response))
 
-    def getUploadMetaDatas(self, identifiers:list[str], isId:bool=False) -> list[dpsReportObj]:
-        """ Gets a previous encounter's meta data. Similar to getUploadMetaData, but
-            takes a list of logs to grab instead of a single one.
-            The identifiers can either be the ID or the permalink, both are fairly similar.
-            By default, the function assumes the identifier is the permalink. To treat it
-            as an ID, you must set idId to true. All identifiers must be the same type.
-        """
+            self.metrics.inc('metadata_cache_hits_total', len(results))
+
+        fetched = []
 
-        startTime = time.perf_counter()
+        async def fetch(identifier:str):
+            print('Queued {:s}'.format(identifier))
 
-        # Loop until the requestsList is empty. Ideally the list gets emptied the first time around,
-        # but incase the JSON gets corrupted, we will try again
-        requestsList = identifiers
-        resultsList = []
-        while (requestsList):
-            # Response List
-            futures = []
+            if (isId):
+                params = {'id': identifier}
+            else:
+                params = {'permalink': identifier}
 
-            # Queue up the requests
-            for request in requestsList:
-                # Select the right identifier
-                if (isId):
-                    params = {'id': request}
-                else:
-                    params = {'permalink': request}
+            def parse(body:bytes) -> dpsReportObj:
+                obj = self.jsonToObject(json.loads(body))
+                fetched.append((identifier, body.decode()))
+                return obj
 
-                future = self.session.get(self.baseUrl + 'getUploadMetadata', params=params)
-                future.id = request
-                futures.append(future)
-                print('Queued {:s}'.format(request))
+            try:
+                obj = await self._requestJson('getUploadMetadata', params, parse=parse, retries=self.maxRetries)
+            except dpsReportError as e:
+                print('Metadata for {:s} could not be fetched: {}'.format(identifier, e))
+                obj = None
 
-            # Clear the request list
-            requestsList = []
+            if (obj is None):
+                print('Skipping {:s}'.format(identifier))
+            else:
+                print('Finished {:s}'.format(identifier))
 
-            # Collect the completed tasks
-            for future in as_completed(futures):
-                r = future.result()
+            results[identifier] = obj
 
-                try:
-                    respJson = r.json()
-                except:
-                    requestsList.append(future.id)
-                    print('JSON malformed, trying again for {:s}'.format(future.id))
-                    continue
+        # Only the links we haven't seen go out to dps.report, as many at a time as the limiter allows
+        missing = [i for i in dict.fromkeys(identifiers) if i not in results]
+        if (len(missing) > 0):
+            self.metrics.inc('metadata_cache_misses_total', len(missing))
 
-                resultsList.append(self.jsonToObject(respJson))
-                print('Finished {:s}'.format(future.id))
+            with self.metrics.span('fetch metadata'):
+                await asyncio.gather(*[fetch(i) for i in missing])
 
-        endTime = time.perf_counter()
-        print('Fetch Metadata Total Time: {}'.format(endTime - startTime))
-        return resultsList
+            if ((self.metadataCache is not None) and (len(fetched) > 0)):
+                self.metadataCache.record(fetched)
 
-    def getJson(self, id:str=None, link:str=None) -> dict:
-        """ Gets a previous encounter's raw data
+        return [results[i] for i in identifiers]
+
+    def getUploadMetaDatas(self, identifiers:list[str], isId:bool=False) -> list[dpsReportObj]:
+        """ Gets a previous encounter's meta data. Similar to getUploadMetaData, but
+            takes a list of logs to grab instead of a single one.
+            The identifiers can either be the ID or the permalink, both are fairly similar.
+            By default, the function assumes the identifier is the permalink. To treat it
+            as an ID, you must set idId to true. All identifiers must be the same type.
+            Identifiers that couldn't be resolved come back as None.
+        """
+        return self.run(self.getUploadMetaDatasAsync(identifiers, isId=isId))
+
+    async def getJsonAsync(self, id:str=None, link:str=None, generatorVersion:int=-1) -> dict:
+        """ Async version of getJson
         """
         # Make sure we got at least one identifier
         if (id is not None):
             params = {'id': id}
         elif (link is not None):
             params = {'permalink': link}
+            id = permalinkToId(link)
         else:
             raise ValueError('Must pass either ID or Permalink to lookup metadata')
 
-        # Get the data
-        retryCnt = 0
-        while (retryCnt < self.maxRetries):
-            # Queue Request
-            future = self.session.get(self.baseUrl + 'getJson', params=params)
+        # Check the cache before going out to the network
+        if (self.jsonCache is not None):
+            data = self.jsonCache.get(id, generatorVersion)
+            if (data is not None):
+                self.metrics.inc('json_cache_hits_total')
+                return json.loads(data)
 
-            # Wait for response
-            r = future.result()
+            self.metrics.inc('json_cache_misses_total')
 
-            # Make sure we were successful
-            r.raise_for_status()
+        def parse(body:bytes):
+            respJson = json.loads(body)
 
-            # Sometimes the JSON gets corrupted, in which case we should try again
-            try:
-                respJson = r.json()
-            except:
-                retryCnt+=1
-                continue
+            if (self.jsonCache is not None):
+                self.jsonCache.put(id, max(generatorVersion, 0), body)
 
-            # This is Elite Insights output, so we just pass this as it
             return respJson
 
-    def getJsons(self, logs:list[dpsReportObj]):
-        """ Given a list of dpsReportObjs, fill in their JSON field with the EI raw JSON
+        # This is Elite Insights output, so we just pass this as it
+        return await self._requestJson('getJson', params, parse=parse, retries=self.maxRetries)
+
+    def getJson(self, id:str=None, link:str=None, generatorVersion:int=-1) -> dict:
+        """ Gets a previous encounter's raw data
+            If the generatorVersion is known, it is used to make sure a cached copy matches the
+            parse on dps.report. Otherwise any cached copy of the log is used.
         """
-        startTime = time.perf_counter()
-
-        # Loop until the requestsList is empty. Ideally the list gets emptied the first time around,
-        # but incase the JSON gets corrupted, we will try again
-        requestsList = logs
-        while (requestsList):
-            # Response List
-            futures = []
-
-            # Queue up the requests
-            for request in requestsList:
-                params = {'permalink': request.permalink}
-                future = self.session.get(self.baseUrl + 'getJson', params=params)
-                future.obj = request
-                futures.append(future)
-                print('Queued {:s}'.format(request.permalink))
-
-            # Clear the request list
-            requestsList = []
-
-            # Collect the completed tasks
-            for future in as_completed(futures):
-                r = future.result()
+        return self.run(self.getJsonAsync(id=id, link=link, generatorVersion=generatorVersion))
+
+    async def _fetchJsonAsync(self, log:dpsReportObj, parse) -> bool:
+        """ Fetches the EI raw JSON for a single dpsReportObj, going through the cache first. The response
+            body is handed to parse(log, data), which should raise a ValueError if the JSON is malformed (or
+            isn't an EI JSON at all) so it can be fetched again, up to maxRetries times.
 
+            Returns False if the JSON couldn't be fetched. The log is left as it was, so one bad log doesn't
+            stop the rest of a batch.
+        """
+        # Anything already on disk doesn't need to go out to the network
+        if (self.jsonCache is not None):
+            data = self.jsonCache.get(log.id, log.generatorVersion)
+            if (data is not None):
                 try:
-                    respJson = r.json()
-                    future.obj.encounter.json = respJson
-                    print('Finished {:s}'.format(future.obj.permalink))
-                except:
-                    requestsList.append(future.obj)
-                    print('JSON malformed, trying again for {:s}'.format(future.obj.permalink))
+                    parse(log, data)
+                    print('Cached {:s}'.format(log.permalink))
+                    self.metrics.inc('json_cache_hits_total')
+                    return True
+                except ValueError:
+                    # Cached before it was checked, or damaged on disk. Fetch it again
+                    print('Cached JSON for {:s} is unusable, fetching it again'.format(log.permalink))
 
-        endTime = time.perf_counter()
-        print('Fetch JSON Total Time: {}'.format(endTime - startTime))
+            self.metrics.inc('json_cache_misses_total')
 
-    def getUploads(self, page:int=1) ->list[dpsReportObj]:
-        """ Returns previous logs
+        def parseAndStore(body:bytes) -> bool:
+            parse(log, body)
+
+            if (self.jsonCache is not None):
+                self.jsonCache.put(log.id, max(log.generatorVersion, 0), body)
+
+            return True
+
+        print('Queued {:s}'.format(log.permalink))
+        try:
+            fetched = await self._requestJson('getJson', {'permalink': log.permalink}, parse=parseAndStore,
+                                              retries=self.maxRetries)
+        except (dpsReportError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print('Log {:s} JSON could not be fetched: {}'.format(log.permalink, e))
+            fetched = None
+
+        if (fetched is None):
+            print('Log {:s} has no usable JSON, skipping it'.format(log.permalink))
+            self.metrics.inc('dpsreport_json_failures_total')
+            return False
+
+        print('Finished {:s}'.format(log.permalink))
+        return True
+
+    async def _fetchJsonsAsync(self, logs:list[dpsReportObj], parse):
+        with self.metrics.span('fetch json'):
+            await asyncio.gather(*[self._fetchJsonAsync(l, parse) for l in logs])
+
+    @staticmethod
+    def _parseJson(log:dpsReportObj, data:bytes):
+        log.encounter.json = json.loads(data)
+
+    @staticmethod
+    def _parseSummary(log:dpsReportObj, data:bytes):
+        log.encounter.summary = logSummary.fromJson(data)
+
+    async def getJsonsAsync(self, logs:list[dpsReportObj]):
+        """ Async version of getJsons
+        """
+        await self._fetchJsonsAsync(logs=logs, parse=self._parseJson)
+
+    def getJsons(self, logs:list[dpsReportObj]):
+        """ Given a list of dpsReportObjs, fill in their JSON field with the EI raw JSON. Logs whose JSON
+            couldn't be fetched are left without one
+        """
+        self.run(self.getJsonsAsync(logs))
+
+    async def getSummariesAsync(self, logs:list[dpsReportObj]):
+        """ Async version of getSummaries
+        """
+        await self._fetchJsonsAsync(logs=logs, parse=self._parseSummary)
+
+    def getSummaries(self, logs:list[dpsReportObj]):
+        """ Given a list of dpsReportObjs, fill in their summary field from the EI raw JSON.
+            The raw JSON is not kept, so memory use stays small regardless of the number of logs.
+            Logs whose JSON couldn't be fetched are left without a summary.
+        """
+        self.run(self.getSummariesAsync(logs))
+
+    async def getSummaryAsync(self, log:dpsReportObj) -> logSummary:
+        """ Async version of getSummary. Returns None if the summary couldn't be fetched
+        """
+        await self._fetchJsonAsync(log, parse=self._parseSummary)
+
+        return log.encounter.summary
+
+    def getSummary(self, log:dpsReportObj) -> logSummary:
+        """ Gets the summary of a single previous encounter, or None if it couldn't be fetched
+        """
+        self.getSummaries(logs=[log])
+
+        return log.encounter.summary
+
+    async def getUploadsAsync(self, page:int=1) -> list[dpsReportObj]:
+        """ Async version of getUploads
         """
         # Queue the request
         params = {'userToken':self.token, 'page':page}
-        future = self.session.get(self.baseUrl + 'getUploads', params=params)
-
-        # Wait for a response
-        r = future.result()
+        (status, body) = await self._request('GET', 'getUploads', params=params)
 
         # Make sure we were successful
-        r.raise_for_status()
+        if (status != HTTPStatus.OK):
+            raise dpsReportError(status, self.baseUrl + 'getUploads')
 
         # The returned value is an array of results, so we need to break each one up
-        data = r.json()
+        data = json.loads(body)
 
         rtnObjs = []
         for encounter in data['uploads']:
@@ -693,23 +1190,30 @@ class dpsReport():
 
         return rtnObjs
 
-    def getUserToken(self) -> str:
-        """ Gets a User Token from DPS.report. Since this generates uniquely if you don't
-            have a cookie, which we don't, this will always return a new token
+    def getUploads(self, page:int=1) ->list[dpsReportObj]:
+        """ Returns previous logs
         """
-        # Queue the request
-        future = self.session.get(self.baseUrl + 'getUserToken')
+        return self.run(self.getUploadsAsync(page=page))
 
-        # Wait for a response
-        r = future.result()
+    async def getUserTokenAsync(self) -> str:
+        """ Async version of getUserToken
+        """
+        (status, body) = await self._request('GET', 'getUserToken')
 
         # Make sure we were successful
-        r.raise_for_status()
+        if (status != HTTPStatus.OK):
+            raise dpsReportError(status, self.baseUrl + 'getUserToken')
 
         # Store token in self
-        self.token = r.text
+        self.token = body.decode()
 
-        return(r.text)
+        return self.token
+
+    def getUserToken(self) -> str:
+        """ Gets a User Token from DPS.report. Since this generates uniquely if you don't
+            have a cookie, which we don't, this will always return a new token
+        """
+        return self.run(self.getUserTokenAsync())
 
 class dpsReportIds():
     '''
@@ -723,12 +1227,10 @@ class dpsReportIds():
             Will raise a KeyError is the folder name doesn't match
         '''
 
-        # Iterate through all IDs in the map to find all folder name matches
-        for (shortName, values) in targetIdMap.items():
-            if (folderName in values['FolderNames']):
-                return shortName
-        else:
-            raise KeyError('Folder Name {:s} does not match any known IDs'.format(folderName))
+        try:
+            return folderNameIndex[folderName]
+        except KeyError:
+            raise KeyError('Folder Name {:s} does not match any known IDs'.format(folderName)) from None
 
     @staticmethod
     def idToShortName(id:int) -> str:
@@ -737,12 +1239,10 @@ class dpsReportIds():
             Will raise a KeyError if the ID isn't associated with any short name
         '''
 
-        for (shortName, values) in targetIdMap.items():
-            for i in values['IDs']:
-                if (id == i):
-                    return shortName
-        else:
-            raise KeyError('ID {:d} does not match any known IDs'.format(id))
+        try:
+            return idIndex[id]
+        except KeyError:
+            raise KeyError('ID {:d} does not match any known IDs'.format(id)) from None
 
     @staticmethod
     def shortNameToIds(shortName:str) -> List[int]:
@@ -752,10 +1252,10 @@ class dpsReportIds():
             Will raise a KeyError if the short name doesn't match
         '''
 
-        if (shortName in targetIdMap.keys()):
+        try:
             return targetIdMap[shortName]['IDs']
-        else:
-            raise KeyError('Short Name {:s} not known'.format(shortName))
+        except KeyError:
+            raise KeyError('Short Name {:s} not known'.format(shortName)) from None
 
     @staticmethod
     def shortNameToPrettyName(shortName:str) -> str:
@@ -765,7 +1265,44 @@ class dpsReportIds():
             Will raise a KeyError if the short name doesn't match
         '''
 
-        if (shortName in targetIdMap.keys()):
+        try:
             return targetIdMap[shortName]['PrettyName']
-        else:
-            raise KeyError('Short Name {:s} not known'.format(shortName))
\ No newline at end of file
+        except KeyError:
+            raise KeyError('Short Name {:s} not known'.format(shortName)) from None
+
+    @staticmethod
+    def shortNameToBossNames(shortName:str) -> FrozenSet[str]:
+        ''' Given a short name, look up every boss name that may be recorded for the encounter, IE: the folder
+            names and the pretty name.
+
+            Will raise a KeyError if the short name doesn't match
+        '''
+
+        try:
+            return shortNameToBossNamesIndex[shortName]
+        except KeyError:
+            raise KeyError('Short Name {:s} not known'.format(shortName)) from None
+
+    @staticmethod
+    def idToBossName(id:int) -> str:
+        ''' Given a boss ID, look up the name of the boss.
+
+            Will raise a KeyError if the ID isn't known
+        '''
+
+        try:
+            return bossNames[id]
+        except KeyError:
+            raise KeyError('ID {:d} does not match any known IDs'.format(id)) from None
+
+    @staticmethod
+    def bossNameToId(bossName:str) -> int:
+        ''' Given a boss name (either the folder name or the pretty name), look up the boss ID.
+
+            Will raise a KeyError if the name isn't known
+        '''
+
+        try:
+            return bossNameToIdIndex[bossName]
+        except KeyError:
+            raise KeyError('Boss Name {:s} does not match any known IDs'.format(bossName)) from None
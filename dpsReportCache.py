@@ -0,0 +1,251 @@
+from dataclasses import dataclass, field
+import gzip
+import hashlib
+import os
+import sqlite3
+import time
+from typing import Dict,List,Tuple
+
+@dataclass
+class jsonCache():
+    ''' A read-through disk cache for the Elite Insights JSON served by dps.report.
+
+        Each entry is a gzip compressed copy of the raw response body, stored under the log ID and the EI
+        generator version so a reparse on dps.report's side never serves stale data. Entries are evicted
+        least recently used first once the total size on disk goes over maxBytes.
+    '''
+    directory:str
+    maxBytes:int = 1024 * 1024 * 1024
+
+    # Running total of the bytes on disk, so we don't need to walk the directory for every store
+    curBytes:int = field(init=False, default=0)
+
+    # Log ID -> {path: last used time} of its entries, so a lookup never has to list the directory
+    index:Dict[str, Dict[str, float]] = field(init=False, default_factory=dict)
+
+    def __post_init__(self):
+        os.makedirs(self.directory, exist_ok=True)
+
+        self.curBytes = 0
+        self.index = {}
+        for e in self._entries():
+            stat = e.stat()
+            self.curBytes += stat.st_size
+            self._track(e.path, stat.st_mtime)
+
+    def _entries(self) -> List[os.DirEntry]:
+        ''' Returns all the cache entries currently on disk
+        '''
+        with os.scandir(self.directory) as d:
+            return [e for e in d if e.is_file() and e.name.endswith('.json.gz')]
+
+    def _path(self, id:str, generatorVersion:int) -> str:
+        return os.path.join(self.directory, '{:s}_{:d}.json.gz'.format(id, generatorVersion))
+
+    @staticmethod
+    def _id(path:str) -> str:
+        ''' The log ID of an entry, IE: the name without the _<generator version>.json.gz
+        '''
+        return os.path.basename(path).rsplit('_', 1)[0]
+
+    def _track(self, path:str, usedTime:float):
+        self.index.setdefault(self._id(path), {})[path] = usedTime
+
+    def _find(self, id:str, generatorVersion:int) -> str:
+        ''' Find the entry for a log. If the generator version is not known (negative), the most
+            recent entry for any version of the log is used.
+        '''
+        versions = self.index.get(id)
+        if (not versions):
+            return None
+
+        if (generatorVersion >= 0):
+            path = self._path(id, generatorVersion)
+            return path if (path in versions) else None
+
+        return max(versions, key=versions.get)
+
+    def get(self, id:str, generatorVersion:int=-1) -> bytes:
+        ''' Returns the raw JSON for a log, or None if it is not cached
+        '''
+        path = self._find(id, generatorVersion)
+        if (path is None):
+            return None
+
+        try:
+            with gzip.open(path, mode='rb') as f:
+                data = f.read()
+        except (OSError, EOFError):
+            # Truncated or otherwise corrupt entry (or removed behind our back), drop it so it gets fetched again
+            self._remove(path)
+            return None
+
+        # Touch the entry so the eviction order is by last use rather than by creation
+        now = time.time()
+        os.utime(path, (now, now))
+        self._track(path, now)
+
+        return data
+
+    def put(self, id:str, generatorVersion:int, data:bytes):
+        ''' Stores the raw JSON for a log and evicts old entries if the cache is over its size limit
+        '''
+        path = self._path(id, generatorVersion)
+
+        # Write to a temporary file first so an interrupted run never leaves a partial entry behind
+        tmpPath = path + '.tmp'
+        with gzip.open(tmpPath, mode='wb', compresslevel=6) as f:
+            f.write(data)
+
+        if (os.path.exists(path)):
+            self.curBytes -= os.path.getsize(path)
+
+        os.replace(tmpPath, path)
+        stat = os.stat(path)
+        self.curBytes += stat.st_size
+        self._track(path, stat.st_mtime)
+
+        if (self.curBytes > self.maxBytes):
+            self.evict()
+
+    def _remove(self, path:str):
+        id = self._id(path)
+        versions = self.index.get(id)
+        if (versions is not None):
+            versions.pop(path, None)
+            if (len(versions) == 0):
+                del self.index[id]
+
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            self.curBytes -= size
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        ''' Removes the least recently used entries until the cache is back under its size limit
+        '''
+        entries = sorted(self._entries(), key=lambda e: e.stat().st_mtime)
+
+        for e in entries:
+            if (self.curBytes <= self.maxBytes):
+                break
+
+            self._remove(e.path)
+
+@dataclass
+class uploadLedger():
+    ''' A record of every log file uploaded to dps.report, keyed by the hash and size of the file.
+
+        Uploading is by far the most expensive step, so before a file is sent the ledger is checked and the
+        stored response is reused if the same file has been uploaded before. Files that dps.report rejected
+        (IE: too short) are recorded too so they aren't sent again either.
+    '''
+    filename:str
+    db:sqlite3.Connection = field(init=False)
+
+    def __post_init__(self):
+        self.db = sqlite3.connect(self.filename)
+
+        # Check if table exists, if not create it
+        c = self.db.cursor()
+        c.execute('''CREATE TABLE IF NOT EXISTS uploads
+                    (hash text,
+                    size integer,
+                    path text,
+                    status integer,
+                    response text,
+                    uploaded integer,
+                    PRIMARY KEY (hash, size))''')
+        self.db.commit()
+        c.close()
+
+    @staticmethod
+    def hashFile(path:str) -> Tuple[str, int]:
+        ''' Returns the (hash, size) key of a log file
+        '''
+        with open(path, mode='rb') as f:
+            digest = hashlib.file_digest(f, 'sha256').hexdigest()
+            size = f.tell()
+
+        return (digest, size)
+
+    def lookup(self, key:Tuple[str, int]) -> Tuple[int, str]:
+        ''' Returns the (status, response) of a previous upload of the file, or None if it hasn't been uploaded
+        '''
+        (digest, size) = key
+
+        c = self.db.cursor()
+        c.execute('''SELECT status, response FROM uploads WHERE hash = ? AND size = ?''', (digest, size, ))
+        result = c.fetchone()
+        c.close()
+
+        return result
+
+    def record(self, key:Tuple[str, int], path:str, status:int, response:str):
+        ''' Stores the result of uploading a file
+        '''
+        (digest, size) = key
+
+        self.db.execute('''INSERT OR REPLACE INTO uploads (hash, size, path, status, response, uploaded)
+                           VALUES (?, ?, ?, ?, ?, ?)''',
+                           (digest, size, path, status, response, int(time.time()), ))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+@dataclass
+class metadataCache():
+    ''' Upload metadata from dps.report, keyed by the permalink (or ID) it was looked up with.
+
+        The metadata of an upload never changes, so once a link has been resolved it doesn't need to be asked
+        for again. This makes reusing a big file of links (IE: for a weekly report) nearly free after the
+        first run. Logs we upload ourselves are stored under their permalink too.
+    '''
+    filename:str
+    db:sqlite3.Connection = field(init=False)
+
+    # SQLite limits the number of parameters in a single query
+    chunkSize:int = 500
+
+    def __post_init__(self):
+        self.db = sqlite3.connect(self.filename)
+
+        # Check if table exists, if not create it
+        c = self.db.cursor()
+        c.execute('''CREATE TABLE IF NOT EXISTS metadata
+                    (identifier text PRIMARY KEY,
+                    response text,
+                    fetched integer)''')
+        self.db.commit()
+        c.close()
+
+    def lookup(self, identifiers:List[str]) -> Dict[str, str]:
+        ''' Returns the stored response for every identifier that has one
+        '''
+        rtn = {}
+        unique = list(dict.fromkeys(identifiers))
+
+        c = self.db.cursor()
+        for i in range(0, len(unique), self.chunkSize):
+            chunk = unique[i:i + self.chunkSize]
+            c.execute('''SELECT identifier, response FROM metadata WHERE identifier IN ({:s})'''.format(
+                      ','.join('?' * len(chunk))), chunk)
+            rtn.update(c.fetchall())
+        c.close()
+
+        return rtn
+
+    def record(self, entries:List[Tuple[str, str]]):
+        ''' Stores (identifier, response) pairs
+        '''
+        now = int(time.time())
+
+        self.db.executemany('''INSERT OR REPLACE INTO metadata (identifier, response, fetched) VALUES (?, ?, ?)''',
+                            [(identifier, response, now) for (identifier, response) in entries])
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
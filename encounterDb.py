@@ -1,8 +1,22 @@
+import aiohttp
+import asyncio
 from dataclasses import dataclass, field
 from datetime import datetime,timedelta,timezone
+import json
+import os
+import shutil
 import sqlite3
 import sys
+import tempfile
 from typing import Dict,List,Tuple
+import zipfile
+
+# numpy is optional, it's only needed for exporting and the statistics
+try:
+    import numpy as np
+    from numpy.lib.format import open_memmap
+except ImportError:
+    np = None
 
 import dpsReport
 import encounterSet as es
@@ -17,6 +31,13 @@ class encounterDb():
     def __post_init__(self):
         self.db = sqlite3.connect(self.filename)
 
+        # Bulk imports write thousands of rows at a time. WAL lets them commit without rewriting the main
+        # database file each time, and NORMAL sync is still safe against corruption in WAL mode
+        self.db.execute('''PRAGMA journal_mode = WAL''')
+        self.db.execute('''PRAGMA synchronous = NORMAL''')
+        self.db.execute('''PRAGMA temp_store = MEMORY''')
+        self.db.execute('''PRAGMA cache_size = -16384''')
+
         # Check if table exists, if not create it
         c = self.db.cursor()
         c.execute('''CREATE TABLE IF NOT EXISTS encounters
@@ -26,122 +47,429 @@ class encounterDb():
                     time integer,
                     success bool,
                     cm bool)''')
+
+        # Indexes for looking up logs by date, and for the best time of an encounter
+        c.execute('''CREATE INDEX IF NOT EXISTS encounters_date ON encounters (date)''')
+        c.execute('''CREATE INDEX IF NOT EXISTS encounters_best ON encounters (boss, cm, success, time)''')
+
+        # Personal best as of a date. For each encounter and CM, this holds only the kills that beat every kill
+        # before them, so the best time as of any date is the last row at or before it. The encounter is the
+        # short name, since the boss name recorded in the encounters table can differ between logs
+        c.execute('''CREATE TABLE IF NOT EXISTS best_times
+                    (encounter text,
+                    cm bool,
+                    date integer,
+                    time integer,
+                    log text,
+                    PRIMARY KEY (encounter, cm, date)) WITHOUT ROWID''')
         self.db.commit()
+
+        # The EI summary of each log, so posts and replays don't need to fetch the EI JSON again. Times are epoch
+        # seconds plus the UTC offset of whoever recorded the log, targets and players are JSON lists
+        c.execute('''CREATE TABLE IF NOT EXISTS log_summary
+                    (log text PRIMARY KEY,
+                    duration integer,
+                    cm bool,
+                    emboldened integer,
+                    started integer,
+                    ended integer,
+                    utc_offset integer,
+                    targets text,
+                    players text)''')
+        self.db.commit()
+
+        # General key/value storage, IE: for checkpoints of long running operations
+        c.execute('''CREATE TABLE IF NOT EXISTS meta
+                    (key text PRIMARY KEY,
+                    value)''')
+        self.db.commit()
+
+        # Databases from before best_times existed need it filled in from the existing logs
+        c.execute('''PRAGMA user_version''')
+        if (c.fetchone()[0] < 1):
+            self.rebuildBestTimes()
+            c.execute('''PRAGMA user_version = 1''')
+            self.db.commit()
+
         c.close()
 
-    def importLogs(self, logs:list[dpsReport.dpsReportObj], parser:dpsReport.dpsReport=None):
-        # Create cursor
-        cursor = self.db.cursor()
+    def _getMeta(self, key:str):
+        cursor = self.db.execute('''SELECT value FROM meta WHERE key = ?''', (key, ))
+        result = cursor.fetchone()
+        cursor.close()
+
+        if (result is None):
+            return None
+
+        return result[0]
+
+    def _setMeta(self, key:str, value, cursor:sqlite3.Cursor=None):
+        ''' Stores a value in the meta table, or removes it if the value is None. If a cursor is given, the
+            write is left to the caller's transaction, otherwise it is committed right away.
+        '''
+        c = cursor if (cursor is not None) else self.db.cursor()
+
+        if (value is None):
+            c.execute('''DELETE FROM meta WHERE key = ?''', (key, ))
+        else:
+            c.execute('''INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)''', (key, value, ))
+
+        if (cursor is None):
+            self.db.commit()
+            c.close()
+
+    @staticmethod
+    def _bossToShortName(boss:str) -> str:
+        ''' Converts a boss name recorded in the encounters table to the encounter short name, or None if the
+            name isn't known
+        '''
+        if (boss is None):
+            return None
+
+        try:
+            return dpsReport.dpsReportIds.idToShortName(dpsReport.dpsReportIds.bossNameToId(boss))
+        except KeyError:
+            return None
+
+    def _recordBest(self, cursor:sqlite3.Cursor, shortName:str, cm:bool, date:int, time:int, log:str):
+        ''' Adds a successful kill to best_times if it beats every kill before it. Later rows that it beats are
+            no longer bests as of their date, so they are removed. Must be called inside a transaction.
+        '''
+        cursor.execute('''SELECT time FROM best_times WHERE encounter = ? AND cm = ? AND date <= ?
+                          ORDER BY date DESC LIMIT 1''',
+                          (shortName, cm, date, ))
+        previous = cursor.fetchone()
+        if ((previous is not None) and (previous[0] <= time)):
+            return
+
+        cursor.execute('''INSERT OR REPLACE INTO best_times (encounter, cm, date, time, log)
+                          VALUES (?, ?, ?, ?, ?)''',
+                          (shortName, cm, date, time, log, ))
+        cursor.execute('''DELETE FROM best_times WHERE encounter = ? AND cm = ? AND date > ? AND time >= ?''',
+                          (shortName, cm, date, time, ))
+
+    def rebuildBestTimes(self):
+        ''' Rebuilds best_times from the encounters table in a single pass over the kills in date order
+        '''
+        bests = {}
+        rows = []
+
+        cursor = self.db.execute('''SELECT log, date, boss, time, cm FROM encounters
+                                    WHERE success AND (time IS NOT NULL) AND (date IS NOT NULL)
+                                    ORDER BY date ASC''')
+        for (log, date, boss, time, cm) in cursor:
+            shortName = self._bossToShortName(boss)
+            if (shortName is None):
+                continue
+
+            key = (shortName, bool(cm))
+            if ((key in bests) and (bests[key] <= time)):
+                continue
+
+            bests[key] = time
+            rows.append((shortName, bool(cm), date, time, log))
+
+        with self.db:
+            self.db.execute('''DELETE FROM best_times''')
+            self.db.executemany('''INSERT OR REPLACE INTO best_times (encounter, cm, date, time, log)
+                                   VALUES (?, ?, ?, ?, ?)''',
+                                   rows)
+
+    @staticmethod
+    def _summaryToRow(log:str, summary:dpsReport.logSummary) -> tuple:
+        return (log,
+                summary.duration,
+                summary.isCm,
+                summary.emboldened,
+                int(summary.timeStart.timestamp()),
+                int(summary.timeEnd.timestamp()),
+                int(summary.timeStart.utcoffset().total_seconds()),
+                json.dumps(summary.targets),
+                json.dumps(summary.players))
+
+    @staticmethod
+    def _rowToSummary(row:tuple) -> dpsReport.logSummary:
+        ''' Converts the columns of log_summary after log back to a summary
+        '''
+        (duration, cm, emboldened, started, ended, utcOffset, targets, players) = row
+
+        tz = timezone(timedelta(seconds=utcOffset))
+        return dpsReport.logSummary(duration=duration,
+                                    isCm=bool(cm),
+                                    targets=tuple(tuple(t) for t in json.loads(targets)),
+                                    emboldened=emboldened,
+                                    timeStart=datetime.fromtimestamp(started, tz=tz),
+                                    timeEnd=datetime.fromtimestamp(ended, tz=tz),
+                                    players=tuple(sys.intern(p) for p in json.loads(players)))
+
+    def storeSummaries(self, logs:List[dpsReport.dpsReportObj], cursor:sqlite3.Cursor=None):
+        ''' Stores the EI summaries of the logs that have one. If a cursor is given, the write is left to the
+            caller's transaction, otherwise it is committed right away.
+        '''
+        rows = [self._summaryToRow(l.permalink, l.encounter.summary) for l in logs if (l.encounter.summary is not None)]
+
+        c = cursor if (cursor is not None) else self.db.cursor()
+        c.executemany('''INSERT OR REPLACE INTO log_summary
+                         (log, duration, cm, emboldened, started, ended, utc_offset, targets, players)
+                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                         rows)
+
+        if (cursor is None):
+            self.db.commit()
+            c.close()
+
+    def loadSummaries(self, logs:List[dpsReport.dpsReportObj]) -> int:
+        ''' Fills in the EI summary of any log that doesn't have one from the database. Returns the number of
+            summaries that were loaded.
+        '''
+        needed = {l.permalink: l for l in logs if (l.encounter.summary is None) and (l.encounter.json is None)}
+        links = list(needed)
+
+        loaded = 0
+
+        # SQLite limits the number of parameters in a single query, so check in chunks
+        chunkSize = 500
+        for i in range(0, len(links), chunkSize):
+            chunk = links[i:i+chunkSize]
+            cursor = self.db.execute('''SELECT log, duration, cm, emboldened, started, ended, utc_offset, targets, players
+                                        FROM log_summary WHERE log IN ({:s})'''.format(','.join('?' * len(chunk))),
+                                     chunk)
+            for row in cursor:
+                needed[row[0]].encounter.summary = self._rowToSummary(row[1:])
+                loaded += 1
+
+        return loaded
+
+    def _existingLogs(self, logs:List[str]) -> set:
+        ''' Returns which of the given logs are already in the database
+        '''
+        existing = set()
+
+        # SQLite limits the number of parameters in a single query, so check in chunks
+        chunkSize = 500
+        for i in range(0, len(logs), chunkSize):
+            chunk = logs[i:i+chunkSize]
+            cursor = self.db.execute('''SELECT log FROM encounters WHERE log IN ({:s})'''.format(','.join('?' * len(chunk))),
+                                     chunk)
+            existing.update(r[0] for r in cursor)
+
+        return existing
+
+    def importLogs(self, logs:list[dpsReport.dpsReportObj], parser:dpsReport.dpsReport=None) -> Tuple[int, int]:
+        ''' Imports logs into the database in a single transaction. Logs that are already in the database are
+            skipped. Returns the number of logs (inserted, skipped).
+        '''
+        # Skip anything that is already in the DB before doing any work for it
+        existing = self._existingLogs([l.permalink for l in logs])
+        newLogs = [l for l in logs if l.permalink not in existing]
 
         # Create Parser if needed
-        if (parser is None):
+        ownParser = (parser is None)
+        if (ownParser):
             parser = dpsReport.dpsReport()
 
-        # Load logs
-        for l in logs:
-            # Check that this log doesn't exist already to prevent an integrity error
-            cursor.execute('''SELECT log FROM encounters WHERE log=?''',
-                            (l.permalink, ))
+        # The accurate duration and the rest of the summary come from the EI JSON, so fetch whatever is missing
+        # in one go
+        missing = [l for l in newLogs if (l.encounter.summary is None) and (l.encounter.json is None)]
+        if (len(missing) > 0):
+            parser.getSummaries(logs=missing)
+
+        # Anything dps.report couldn't give a JSON for is left out, so the next import can try it again
+        for l in newLogs:
+            if (l.encounter.summary is None) and (l.encounter.json is None):
+                print('Log {:s} has no summary, not importing it'.format(l.permalink))
+        newLogs = [l for l in newLogs if (l.encounter.summary is not None) or (l.encounter.json is not None)]
+
+        # Grab important log data
+        rows = []
+        for l in newLogs:
+            rows.append((l.permalink,
+                         l.encounterTime,
+                         l.encounter.boss,
+                         logUtils.logTime.fromLog(logParser=parser, log=l),
+                         l.encounter.success,
+                         l.encounter.isCm))
+
+        # Insert logs into table, keeping the best times up to date in the same transaction
+        changesBefore = self.db.total_changes
+        with self.db:
+            cursor = self.db.cursor()
+            cursor.executemany('''INSERT OR IGNORE INTO encounters (log, date, boss, time, success, cm)
+                                  VALUES (?, ?, ?, ?, ?, ?)''',
+                                  rows)
+            inserted = self.db.total_changes - changesBefore
+
+            for (l, (log, date, boss, time, success, cm)) in zip(newLogs, rows):
+                if (not success):
+                    continue
 
-            if (cursor.fetchone() is not None):
-                print('Log: {:s} already in DB'.format(l.permalink))
-                continue
+                try:
+                    shortName = dpsReport.dpsReportIds.idToShortName(l.encounter.bossId)
+                except KeyError:
+                    continue
 
-            # Grab important log data
-            date = l.encounterTime
-            boss = l.encounter.boss
-            time = logUtils.logTime.fromLog(logParser=parser, log=l)
-            success = l.encounter.success
-            cm = l.encounter.isCm
+                self._recordBest(cursor, shortName=shortName, cm=bool(cm), date=date, time=time.__toMs__(), log=log)
 
-            # Insert log into table
-            cursor.execute('''INSERT INTO encounters (log, date, boss, time, success, cm)
-                              VALUES (?, ?, ?, ?, ?, ?)''',
-                              (l.permalink, date, boss, time, success, cm, ))
+            # Keep the summaries of everything, so reposting the logs later doesn't need the EI JSON
+            for l in newLogs:
+                logUtils.getSummary(logParser=parser, log=l)
+            self.storeSummaries(logs, cursor=cursor)
 
-            self.db.commit()
+            cursor.close()
+        skipped = len(logs) - inserted
 
-        cursor.close()
+        print('Imported {:d} logs, {:d} already in DB'.format(inserted, skipped))
+
+        if (ownParser):
+            parser.close()
+
+        return (inserted, skipped)
 
     '''
     Bulk load logs from an input file. This will not populate the metadata, only create
     the entry for it.
 
-    The input format should be simply 1 log per line
+    The input format should be simply 1 log per line. Returns the number of logs (inserted, skipped).
     '''
-    def loadFromFile(self, inFile:str):
-        # Create cursor
-        cursor = self.db.cursor()
+    def loadFromFile(self, inFile:str) -> Tuple[int, int]:
+        total = 0
+
+        def readLogs(f):
+            nonlocal total
 
-        # Read file
-        with open(inFile, 'r') as f:
             for l in f:
                 # One log per line, remove the newline and whitespace
                 log = l.strip()
-
-                # Check that this log doesn't exist already to prevent an integrity error
-                cursor.execute('''SELECT log FROM encounters WHERE log=?''',
-                                (log, ))
-
-                if (cursor.fetchone() is not None):
-                    print('Log: {:s} already in DB'.format(log))
+                if (log == ''):
                     continue
 
-                # Add log in, but it will have no additional data
-                cursor.execute('''INSERT INTO encounters (log) VALUES
-                                (?)''',
-                                (log, ))
+                total += 1
+                yield (log, )
 
-                self.db.commit()
+        # Add logs in, but they will have no additional data
+        # The whole file goes in as one transaction, anything already in the DB is ignored
+        changesBefore = self.db.total_changes
+        with open(inFile, 'r') as f, self.db:
+            self.db.executemany('''INSERT OR IGNORE INTO encounters (log) VALUES (?)''', readLogs(f))
+        inserted = self.db.total_changes - changesBefore
+        skipped = total - inserted
 
-        cursor.close()
+        print('Loaded {:d} logs, {:d} already in DB'.format(inserted, skipped))
+
+        return (inserted, skipped)
 
     '''
-    Searches entries in the database and reparses the log to fill in missing fields
+    Searches entries in the database and reparses the log to fill in missing fields.
+
+    Rows are handled batchSize at a time. The metadata and EI summary of every log in a batch are fetched
+    concurrently, then the whole batch is written in one transaction along with a checkpoint. If the backfill
+    is interrupted, the next call carries on after the checkpoint. Logs that can't be fetched are skipped and
+    picked up again once a backfill runs to completion, or with restart.
     '''
-    def updateFields(self):
+    def updateFields(self, batchSize:int=50, restart:bool=False):
         # Parser for log data
         parser = dpsReport.dpsReport()
 
-        # Create cursors
-        # We need one for the query and iterating through the results, and one to perform the updates
-        q_cursor = self.db.cursor()
-        w_cursor = self.db.cursor()
-
-        # Get rows that needs updating
-        q_cursor.execute('''SELECT log FROM encounters WHERE
-                            coalesce(date,boss,time,success,cm) IS NULL''')
-        for r in q_cursor:
-            logPath = r[0]
-
-            log = logUtils.linkToLogObject(parser=parser, links=[logPath])[0]
-
-            date = log.encounterTime
-            boss = log.encounter.boss
-            time = logUtils.logTime.fromLog(logParser=parser, log=log)
-            success = log.encounter.success
-            cm = log.encounter.isCm
-
-            w_cursor.execute('''UPDATE encounters SET
-                                date = ?,
-                                boss = ?,
-                                time = ?,
-                                success = ?,
-                                cm = ?
-                                WHERE log = ?''',
-                                (date, boss, time, success, cm, logPath, ))
+        if (restart):
+            self._setMeta('updateFields.last', None)
 
-            self.db.commit()
+        checkpoint = self._getMeta('updateFields.last')
+        if (checkpoint is None):
+            checkpoint = ''
+        else:
+            print('Resuming after {:s}'.format(checkpoint))
+
+        cursor = self.db.cursor()
+        cursor.execute('''SELECT COUNT(*) FROM encounters WHERE
+                          coalesce(date,boss,time,success,cm) IS NULL AND log > ?''',
+                          (checkpoint, ))
+        remaining = cursor.fetchone()[0]
+        print('{:d} logs to update'.format(remaining))
+
+        async def fetch(link:str) -> dpsReport.dpsReportObj:
+            try:
+                log = await parser.getUploadMetaDataAsync(link)
+                if (log is None):
+                    print('Log {:s} metadata was malformed, skipping'.format(link))
+                    return None
+
+                if (await parser.getSummaryAsync(log) is None):
+                    print('Log {:s} summary could not be fetched, skipping'.format(link))
+                    return None
+
+                return log
+            except (dpsReport.dpsReportError, aiohttp.ClientError, asyncio.TimeoutError, KeyError, ValueError) as e:
+                print('Log {:s} could not be fetched ({}), skipping'.format(link, e))
+                return None
+
+        async def fetchBatch(links:List[str]) -> List[dpsReport.dpsReportObj]:
+            return await asyncio.gather(*[fetch(l) for l in links])
+
+        updated = 0
+        while True:
+            # Get the next batch of rows that needs updating
+            cursor.execute('''SELECT log FROM encounters WHERE
+                              coalesce(date,boss,time,success,cm) IS NULL AND log > ?
+                              ORDER BY log ASC LIMIT ?''',
+                              (checkpoint, batchSize, ))
+            links = [r[0] for r in cursor]
+
+            if (len(links) == 0):
+                break
+
+            logs = parser.run(fetchBatch(links))
+
+            # Write the batch and move the checkpoint in the same transaction, so they can't get out of step
+            with self.db:
+                for (logPath, log) in zip(links, logs):
+                    if (log is None):
+                        continue
+
+                    date = log.encounterTime
+                    boss = log.encounter.boss
+                    time = logUtils.logTime.fromLog(logParser=parser, log=log)
+                    success = log.encounter.success
+                    cm = log.encounter.isCm
+
+                    cursor.execute('''UPDATE encounters SET
+                                      date = ?,
+                                      boss = ?,
+                                      time = ?,
+                                      success = ?,
+                                      cm = ?
+                                      WHERE log = ?''',
+                                      (date, boss, time, success, cm, logPath, ))
+
+                    if (success):
+                        try:
+                            shortName = dpsReport.dpsReportIds.idToShortName(log.encounter.bossId)
+                            self._recordBest(cursor, shortName=shortName, cm=bool(cm), date=date, time=time.__toMs__(), log=logPath)
+                        except KeyError:
+                            pass
+
+                    updated += 1
+
+                self.storeSummaries([l for l in logs if (l is not None)], cursor=cursor)
+
+                checkpoint = links[-1]
+                self._setMeta('updateFields.last', checkpoint, cursor=cursor)
+
+            print('Updated {:d} of {:d} logs'.format(updated, remaining))
+
+        # Finished, so the next backfill starts from the beginning and retries anything that was skipped
+        with self.db:
+            self._setMeta('updateFields.last', None, cursor=cursor)
+
+        # Close the cursor
+        cursor.close()
 
-        # Close the cursors
-        q_cursor.close()
-        w_cursor.close()
+        parser.close()
 
     def getEarliestDate(self) -> datetime:
         # Database Cursor
         cursor = self.db.cursor()
 
-        cursor.execute('''SELECT date FROM encounters ORDER BY date ASC''')
+        cursor.execute('''SELECT MIN(date) FROM encounters''')
 
         firstDate = datetime.fromtimestamp(cursor.fetchone()[0], tz=timezone.utc)
 
@@ -151,22 +479,30 @@ class encounterDb():
         # Database Cursor
         cursor = self.db.cursor()
 
-        # If there is no start date, we just start at the first log in the database
-        if (startDate is None):
-            startDate = self.getEarliestDate()
-
         # If there is no end date, we just end now
         if endDate is None:
             endDate = datetime.now()
 
-        # Convert bossId to bossName
-        bossName = dpsReport.bossNames[boss]
+        shortName = dpsReport.dpsReportIds.idToShortName(boss)
+
+        # If there is no start date, this is the best time as of the end date, which is the last
+        # entry in best_times at or before it
+        if (startDate is None):
+            cursor.execute('''SELECT log,time FROM best_times WHERE
+                              encounter = ? AND cm = ? AND date <= ?
+                              ORDER BY date DESC LIMIT 1''',
+                              (shortName, bool(isCm), endDate.timestamp(), ))
+        else:
+            # Convert bossId to the boss names. The name stored for a log depends on what dps.report called the
+            # boss, so match any of the names for the encounter
+            bossNames = sorted(dpsReport.dpsReportIds.shortNameToBossNames(shortName))
+            namePlaceholders = ','.join('?' * len(bossNames))
 
-        # Find best time so far
-        cursor.execute('''SELECT log,time FROM encounters WHERE
-                          (date BETWEEN ? AND ?) AND boss = ? AND cm = ? AND success = ?
-                          ORDER BY time ASC''',
-                          (startDate.timestamp(), endDate.timestamp(), bossName, isCm, True, ))
+            # Find best time in the range
+            cursor.execute('''SELECT log,time FROM encounters WHERE
+                              (date BETWEEN ? AND ?) AND boss IN ({:s}) AND cm = ? AND success = ?
+                              ORDER BY time ASC LIMIT 1'''.format(namePlaceholders),
+                              (startDate.timestamp(), endDate.timestamp(), *bossNames, isCm, True, ))
 
         result = cursor.fetchone()
         if (result is None):
@@ -188,10 +524,141 @@ class encounterDb():
 
         return (compTime - bestDuration)
 
-    def replayHistory(self, postConfig:Dict, encounterSet:es.encounterSet, startDate:datetime=None, endDate:datetime=None):
+    def export(self, filename:str, chunkSize:int=65536, compress:bool=True):
+        ''' Writes the encounters table to a NumPy .npz file with one array per column, for offline analysis.
+
+            The rows are streamed out of the database chunkSize at a time into memory mapped .npy files, which
+            are then zipped together, so the size of the history doesn't matter. Missing values are -1. Boss names
+            are dictionary encoded: boss holds an index into boss_names. record is 1 for kills that were a best
+            time when they happened. emboldened, started and ended (epoch seconds) come from the stored EI summaries.
+        '''
+        if (np is None):
+            raise RuntimeError('numpy is required to export the encounter database')
+
+        # Read everything from one snapshot, so the row count holds while the rows are streamed out
+        self.db.commit()
+        cursor = self.db.cursor()
+        cursor.execute('''BEGIN''')
+        cursor.execute('''SELECT COUNT(*), coalesce(MAX(LENGTH(log)), 1) FROM encounters''')
+        (numRows, logLength) = cursor.fetchone()
+
+        columns = {
+            'log': np.dtype('U{:d}'.format(logLength)),
+            'date': np.int64,
+            'boss': np.int32,
+            'time': np.int64,
+            'success': np.int8,
+            'cm': np.int8,
+            'record': np.int8,
+            'emboldened': np.int16,
+            'started': np.int64,
+            'ended': np.int64,
+        }
+
+        bossNames = {}
+
+        tmpDir = tempfile.mkdtemp(dir=(os.path.dirname(os.path.abspath(filename))))
+        try:
+            arrays = {name: open_memmap(os.path.join(tmpDir, name + '.npy'), mode='w+', dtype=dtype, shape=(numRows, ))
+                      for (name, dtype) in columns.items()}
+
+            cursor.execute('''SELECT e.log, coalesce(e.date, -1), e.boss, coalesce(e.time, -1), coalesce(e.success, -1),
+                              coalesce(e.cm, -1), (b.log IS NOT NULL),
+                              coalesce(s.emboldened, -1), coalesce(s.started, -1), coalesce(s.ended, -1)
+                              FROM encounters AS e
+                              LEFT JOIN best_times AS b ON (b.log = e.log)
+                              LEFT JOIN log_summary AS s ON (s.log = e.log)
+                              ORDER BY e.date ASC, e.log ASC''')
+
+            offset = 0
+            while True:
+                rows = cursor.fetchmany(chunkSize)
+                if (len(rows) == 0):
+                    break
+
+                (logs, dates, bosses, times, successes, cms, records, emboldened, started, ended) = zip(*rows)
+                end = offset + len(rows)
+
+                arrays['log'][offset:end] = logs
+                arrays['date'][offset:end] = dates
+                arrays['boss'][offset:end] = [bossNames.setdefault(b, len(bossNames)) if (b is not None) else -1 for b in bosses]
+                arrays['time'][offset:end] = times
+                arrays['success'][offset:end] = successes
+                arrays['cm'][offset:end] = cms
+                arrays['record'][offset:end] = records
+                arrays['emboldened'][offset:end] = emboldened
+                arrays['started'][offset:end] = started
+                arrays['ended'][offset:end] = ended
+
+                offset = end
+
+            for a in arrays.values():
+                a.flush()
+            del arrays
+
+            np.save(os.path.join(tmpDir, 'boss_names.npy'), np.array(list(bossNames), dtype=str))
+
+            compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+            with zipfile.ZipFile(filename, mode='w', compression=compression, allowZip64=True) as z:
+                for name in (*columns, 'boss_names'):
+                    z.write(os.path.join(tmpDir, name + '.npy'), arcname=name + '.npy')
+        finally:
+            shutil.rmtree(tmpDir, ignore_errors=True)
+            cursor.close()
+            self.db.rollback()
+
+        print('Exported {:d} logs to {:s}'.format(offset, filename))
+
+    def getKillStats(self, boss:int, isCm:bool, startDate:datetime=None, endDate:datetime=None,
+                     compTime:logUtils.logTime=None) -> 'killStats':
+        ''' Statistics on the successful kill times of an encounter, IE: for 'the 3rd fastest of 214 kills'.
+
+            The dates and times are loaded straight into NumPy arrays and everything is worked out from those, so
+            the cost doesn't grow with a Python object per kill. If compTime is given, its rank among the kills
+            is included as well.
+        '''
+        if (np is None):
+            raise RuntimeError('numpy is required for kill statistics')
+
+        if (endDate is None):
+            endDate = datetime.now()
+
+        if (startDate is None):
+            startTS = 0
+        else:
+            startTS = startDate.timestamp()
+
+        # The name stored for a log depends on what dps.report called the boss, so match any of the names
+        bossNames = sorted(dpsReport.dpsReportIds.shortNameToBossNames(dpsReport.dpsReportIds.idToShortName(boss)))
+        namePlaceholders = ','.join('?' * len(bossNames))
+
+        cursor = self.db.execute('''SELECT date, time FROM encounters WHERE
+                                    (date BETWEEN ? AND ?) AND boss IN ({:s}) AND cm = ? AND success = ?
+                                    AND (time IS NOT NULL)
+                                    ORDER BY date ASC'''.format(namePlaceholders),
+                                    (startTS, endDate.timestamp(), *bossNames, isCm, True, ))
+        kills = np.fromiter(cursor, dtype=[('date', np.int64), ('time', np.int64)])
+        cursor.close()
+
+        return killStats.fromArrays(dates=kills['date'], times=kills['time'], compTime=compTime)
+
+    def replayHistory(self, postConfig:Dict, encounterSet:es.encounterSet, globalConfig:Dict, startDate:datetime=None,
+                      endDate:datetime=None, outputDir:str=None, batchSize:int=16):
+        ''' Recreates the post for every session (calendar day, local time) in the database.
+
+            The encounters table is read in a single ordered pass and grouped into sessions as it goes. The best
+            times are tracked in memory, so each session compares against the bests from before it without any
+            extra queries. Sessions are handled batchSize at a time: the EI summaries for the whole batch are
+            fetched concurrently, then each message is prepared and sent in order.
+
+            If outputDir is given, the messages are written there as JSON files instead of being posted.
+        '''
         # Log Parser
         logParser = dpsReport.dpsReport()
 
+        # Get the local timezone, sessions are split on local days
+        localTz = datetime.utcnow().astimezone().tzinfo
+
         # If there is no start date, we just start at the first log in the database
         # We will floor it to the start of the day so that we don't have a weird start time
         # We want to floor the start time to the start of the day, but since getEarliestDate returns
@@ -199,59 +666,232 @@ class encounterDb():
         if (startDate is None):
             startDate = self.getEarliestDate()
 
-            # Get the local timezone and reset the startDate to be in that timezone
-            localTz = datetime.utcnow().astimezone().tzinfo
+            # Reset the startDate to be in the local timezone
             startDate = startDate.astimezone(tz=localTz)
 
             # Now zero-out the day
             startDate = startDate.replace(hour=0, minute=0, second=0, microsecond=0)
 
-
         # If there is no end date, we just end now
         if endDate is None:
             endDate = datetime.now(tz=timezone.utc)
 
-        # Step Size of 1 day
-        dateStep = timedelta(days=1)
+        if (outputDir is not None):
+            os.makedirs(outputDir, exist_ok=True)
 
-        # Get a cursor to walk through the database
-        cursor = self.db.cursor()
+        # Seed the running bests with everything from before the replay window
+        bests = runningBests.fromDb(db=self, asOf=startDate)
 
-        curStartDate = startDate
-        while (curStartDate < endDate):
-            # Isolate the search to a single day
-            curEndDate = curStartDate + dateStep
+        def finishBatch(batch:List[Tuple[datetime, List[dpsReport.dpsReportObj], runningBests]]):
+            # Fetch the summaries that aren't in the database for every session in the batch together, and keep
+            # them so the next replay doesn't need to
+            missing = [l for (_, logs, _) in batch for l in logs if l.encounter.summary is None]
+            if (len(missing) > 0):
+                logParser.getSummaries(logs=missing)
+                self.storeSummaries(missing)
 
-            cursor.execute('''SELECT * FROM encounters WHERE date BETWEEN ? AND ? ORDER BY date ASC''',
-                            (curStartDate.timestamp(), curEndDate.timestamp(), ))
+            for (sessionDate, logs, sessionBests) in batch:
+                # Reset the encounterSet
+                encounterSet.clear()
+                encounterSet.fillFromLogs(logs=logs)
 
-            # Light-weight
-            parsed_logs = []
-            for r in cursor:
-                (log, date, boss, time, success, cm) = r
-
-                bossId = next(key for key, value in dpsReport.bossNames.items() if value == boss)
-                eObj = dpsReport.dpsReportObjEncounter(success=success, accurateDuration=time, isCm=cm, boss=boss, bossId=bossId)
-                dObj = dpsReport.dpsReportObj(permalink=log, encounterTime=date, encounter=eObj)
-                parsed_logs.append(dObj)
-
-            # Kill this iteration if there was nothing
-            if (len(parsed_logs) == 0):
-                curStartDate = curEndDate
+                if (encounterSet.isEmpty()):
+                    continue
+
+                print('Session: {:s}'.format(sessionDate.isoformat()))
+                print(encounterSet)
+
+                # Create a post for this set
+                message = postUtils.prepareMessage(logParser=logParser, globalConfig=globalConfig, config=postConfig,
+                                                   encounterSet=encounterSet, db=sessionBests)
+
+                if (outputDir is not None):
+                    outFile = os.path.join(outputDir, '{:s}.json'.format(sessionDate.strftime('%Y-%m-%d')))
+                    with open(outFile, mode='w') as f:
+                        json.dump(message.to_dict(), f, indent=2)
+                else:
+                    logParser.run(postUtils.sendMessage(config=postConfig, message=message))
+
+        # Walk through the database once, in date order
+        cursor = self.db.cursor()
+        cursor.execute('''SELECT e.log, e.date, e.boss, e.time, e.success, e.cm,
+                          s.duration, s.cm, s.emboldened, s.started, s.ended, s.utc_offset, s.targets, s.players
+                          FROM encounters AS e LEFT JOIN log_summary AS s ON (s.log = e.log)
+                          WHERE e.date BETWEEN ? AND ? ORDER BY e.date ASC''',
+                        (startDate.timestamp(), endDate.timestamp(), ))
+
+        batch = []
+        sessionDate = None
+        sessionLogs = []
+        for r in cursor:
+            (log, date, boss, time, success, cm) = r[:6]
+
+            try:
+                bossId = dpsReport.dpsReportIds.bossNameToId(boss)
+            except KeyError:
+                print('Log: {:s} has unknown boss {}, skipping'.format(log, boss))
                 continue
 
-            # Reset the encounterSet
-            encounterSet.clear()
-            encounterSet.fillFromLogs(logs=parsed_logs)
+            # A new day starts a new session. Snapshot the bests for the finished session, then fold its kills in
+            logDate = datetime.fromtimestamp(date, tz=localTz).replace(hour=0, minute=0, second=0, microsecond=0)
+            if (logDate != sessionDate):
+                if (len(sessionLogs) > 0):
+                    batch.append((sessionDate, sessionLogs, bests.copy()))
+                    bests.update(sessionLogs)
 
-            print('Session: {:s} to {:s}'.format(curStartDate.isoformat(), curEndDate.isoformat()))
-            print(encounterSet)
+                    if (len(batch) >= batchSize):
+                        finishBatch(batch)
+                        batch = []
 
-            # Create a post for this set
-            postUtils.postLogs(logParser=logParser, config=postConfig, encounterSet=encounterSet, db=self)
+                sessionDate = logDate
+                sessionLogs = []
+
+            # Light-weight
+            eObj = dpsReport.dpsReportObjEncounter(success=success, accurateDuration=time, isCm=cm, boss=boss, bossId=bossId)
+            if (r[6] is not None):
+                eObj.summary = self._rowToSummary(r[6:])
+            dObj = dpsReport.dpsReportObj(permalink=log, encounterTime=date, encounter=eObj)
+            sessionLogs.append(dObj)
 
-            # Effectively steps by the dateStep
-            curStartDate = curEndDate
+        if (len(sessionLogs) > 0):
+            batch.append((sessionDate, sessionLogs, bests.copy()))
+
+        if (len(batch) > 0):
+            finishBatch(batch)
 
         # Close the cursor
         cursor.close()
+
+        logParser.close()
+
+@dataclass
+class killStats():
+    ''' Kill time statistics for an encounter, see encounterDb.getKillStats.
+
+        The weekly arrays line up with each other: weeks holds the timestamp of the start of each week (Monday,
+        UTC) that had a kill, killsPerWeek the number of kills in it, weekBest the fastest kill in it and
+        rollingBest the fastest kill up to the end of it. Times are in milliseconds.
+    '''
+    count:int = 0
+    median:logUtils.logTime = None
+    p90:logUtils.logTime = None
+    best:logUtils.logTime = None
+
+    weeks:'np.ndarray' = None
+    killsPerWeek:'np.ndarray' = None
+    weekBest:'np.ndarray' = None
+    rollingBest:'np.ndarray' = None
+
+    # Where the compared time would place among the kills, 1 being the fastest
+    rank:int = None
+
+    # Epoch time of the first Monday after the epoch, so weeks start on Mondays
+    weekOrigin = 4 * 24 * 60 * 60
+    weekLength = 7 * 24 * 60 * 60
+
+    @classmethod
+    def fromArrays(cls, dates:'np.ndarray', times:'np.ndarray', compTime:logUtils.logTime=None):
+        ''' Builds the statistics from the dates and times of the kills, which must be sorted by date
+        '''
+        if (len(times) == 0):
+            return cls(rank=(1 if (compTime is not None) else None))
+
+        (median, p90) = np.percentile(times, [50, 90])
+
+        # Dates are in order, so each week is a contiguous run
+        week = (dates - cls.weekOrigin) // cls.weekLength
+        (weekIds, starts, counts) = np.unique(week, return_index=True, return_counts=True)
+        weekBest = np.minimum.reduceat(times, starts)
+
+        rank = None
+        if (compTime is not None):
+            rank = int(np.count_nonzero(times < compTime.__toMs__())) + 1
+
+        return cls(count=len(times),
+                   median=logUtils.logTime.fromMs(ms=int(round(median))),
+                   p90=logUtils.logTime.fromMs(ms=int(round(p90))),
+                   best=logUtils.logTime.fromMs(ms=int(weekBest.min())),
+                   weeks=(weekIds * cls.weekLength) + cls.weekOrigin,
+                   killsPerWeek=counts,
+                   weekBest=weekBest,
+                   rollingBest=np.minimum.accumulate(weekBest),
+                   rank=rank)
+
+    def rankStr(self) -> str:
+        ''' IE: '3rd fastest of 214'
+        '''
+        if (self.rank is None):
+            return ''
+
+        if ((self.rank % 100) in (11, 12, 13)):
+            suffix = 'th'
+        else:
+            suffix = {1: 'st', 2: 'nd', 3: 'rd'}.get(self.rank % 10, 'th')
+
+        return '{:d}{:s} fastest of {:d}'.format(self.rank, suffix, max(self.count, self.rank))
+
+@dataclass
+class runningBests():
+    ''' In-memory best times per encounter short name and CM, used while replaying history.
+
+        Has the same compareTime as encounterDb so it can be handed to postUtils.prepareMessage in place of the
+        database. The dates passed to compareTime are ignored, the bests are whatever has been folded in so far.
+    '''
+    bests:Dict[Tuple[str, bool], int] = field(default_factory=dict)
+
+    @classmethod
+    def fromDb(cls, db:encounterDb, asOf:datetime):
+        ''' Loads the best times as of a date from the database
+        '''
+        # best_times only holds improvements, so the smallest time before the date is the best as of it
+        cursor = db.db.execute('''SELECT encounter, cm, MIN(time) FROM best_times WHERE date < ?
+                                  GROUP BY encounter, cm''',
+                                  (asOf.timestamp(), ))
+
+        return cls(bests={(encounter, bool(cm)): time for (encounter, cm, time) in cursor})
+
+    def copy(self):
+        return runningBests(bests=dict(self.bests))
+
+    def update(self, logs:List[dpsReport.dpsReportObj]):
+        ''' Folds the successful kills from a list of logs into the bests
+        '''
+        for l in logs:
+            if ((not l.encounter.success) or (l.encounter.accurateDuration is None)):
+                continue
+
+            try:
+                key = (dpsReport.dpsReportIds.idToShortName(l.encounter.bossId), bool(l.encounter.isCm))
+            except KeyError:
+                continue
+
+            if ((key not in self.bests) or (l.encounter.accurateDuration < self.bests[key])):
+                self.bests[key] = l.encounter.accurateDuration
+
+    def compareTime(self, compTime:logUtils.logTime, boss:int, isCm:bool, startDate:datetime=None, endDate:datetime=None) -> logUtils.logTime:
+        key = (dpsReport.dpsReportIds.idToShortName(boss), bool(isCm))
+
+        if (key not in self.bests):
+            return logUtils.logTime.fromMs(ms=0)
+
+        return (compTime - logUtils.logTime.fromMs(ms=self.bests[key]))
+
+# Command line access to the database for maintenance and analysis
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='OtterLogger encounter database tools')
+    parser.add_argument('database', help='The encounter database file')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    exportParser = subparsers.add_parser('export', help='Export the encounters to a NumPy .npz file')
+    exportParser.add_argument('output', help='The .npz file to write')
+    exportParser.add_argument('--chunk', type=int, default=65536, help='Rows read from the database at a time')
+    exportParser.add_argument('--no-compress', dest='compress', action='store_false', help='Store the arrays uncompressed')
+
+    args = parser.parse_args()
+
+    db = encounterDb(filename=args.database)
+
+    if (args.command == 'export'):
+        db.export(filename=args.output, chunkSize=args.chunk, compress=args.compress)
@@ -0,0 +1,513 @@
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+import mmap
+import os
+import re
+import struct
+import sys
+from typing import Dict,Iterator,List,Optional,Tuple
+import zipfile
+
+import dpsReport
+
+'''
+Layout of an arcDPS log (revision 1), all little endian:
+
+    header  12 bytes 'EVTC' + arcDPS build date (IE: EVTC20230110), 1 byte revision, uint16 boss species ID,
+            1 unused byte
+    agents  uint32 count, then count * 96 byte agents
+    skills  uint32 count, then count * 68 byte skills
+    events  64 byte combat events until the end of the file
+
+.zevtc files are the same thing inside a zip with a single entry.
+'''
+headerStruct = struct.Struct('<4s8sBHx')
+countStruct = struct.Struct('<I')
+
+# addr, prof, is_elite, toughness, concentration, healing, hitbox width, condition, hitbox height, name
+agentStruct = struct.Struct('<QIIhhhhhh64s4x')
+
+# id, name
+skillStruct = struct.Struct('<i64s')
+
+# time, src_agent, dst_agent, value, buff_dmg, overstack_value, skillid, src/dst instid, src/dst master instid,
+# iff, buff, result, is_activation, is_buffremove, is_ninety, is_fifty, is_moving, is_statechange, is_flanking,
+# is_shields, is_offcycle
+eventStruct = struct.Struct('<QQQiiIIHHHHBBBBBBBBBBBB4x')
+
+# Offset of is_statechange within an event
+stateChangeOffset = 56
+
+'''
+The statechanges (is_statechange) we look at. Anything that isn't a plain combat event has one of these set.
+'''
+stateChangeDead = 4
+stateChangeHealthUpdate = 8
+stateChangeLogStart = 9
+stateChangeLogEnd = 10
+stateChangeMaxHealthUpdate = 12
+stateChangeGwBuild = 15
+stateChangeReward = 17
+stateChangeBuffInitial = 18
+
+# is_elite of anything that isn't a player
+nonPlayerElite = 0xffffffff
+
+'''
+Species ID -> the boss max health above which the encounter is the challenge mote, the same cut EI makes for the
+bosses whose CM only shows up as extra health. arcDPS doesn't record CMs directly, so for a boss that isn't listed
+here (IE: CMs EI spots from a skill or buff) the log can't tell, and isCm is left as None.
+'''
+cmMaxHealth:Dict[int, int] = {
+    # Raids
+    17172: 25000000,    # Mursaat Overseer
+    17188: 30000000,    # Samarog
+    17154: 40000000,    # Deimos
+    19450: 35000000,    # Dhuum
+    21105: 18000000,    # Nikare (Twin Largos)
+    20934: 21000000,    # Qadim
+    22006: 23000000,    # Cardinal Adina
+    21964: 32000000,    # Cardinal Sabir
+    22000: 48000000,    # Qadim the Peerless
+
+    # Fractals
+    17021: 4500000,     # MAMA
+    17028: 5500000,     # Siax the Corrupted
+    16948: 12000000,    # Ensolyss of the Endless Torment
+    17632: 5500000,     # Skorvald the Shattered
+    17949: 5500000,     # Artsariiv
+    17759: 9000000,     # Arkk
+}
+
+'''
+Species IDs of encounters that aren't won by taking the boss's health down, so a fail can't be judged by how much
+health it has left: Escort (McLeod), Twisted Castle (Haunting Statue) and River of Souls (Desmina).
+'''
+healthlessSpecies = frozenset({16253, 16247, 19828})
+
+class evtcError(ValueError):
+    ''' Raised when a file is not an arcDPS log this module can read
+    '''
+    pass
+
+@dataclass(slots=True)
+class evtcAgent():
+    address: int
+    profession: int
+    isElite: int
+    toughness: int
+    concentration: int
+    healing: int
+    hitboxWidth: int
+    condition: int
+    hitboxHeight: int
+
+    # Players have their character name, account and subgroup packed into the name, NPCs only have a name
+    name: str
+    account: str = None
+    subgroup: str = None
+
+    @property
+    def isPlayer(self) -> bool:
+        return (self.isElite != nonPlayerElite)
+
+    @property
+    def isGadget(self) -> bool:
+        return (not self.isPlayer) and ((self.profession >> 16) == 0xffff)
+
+    @property
+    def speciesId(self) -> int:
+        ''' Species ID of an NPC, which is what dps.report and EI call the boss ID. None for players and gadgets
+        '''
+        if (self.isPlayer or self.isGadget):
+            return None
+
+        return self.profession & 0xffff
+
+    @classmethod
+    def fromBytes(cls, data:bytes, offset:int):
+        (address, prof, elite, toughness, concentration, healing, hitboxWidth, condition, hitboxHeight,
+         rawName) = agentStruct.unpack_from(data, offset)
+
+        names = rawName.split(b'\0')
+        name = names[0].decode('utf-8', errors='replace')
+        account = None
+        subgroup = None
+
+        if (elite != nonPlayerElite):
+            if (len(names) > 1):
+                account = sys.intern(names[1].decode('utf-8', errors='replace').lstrip(':'))
+            if (len(names) > 2):
+                subgroup = names[2].decode('utf-8', errors='replace')
+
+        return cls(address=address, profession=prof, isElite=elite, toughness=toughness, concentration=concentration,
+                   healing=healing, hitboxWidth=hitboxWidth, condition=condition, hitboxHeight=hitboxHeight,
+                   name=name, account=account, subgroup=subgroup)
+
+@dataclass(slots=True)
+class evtcEvent():
+    time: int
+    srcAgent: int
+    dstAgent: int
+    value: int
+    buffDmg: int
+    overstackValue: int
+    skillId: int
+    srcInstId: int
+    dstInstId: int
+    srcMasterInstId: int
+    dstMasterInstId: int
+    iff: int
+    buff: int
+    result: int
+    isActivation: int
+    isBuffRemove: int
+    isNinety: int
+    isFifty: int
+    isMoving: int
+    isStateChange: int
+    isFlanking: int
+    isShields: int
+    isOffcycle: int
+
+@dataclass
+class encounterFacts():
+    ''' What can be worked out about an encounter from the log alone, in the same terms dps.report uses.
+
+        duration   = Milliseconds from the start of the log to the kill, or to the end of the log for a fail
+        targets    = Tuple of (species ID, healthPercentBurned) of the boss targets
+        emboldened = Max Emboldened stacks any player started the encounter with
+        players    = Tuple of the account names of the squad
+        isCm       = None if the log alone can't tell, see cmMaxHealth
+    '''
+    bossId: int
+    boss: str
+    success: bool
+    isCm: Optional[bool]
+    duration: int
+    timeStart: datetime
+    timeEnd: datetime
+    gw2Build: int
+    emboldened: int
+    targets: Tuple[Tuple[int, float], ...]
+    players: Tuple[str, ...]
+
+    def toSummary(self) -> dpsReport.logSummary:
+        return dpsReport.logSummary(duration=self.duration, isCm=self.isCm, targets=self.targets,
+                                    emboldened=self.emboldened, timeStart=self.timeStart, timeEnd=self.timeEnd,
+                                    players=self.players)
+
+@dataclass
+class evtcLog():
+    ''' An arcDPS log read straight from disk.
+
+        The agent and skill tables are parsed up front. The events are kept as a view of the raw block (see
+        evtcArray for reading it with NumPy) and only unpacked when asked for, and the few statechange events
+        needed for the encounter facts are found by scanning the is_statechange column rather than unpacking
+        every event.
+    '''
+    path: str
+    arcVersion: str
+    revision: int
+    bossId: int
+    agents: List[evtcAgent]
+    skills: Dict[int, str]
+    eventData: memoryview = field(repr=False)
+
+    @property
+    def eventCount(self) -> int:
+        return len(self.eventData) // eventStruct.size
+
+    @classmethod
+    def fromBytes(cls, data:bytes, path:str=None):
+        ''' Parses an uncompressed log from anything that supports the buffer protocol. The events are not copied
+            out of it. Raises an evtcError if the data isn't an arcDPS log
+        '''
+        if (len(data) < headerStruct.size):
+            raise evtcError('Log is too short to have a header')
+
+        (magic, arcVersion, revision, bossId) = headerStruct.unpack_from(data, 0)
+        if (magic != b'EVTC'):
+            raise evtcError('Not an arcDPS log')
+
+        # Revision 0 logs use a different event layout and haven't been written since 2019
+        if (revision != 1):
+            raise evtcError('Log revision {:d} is not supported'.format(revision))
+
+        offset = headerStruct.size
+
+        try:
+            (agentCount, ) = countStruct.unpack_from(data, offset)
+            offset += countStruct.size
+            agents = [evtcAgent.fromBytes(data, offset + (i * agentStruct.size)) for i in range(agentCount)]
+            offset += agentCount * agentStruct.size
+
+            (skillCount, ) = countStruct.unpack_from(data, offset)
+            offset += countStruct.size
+            skills = {}
+            for (id, name) in skillStruct.iter_unpack(data[offset:offset + (skillCount * skillStruct.size)]):
+                skills[id] = name.split(b'\0', 1)[0].decode('utf-8', errors='replace')
+            offset += skillCount * skillStruct.size
+        except struct.error:
+            raise evtcError('Log is truncated') from None
+
+        # A log that is still being written can end part way through an event, drop the partial one
+        eventBytes = ((len(data) - offset) // eventStruct.size) * eventStruct.size
+        eventData = memoryview(data)[offset:offset + eventBytes]
+
+        return cls(path=path, arcVersion=sys.intern('EVTC' + arcVersion.decode('ascii', errors='replace')),
+                   revision=revision, bossId=bossId, agents=agents, skills=skills, eventData=eventData)
+
+    @classmethod
+    def fromFile(cls, path:str):
+        ''' Opens a .zevtc or a plain .evtc log
+        '''
+        if (zipfile.is_zipfile(path)):
+            with zipfile.ZipFile(path, mode='r') as z:
+                names = z.namelist()
+                if (len(names) == 0):
+                    raise evtcError('{:s} is an empty archive'.format(path))
+
+                data = z.read(names[0])
+        else:
+            # Plain logs are mapped rather than read, so the events are only paged in as they are used
+            with open(path, mode='rb') as f:
+                try:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                except ValueError:
+                    raise evtcError('{:s} is empty'.format(path)) from None
+
+        return cls.fromBytes(data, path=path)
+
+    def events(self) -> Iterator[evtcEvent]:
+        ''' Every event in the log, in the order arcDPS wrote them
+        '''
+        for e in eventStruct.iter_unpack(self.eventData):
+            yield evtcEvent(*e)
+
+    def stateChanges(self) -> Iterator[evtcEvent]:
+        ''' Only the statechange events. These are a small fraction of the log, so they are found by searching the
+            is_statechange byte of every event for anything but zero
+        '''
+        column = self.eventData[stateChangeOffset::eventStruct.size].tobytes()
+
+        for m in re.finditer(rb'[^\x00]', column):
+            yield evtcEvent(*eventStruct.unpack_from(self.eventData, m.start() * eventStruct.size))
+
+    def players(self) -> List[evtcAgent]:
+        return [a for a in self.agents if a.isPlayer]
+
+    def targetIds(self) -> List[int]:
+        ''' Species IDs that count as the boss for this log's encounter
+        '''
+        try:
+            return list(dpsReport.dpsReportIds.shortNameToIds(dpsReport.dpsReportIds.idToShortName(self.bossId)))
+        except KeyError:
+            return [self.bossId]
+
+    def facts(self) -> encounterFacts:
+        ''' Works out the encounter facts from the statechange events
+        '''
+        targetIds = set(self.targetIds())
+        targets = {a.address: a.speciesId for a in self.agents if (a.speciesId in targetIds)}
+        players = {a.address: a for a in self.agents if a.isPlayer}
+
+        firstTime = None
+        lastTime = None
+        startTime = None
+        endTime = None
+        serverStart = None
+        serverEnd = None
+        rewardTime = None
+        gw2Build = -1
+
+        # Last health update of each target species, in hundredths of a percent
+        health = {}
+        maxHealth = {}
+        deaths = {}
+        emboldened = {}
+
+        for e in self.stateChanges():
+            if (firstTime is None):
+                firstTime = e.time
+            lastTime = e.time
+
+            sc = e.isStateChange
+            if (sc == stateChangeLogStart):
+                startTime = e.time
+                serverStart = e.value
+            elif (sc == stateChangeLogEnd):
+                endTime = e.time
+                serverEnd = e.value
+            elif (sc == stateChangeHealthUpdate):
+                if (e.srcAgent in targets):
+                    health[targets[e.srcAgent]] = e.dstAgent
+            elif (sc == stateChangeMaxHealthUpdate):
+                if (e.srcAgent in targets):
+                    maxHealth[targets[e.srcAgent]] = max(maxHealth.get(targets[e.srcAgent], 0), e.dstAgent)
+            elif (sc == stateChangeDead):
+                if (e.srcAgent in targets):
+                    deaths[targets[e.srcAgent]] = e.time
+            elif (sc == stateChangeReward):
+                if (rewardTime is None):
+                    rewardTime = e.time
+            elif (sc == stateChangeGwBuild):
+                gw2Build = e.srcAgent
+            elif (sc == stateChangeBuffInitial):
+                # Every stack a player starts with gets its own event
+                if ((e.skillId == dpsReport.emboldenedID) and (e.srcAgent in players)):
+                    emboldened[e.srcAgent] = emboldened.get(e.srcAgent, 0) + 1
+
+        if (firstTime is None):
+            raise evtcError('Log has no statechange events')
+
+        if (startTime is None):
+            startTime = firstTime
+
+        # The raid bosses hand out a reward on the kill, everything else is a kill once every boss target has died
+        targetSpecies = set(targets.values())
+        success = (rewardTime is not None) or ((len(targetSpecies) > 0) and (targetSpecies <= deaths.keys()))
+
+        if (success):
+            end = rewardTime if (rewardTime is not None) else max(deaths.values())
+        else:
+            end = endTime if (endTime is not None) else lastTime
+
+        duration = end - startTime
+
+        # Server timestamps are unix seconds, shown in local time like EI does
+        if (serverStart is not None):
+            timeStart = datetime.fromtimestamp(serverStart, tz=timezone.utc).astimezone()
+        elif (self.path is None):
+            raise evtcError('Log has no start time')
+        else:
+            timeStart = datetime.fromtimestamp(os.path.getmtime(self.path), tz=timezone.utc).astimezone()
+
+        if (serverEnd is not None):
+            timeEnd = datetime.fromtimestamp(serverEnd, tz=timezone.utc).astimezone()
+        else:
+            timeEnd = timeStart + timedelta(milliseconds=duration)
+
+        targetHealth = []
+        for species in dict.fromkeys(targets.values()):
+            if (success or (species in deaths)):
+                burned = 100.0
+            else:
+                burned = 100.0 - (health.get(species, 10000) / 100.0)
+            targetHealth.append((species, burned))
+
+        known = [species for species in maxHealth if (species in cmMaxHealth)]
+        if (len(known) > 0):
+            isCm = any(maxHealth[species] > cmMaxHealth[species] for species in known)
+        else:
+            isCm = None
+
+        try:
+            boss = dpsReport.dpsReportIds.idToBossName(self.bossId)
+        except KeyError:
+            boss = next((a.name for a in self.agents if (a.speciesId == self.bossId)), '')
+
+        return encounterFacts(bossId=self.bossId, boss=sys.intern(boss), success=success, isCm=isCm, duration=duration,
+                              timeStart=timeStart, timeEnd=timeEnd, gw2Build=gw2Build,
+                              emboldened=max(emboldened.values(), default=0), targets=tuple(targetHealth),
+                              players=tuple(a.account for a in players.values() if (a.account is not None)))
+
+    def toLogObject(self) -> dpsReport.dpsReportObj:
+        ''' Builds a log object like the ones dps.report hands back, with the summary already filled in. The
+            permalink is the path of the file, since the log hasn't been uploaded
+        '''
+        facts = self.facts()
+        players = self.players()
+
+        encounter = dpsReport.dpsReportObjEncounter(
+            success = facts.success,
+            duration = facts.duration // 1000,
+            numberOfPlayers = len(players),
+            numberOfGroups = len({p.subgroup for p in players}),
+            bossId = facts.bossId,
+            boss = facts.boss,
+            # Same as a null isCm from dps.report
+            isCm = bool(facts.isCm),
+            gw2Build = facts.gw2Build,
+            accurateDuration = facts.duration,
+            summary = facts.toSummary(),
+        )
+
+        return dpsReport.dpsReportObj(
+            id = os.path.splitext(os.path.basename(self.path))[0],
+            permalink = self.path,
+            encounterTime = int(facts.timeStart.timestamp()),
+            etvc = dpsReport.dpsReportObjEtvc(version=self.arcVersion, bossId=self.bossId),
+            encounter = encounter,
+            rawPlayers = tuple((p.account, sys.intern(p.name), p.profession, p.isElite) for p in players),
+        )
+
+def loadLogs(paths:List[str]) -> List[Tuple[str, dpsReport.dpsReportObj]]:
+    ''' Parses logs locally. Returns (path, log) in the order given, with None for anything that couldn't be read
+    '''
+    rtn = []
+    for path in paths:
+        try:
+            obj = evtcLog.fromFile(path).toLogObject()
+        except (evtcError, OSError, zipfile.BadZipFile) as e:
+            print('Log {:s} could not be read: {}'.format(path, e))
+            obj = None
+
+        rtn.append((path, obj))
+
+    return rtn
+
+@dataclass
+class triageRules():
+    ''' Decides from the log alone whether it is worth uploading at all.
+
+        A fail night is mostly short pulls and resets where the boss was never touched. dps.report rejects the
+        shortest of these, and posts leave the untouched ones out, but only after the whole file has been
+        uploaded and its JSON fetched. Reading the statechanges locally is a tiny fraction of that.
+    '''
+    # Milliseconds. Elite Insights refuses logs shorter than 2.2s, so dps.report would reject them anyway
+    minDuration: int = 2200
+
+    # Skip fails where every boss target is still at or above untouchedHealth percent, the same cutoff posts use.
+    # Success is only known locally from a reward or the boss dying, and raid rewards are weekly, so only pulls
+    # shorter than untouchedMaxDuration (milliseconds) are treated as resets
+    skipUntouched: bool = True
+    untouchedHealth: float = 99.9
+    untouchedMaxDuration: int = 60000
+
+    def reason(self, facts:encounterFacts) -> str:
+        ''' Returns why a log should be skipped, or None if it should be uploaded
+        '''
+        if (facts.duration < self.minDuration):
+            return 'too short'
+
+        if (self.skipUntouched and (not facts.success) and (facts.duration < self.untouchedMaxDuration) and
+            (facts.bossId not in healthlessSpecies) and (len(facts.targets) > 0) and
+            all((100.0 - burned) >= self.untouchedHealth for (_, burned) in facts.targets)):
+            return 'untouched'
+
+        return None
+
+    def check(self, path:str) -> str:
+        ''' Same as reason, for a log on disk. Logs that can't be read here are left for dps.report to judge
+        '''
+        try:
+            facts = evtcLog.fromFile(path).facts()
+        except (evtcError, OSError, zipfile.BadZipFile):
+            return None
+
+        return self.reason(facts)
+
+    def triage(self, paths:List[str]) -> Tuple[List[str], List[Tuple[str, str]]]:
+        ''' Splits logs into the ones to upload and the (path, reason) of the ones to skip
+        '''
+        keep = []
+        skipped = []
+        for path in paths:
+            reason = self.check(path)
+            if (reason is None):
+                keep.append(path)
+            else:
+                skipped.append((path, reason))
+
+        return (keep, skipped)
@@ -0,0 +1,166 @@
+from dataclasses import dataclass, field
+from typing import Dict,List,Tuple
+
+# numpy is optional, it's only needed for reading the events as an array
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import dpsReport
+import evtc
+
+'''
+The combat event layout of evtc.eventStruct as a NumPy dtype, so the event block of a log can be used as an
+array of records without copying it.
+'''
+if (np is not None):
+    eventDtype = np.dtype([
+        ('time', '<u8'),
+        ('srcAgent', '<u8'),
+        ('dstAgent', '<u8'),
+        ('value', '<i4'),
+        ('buffDmg', '<i4'),
+        ('overstackValue', '<u4'),
+        ('skillId', '<u4'),
+        ('srcInstId', '<u2'),
+        ('dstInstId', '<u2'),
+        ('srcMasterInstId', '<u2'),
+        ('dstMasterInstId', '<u2'),
+        ('iff', 'u1'),
+        ('buff', 'u1'),
+        ('result', 'u1'),
+        ('isActivation', 'u1'),
+        ('isBuffRemove', 'u1'),
+        ('isNinety', 'u1'),
+        ('isFifty', 'u1'),
+        ('isMoving', 'u1'),
+        ('isStateChange', 'u1'),
+        ('isFlanking', 'u1'),
+        ('isShields', 'u1'),
+        ('isOffcycle', 'u1'),
+        ('pad', '<u4'),
+    ])
+
+    assert (eventDtype.itemsize == evtc.eventStruct.size)
+else:
+    eventDtype = None
+
+@dataclass
+class evtcArray():
+    ''' The combat events of an arcDPS log as a NumPy structured array.
+
+        The array is a view of the log's event block, which is either the mapped file (.evtc) or the
+        decompressed buffer (.zevtc), so nothing is copied or decoded per event. Queries are done with masks
+        over whole columns instead of looping over events, which keeps them to a few milliseconds even for logs
+        with millions of events.
+    '''
+    log: evtc.evtcLog
+    events: 'np.ndarray' = field(init=False, repr=False)
+
+    def __post_init__(self):
+        if (np is None):
+            raise RuntimeError('numpy is required to read the events as an array')
+
+        self.events = np.frombuffer(self.log.eventData, dtype=eventDtype)
+
+    @classmethod
+    def fromFile(cls, path:str):
+        return cls(log=evtc.evtcLog.fromFile(path))
+
+    def targetAddresses(self) -> List[int]:
+        ''' Agent addresses of the boss targets of the encounter
+        '''
+        targetIds = set(self.log.targetIds())
+        return [a.address for a in self.log.agents if (a.speciesId in targetIds)]
+
+    def playerAddresses(self) -> List[int]:
+        return [a.address for a in self.log.agents if a.isPlayer]
+
+    def stateChanges(self, kind:int) -> 'np.ndarray':
+        ''' All the events of one statechange, IE: evtc.stateChangeHealthUpdate
+        '''
+        return self.events[self.events['isStateChange'] == kind]
+
+    def _combatMask(self) -> 'np.ndarray':
+        ''' Events that are neither statechanges, skill activations nor buff removals
+        '''
+        e = self.events
+        return (e['isStateChange'] == 0) & (e['isActivation'] == 0) & (e['isBuffRemove'] == 0)
+
+    def damageMask(self) -> 'np.ndarray':
+        ''' Direct hits (value) and condition ticks (buff_dmg) that did damage
+        '''
+        e = self.events
+        direct = (e['buff'] == 0) & (e['value'] > 0)
+        condition = (e['buff'] != 0) & (e['value'] == 0) & (e['buffDmg'] > 0)
+
+        return self._combatMask() & (direct | condition)
+
+    def buffApplies(self, buffId:int, includeInitial:bool=True) -> Tuple['np.ndarray', 'np.ndarray']:
+        ''' Returns (time, agent) of every application of a buff. Buffs that were already on an agent when the log
+            started (BUFFINITIAL) are included by default
+        '''
+        e = self.events
+
+        # An application has the duration in value, a zero value is the buff ticking damage instead
+        applied = self._combatMask() & (e['buff'] != 0) & (e['value'] != 0) & (e['skillId'] == buffId)
+        times = e['time'][applied]
+        agents = e['dstAgent'][applied]
+
+        if (includeInitial):
+            initial = (e['isStateChange'] == evtc.stateChangeBuffInitial) & (e['skillId'] == buffId)
+            times = np.concatenate((e['time'][initial], times))
+            agents = np.concatenate((e['srcAgent'][initial], agents))
+
+        return (times, agents)
+
+    def emboldened(self) -> int:
+        ''' Max number of Emboldened stacks any player was given, the same value the EI summary reports
+        '''
+        (_, agents) = self.buffApplies(dpsReport.emboldenedID)
+        agents = agents[np.isin(agents, self.playerAddresses())]
+        if (len(agents) == 0):
+            return 0
+
+        return int(np.unique(agents, return_counts=True)[1].max())
+
+    def healthUpdates(self, addresses:List[int]=None) -> Dict[int, Tuple['np.ndarray', 'np.ndarray']]:
+        ''' Returns agent address -> (time, health percent) of the health updates of each agent, by default only
+            the boss targets
+        '''
+        if (addresses is None):
+            addresses = self.targetAddresses()
+
+        updates = self.stateChanges(evtc.stateChangeHealthUpdate)
+        updates = updates[np.isin(updates['srcAgent'], addresses)]
+
+        # dst_agent holds the health in hundredths of a percent
+        rtn = {}
+        for address in addresses:
+            mine = updates[updates['srcAgent'] == address]
+            if (len(mine) > 0):
+                rtn[address] = (mine['time'], mine['dstAgent'] / 100.0)
+
+        return rtn
+
+    def lastHits(self, addresses:List[int]=None) -> Dict[int, Tuple[int, int]]:
+        ''' Returns agent address -> (time, source agent) of the last damaging hit on each agent, by default only
+            the boss targets
+        '''
+        if (addresses is None):
+            addresses = self.targetAddresses()
+
+        e = self.events
+        damage = self.damageMask()
+        times = e['time']
+
+        # There are only ever a handful of targets, so one pass per target beats sorting every hit
+        rtn = {}
+        for address in addresses:
+            hits = np.flatnonzero(damage & (e['dstAgent'] == address))
+            if (len(hits) > 0):
+                last = hits[times[hits].argmax()]
+                rtn[address] = (int(times[last]), int(e['srcAgent'][last]))
+
+        return rtn
@@ -0,0 +1,220 @@
+from bisect import bisect_left,bisect_right
+from dataclasses import dataclass, field
+from datetime import datetime
+import json
+import os
+import re
+from typing import Dict,List,Set
+
+import dpsReport
+
+'''
+arcDPS names logs after the time the encounter started, IE: 20230115-201534.zevtc. The names sort in the same
+order as the times, so they can be compared as strings.
+'''
+logNamePattern = re.compile(r'^(\d{8}-\d{6})')
+logNameFormat = '%Y%m%d-%H%M%S'
+
+@dataclass
+class logScanner():
+    ''' Finds new logs in the arcDPS log folder.
+
+        For every boss folder, the scanner remembers the name of the newest log that was processed (the
+        watermark) and the modified time of the folder at that point. On the next scan a folder that hasn't
+        been modified is skipped entirely, and otherwise only names after the watermark are considered. Since
+        the names are timestamps, finding them is a bisect of the sorted names rather than a stat of every
+        file in the folder's history.
+
+        The watermarks are only moved forward by commit(), so a run that fails part way will pick the same
+        logs up again next time. commit() can also be told which of the scanned logs were actually processed,
+        in which case each folder only moves up to the first log that wasn't.
+
+        The state file keeps a separate set of watermarks for each key (the config names), so posting the
+        same session to another config later still finds the logs. A scanner for several keys only skips what
+        all of them have processed, and commits for all of them.
+    '''
+    logFolderPath:str
+    stateFile:str = None
+    keys:List[str] = field(default_factory=lambda: ['default'])
+
+    # Key -> folder name -> watermark, as stored in the state file
+    state:Dict[str, Dict[str, Dict]] = field(init=False, default_factory=dict)
+
+    # Folder name -> {'last': timestamp of the newest processed log, 'mtime': folder modified time}, the oldest
+    # of the keys' watermarks for the folder
+    watermarks:Dict[str, Dict] = field(init=False, default_factory=dict)
+
+    # Watermarks from the last scan that haven't been committed yet
+    pending:Dict[str, Dict] = field(init=False, default_factory=dict)
+
+    # Folder name -> logs the last scan returned from it
+    scanned:Dict[str, List[str]] = field(init=False, default_factory=dict)
+
+    def __post_init__(self):
+        if ((self.stateFile is not None) and os.path.exists(self.stateFile)):
+            try:
+                with open(self.stateFile, mode='r') as f:
+                    self.state = json.load(f)
+            except (OSError, ValueError):
+                print('Could not read scan state from {:s}, scanning everything'.format(self.stateFile))
+                self.state = {}
+
+            # Older state files had one set of watermarks for every config, which can't be split up
+            if (any(isinstance(v, dict) and ('last' in v) for v in self.state.values())):
+                print('Scan state in {:s} is from an older version, scanning everything'.format(self.stateFile))
+                self.state = {}
+
+        self.watermarks = self._merge()
+
+    def _merge(self) -> Dict[str, Dict]:
+        ''' Folder watermarks that hold for every key. A folder only some keys have processed has none
+        '''
+        merged = {}
+        for name in self.state.get(self.keys[0], {}):
+            marks = [self.state.get(k, {}).get(name) for k in self.keys]
+            if (any(m is None for m in marks)):
+                continue
+
+            lasts = [m['last'] for m in marks]
+            mtimes = set(m['mtime'] for m in marks)
+            merged[name] = {'last': None if (None in lasts) else min(lasts),
+                            'mtime': mtimes.pop() if (len(mtimes) == 1) else None}
+
+        return merged
+
+    def scan(self, startTime:datetime, shortNames:Set[str], useWatermark:bool=True, verbose:bool=True) -> List[str]:
+        ''' Returns the paths of all logs started after startTime for the given encounter short names. If
+            useWatermark is set, logs that were already processed in a previous run are skipped as well.
+        '''
+        cutoffTS = startTime.timestamp()
+        cutoffName = startTime.strftime(logNameFormat)
+
+        logsToParse = []
+        self.pending = {}
+        self.scanned = {}
+
+        with os.scandir(self.logFolderPath) as logFolder:
+            # First directory in logs are the boss directories
+            for bossDir in logFolder:
+                if (not bossDir.is_dir()):
+                    continue
+
+                # Filter out bosses that aren't in the encounterSet
+                try:
+                    bossSN = dpsReport.dpsReportIds.folderNameToShortName(bossDir.name)
+                except KeyError:
+                    if (verbose):
+                        print('Folder {:s} did not match known boss'.format(bossDir.name))
+                    continue
+
+                if (bossSN not in shortNames):
+                    continue
+
+                # Filter out bosses that haven't been done after the cutoff
+                modifiedTS = bossDir.stat().st_mtime
+                if (modifiedTS < cutoffTS):
+                    continue
+
+                # Nothing has been added to the folder since the last time it was processed
+                watermark = self.watermarks.get(bossDir.name) if useWatermark else None
+                if ((watermark is not None) and (watermark['mtime'] == modifiedTS)):
+                    continue
+
+                lastName = watermark['last'] if (watermark is not None) else None
+
+                newLogs = self._scanFolder(bossDir.path, cutoffTS=cutoffTS, cutoffName=cutoffName, lastName=lastName)
+                if (len(newLogs) == 0):
+                    # Still remember the folder time so it doesn't get listed again until something changes
+                    if (watermark is not None):
+                        self.pending[bossDir.name] = {'last': lastName, 'mtime': modifiedTS}
+                    continue
+
+                if (verbose):
+                    print(bossDir.name)
+                    for l in newLogs:
+                        print('--> {}'.format(os.path.basename(l)))
+
+                logsToParse.extend(newLogs)
+                self.scanned[bossDir.name] = newLogs
+
+                # The newest timestamp becomes the watermark once the logs are committed
+                stamps = [m.group(1) for m in (logNamePattern.match(os.path.basename(l)) for l in newLogs) if m]
+                if (lastName is not None):
+                    stamps.append(lastName)
+                last = max(stamps, default=None)
+
+                self.pending[bossDir.name] = {'last': last, 'mtime': modifiedTS}
+
+        return logsToParse
+
+    @staticmethod
+    def _scanFolder(path:str, cutoffTS:float, cutoffName:str, lastName:str=None) -> List[str]:
+        ''' Returns the logs in a boss folder that started at or after cutoffName, and strictly after lastName
+            if it is given
+        '''
+        named = []
+        unnamed = []
+        for name in os.listdir(path):
+            # Filter non-zevtc files in case something else has parsed the logs
+            if (not name.endswith('.zevtc')):
+                continue
+
+            m = logNamePattern.match(name)
+            if (m):
+                named.append((m.group(1), name))
+            else:
+                unnamed.append(name)
+
+        # Bisect straight to the first log after the lower bounds
+        named.sort()
+        stamps = [ts for (ts, _) in named]
+        start = bisect_left(stamps, cutoffName)
+        if (lastName is not None):
+            start = max(start, bisect_right(stamps, lastName))
+
+        newLogs = [os.path.join(path, n) for (_, n) in named[start:]]
+
+        # Anything that was renamed can't be placed by name, so fall back to the modified time
+        for name in unnamed:
+            logPath = os.path.join(path, name)
+            if (os.stat(logPath).st_mtime >= cutoffTS):
+                newLogs.append(logPath)
+
+        return newLogs
+
+    def commit(self, processed:Set[str]=None):
+        ''' Moves the watermarks up to the logs returned by the last scan and stores them. If processed is given,
+            a folder with logs that aren't in it only moves up to the newest log before the first of those, and
+            the folder is listed again next scan so they get picked up.
+        '''
+        pending = self.pending
+        if (processed is not None):
+            pending = {}
+            for (name, watermark) in self.pending.items():
+                logs = self.scanned.get(name, [])
+                if (all(l in processed for l in logs)):
+                    pending[name] = watermark
+                    continue
+
+                stamps = [(m.group(1), l) for (m, l) in ((logNamePattern.match(os.path.basename(l)), l) for l in logs) if m]
+                firstLeft = min((ts for (ts, l) in stamps if l not in processed), default=None)
+
+                previous = self.watermarks.get(name)
+                done = [ts for (ts, l) in stamps if (l in processed) and ((firstLeft is None) or (ts < firstLeft))]
+                if ((previous is not None) and (previous['last'] is not None)):
+                    done.append(previous['last'])
+
+                if (len(done) > 0):
+                    pending[name] = {'last': max(done), 'mtime': None}
+
+        self.watermarks.update(pending)
+        for k in self.keys:
+            self.state.setdefault(k, {}).update(pending)
+        self.pending = {}
+        self.scanned = {}
+
+        if (self.stateFile is None):
+            return
+
+        with open(self.stateFile, mode='w') as f:
+            json.dump(self.state, f, indent=2)
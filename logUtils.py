@@ -66,34 +66,15 @@ class logTime():
     def fromLog(cls, logParser:dpsReport, log:dpsReport.dpsReportObj):
         ''' Creates a logTime object from a log.
 
-            Duration within the log is stored in a string within the JSON. This method will parse the string and split
-            out the time accordingly. If this step has already been done for the log, just use the parsed time.
+            Duration within the log is stored in a string within the JSON, which the EI summary parses. If this step
+            has already been done for the log, just use the parsed time.
         '''
 
         if (log.encounter.accurateDuration is None):
-            # Fetch EI Raw Output if not already done
-            if (log.encounter.json is None):
-                log.encounter.json = logParser.getJson(id=log.id)
-
-            # Grab the duration string from the JSON
-            # There is technically a durationMS in newer logs which would make this easier, but because
-            # the class stores the broken down values, we'll stick to the old method
-            duration = log.encounter.json['duration']
-
-            # Encounter time is a string, so parse it out of the JSON
-            mins = int(duration[:2])
-            secs = int(duration[4:6])
-            ms   = int(duration[7:-2])
-
-            totalMs = ms + (1000*secs) + (60*1000*mins)
-
             # Store the result in case we need it later
-            log.encounter.accurateDuration = totalMs
+            log.encounter.accurateDuration = getSummary(logParser=logParser, log=log).duration
 
-            # Return the packed class
-            return cls(mins=mins, secs=secs, ms=ms)
-        else:
-            return logTime.fromMs(log.encounter.accurateDuration)
+        return logTime.fromMs(log.encounter.accurateDuration)
 
     @classmethod
     def fromMs(cls, ms:int):
@@ -117,105 +98,50 @@ class logTime():
         # Return the packed class
         return cls(mins=mins, secs=secs, ms=msRemaining, negative=negative)
 
+def getSummary(logParser:dpsReport, log:dpsReport.dpsReportObj) -> dpsReport.logSummary:
+    ''' Returns the EI summary of a log. If the full EI JSON has already been loaded onto the log, the summary
+        is built from it, otherwise only the summary is fetched. Either way it is kept on the log, so the JSON
+        is only ever visited once no matter how many of the values below are needed. Returns None if the
+        summary couldn't be fetched.
+    '''
+    if (log.encounter.summary is None):
+        if (log.encounter.json is not None):
+            log.encounter.summary = dpsReport.logSummary.fromDict(log.encounter.json)
+        else:
+            logParser.getSummary(log)
+
+    return log.encounter.summary
+
 def getPercentage(logParser:dpsReport, log:dpsReport.dpsReportObj, allowedIDs:List[int]) -> List[float]:
     ''' Returns the remaining health percentage of each target within a log. If there are multiple targets,
         the percentages will be returned in the order they were encountered in
     '''
-    # Fetch EI Raw Output if not already done
-    if (log.encounter.json is None):
-        log.encounter.json = logParser.getJson(id=log.id)
-
-    healthPercentages = []
-    for target in log.encounter.json['targets']:
-        # Trash Targets are set to negative numbers
-        if (target['id'] < 0):
-            continue
+    summary = getSummary(logParser=logParser, log=log)
 
-        # Skip non-boss targets
-        if (target['id'] not in allowedIDs):
-            continue
-
-        healthPercentages.append(100.0 - target['healthPercentBurned'])
-
-    return healthPercentages
+    # Trash Targets are set to negative numbers, and non-boss targets are skipped
+    return [100.0 - burned for (id, burned) in summary.targets if (id >= 0) and (id in allowedIDs)]
 
 def getEmboldened(logParser:dpsReport, log:dpsReport.dpsReportObj) -> int:
     ''' Returns if this log is Emboldened and by how much. If the log is not Emboldened, it will
         return 0.
     '''
-    # Fetch EI Raw Output if not already done
-    if (log.encounter.json is None):
-        log.encounter.json = logParser.getJson(id=log.id)
-
-    emboldenedStacksMax = 0
-
-    # Search each player and each phase for the max emboldened stacks
-    # Technically it can differ per player, and it shouldn't change per phase,
-    # but the full fight values seem to differ slighly from the phase values
-    for player in log.encounter.json['players']:
-        # Skip NPCs
-        try:
-            if (player['friendlyNPC']):
-                continue
-        except:
-            continue
-
-        for buff in player['buffUptimes']:
-            # Filter only for Emboldened
-            if (buff['id'] != dpsReport.emboldenedID):
-                continue
-
-            for phase in buff['buffData']:
-                if (phase['uptime'] > emboldenedStacksMax):
-                    emboldenedStacksMax = phase['uptime']
-
-    # Sometimes Emboldened stacks are not quite integers even though they should be
-    emboldenedStacksMax = round(emboldenedStacksMax)
-
-    return emboldenedStacksMax
+    return getSummary(logParser=logParser, log=log).emboldened
 
 def getCm(logParser:dpsReport, log:dpsReport.dpsReportObj) -> bool:
     ''' Returns a bool indicating if this is a CM encounter or not.
     '''
-
-    # Fetch EI Raw Output if not already done
-    if (log.encounter.json is None):
-        log.encounter.json = logParser.getJson(id=log.id)
-
-    return (log.encounter.json['isCM'])
+    return getSummary(logParser=logParser, log=log).isCm
 
 def getStartAndEndTimes(logParser:dpsReport, log:dpsReport.dpsReportObj) -> Tuple[datetime, datetime]:
     ''' Returns a datetime for both the start and end time of the log.
     '''
+    summary = getSummary(logParser=logParser, log=log)
 
-    # Fetch EI Raw Output if not already done
-    if (log.encounter.json is None):
-        log.encounter.json = logParser.getJson(id=log.id)
-
-    # Try to fast way first
-    try:
-        startTimeStr = log.encounter.json['timeStartStd']
-        endTimeStr = log.encounter.json['timeEndStd']
-
-        startTime = datetime.fromisoformat(startTimeStr)
-        endTime = datetime.fromisoformat(endTimeStr)
-
-    # Older logs don't have the standard field we we need to fix them up a bit
-    except:
-        startTimeStr = log.encounter.json['timeStart']
-        endTimeStr = log.encounter.json['timeEnd']
-
-        startTimeStr += ':00'
-        endTimeStr += ':00'
-
-        startTime = datetime.fromisoformat(startTimeStr)
-        endTime = datetime.fromisoformat(endTimeStr)
-
-    print('Start: {}, End {}'.format(startTime, endTime))
+    print('Start: {}, End {}'.format(summary.timeStart, summary.timeEnd))
 
-    return (startTime, endTime)
+    return (summary.timeStart, summary.timeEnd)
 
 def linkToLogObject(parser:dpsReport.dpsReport, links:List[str]) -> List[dpsReport.dpsReportObj]:
-    ''' Given a list of log links, will return a the parsed objects
+    ''' Given a list of log links, will return a the parsed objects. Links dps.report couldn't resolve are left out
     '''
-    return parser.getUploadMetaDatas(identifiers=links, isId=False)
\ No newline at end of file
+    return [obj for obj in parser.getUploadMetaDatas(identifiers=links, isId=False) if obj is not None]
\ No newline at end of file
@@ -0,0 +1,110 @@
+import asyncio
+from dataclasses import dataclass, field
+from datetime import datetime
+import os
+import time
+from typing import Dict,List,Set,Tuple
+import zipfile
+
+import logScanner
+
+# watchdog is optional. Without it the watcher falls back to polling the log folder
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
+
+@dataclass
+class logWatcher():
+    ''' Watches the arcDPS log folder for new logs while a session is in progress.
+
+        arcDPS writes the log out over a few seconds once an encounter ends, so a new file is only handed out
+        once its size and modified time have stayed the same for settleTime seconds and it reads as a complete
+        zip. If watchdog is installed, file system events wake the watcher up as soon as something changes,
+        otherwise the folder is polled every pollInterval seconds.
+    '''
+    scanner:logScanner.logScanner
+    shortNames:Set[str]
+    startTime:datetime
+    pollInterval:float = 5.0
+    settleTime:float = 5.0
+
+    # Path -> (size, mtime) of files that were seen but aren't finished yet
+    candidates:Dict[str, Tuple[int, float]] = field(init=False, default_factory=dict)
+
+    # Paths that have already been handed out
+    handled:Set[str] = field(init=False, default_factory=set)
+
+    wakeup:asyncio.Event = field(init=False, default=None, repr=False)
+    observer:object = field(init=False, default=None, repr=False)
+
+    def start(self):
+        ''' Starts listening for file system events if watchdog is available. Must be called from the event loop
+        '''
+        self.wakeup = asyncio.Event()
+
+        if (Observer is None):
+            print('watchdog not installed, polling {:s} every {} seconds'.format(self.scanner.logFolderPath, self.pollInterval))
+            return
+
+        loop = asyncio.get_running_loop()
+        wakeup = self.wakeup
+
+        class handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                loop.call_soon_threadsafe(wakeup.set)
+
+        self.observer = Observer()
+        self.observer.schedule(handler(), self.scanner.logFolderPath, recursive=True)
+        self.observer.start()
+
+    def stop(self):
+        if (self.observer is not None):
+            self.observer.stop()
+            self.observer.join()
+            self.observer = None
+
+    async def wait(self):
+        ''' Waits until the next check is due, or something changes in the log folder
+        '''
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), timeout=self.pollInterval)
+        except asyncio.TimeoutError:
+            pass
+
+        self.wakeup.clear()
+
+    def poll(self) -> List[str]:
+        ''' Returns the logs that have finished being written since the last poll
+        '''
+        now = time.time()
+        ready = []
+
+        for path in self.scanner.scan(startTime=self.startTime, shortNames=self.shortNames, verbose=False):
+            if (path in self.handled):
+                continue
+
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                self.candidates.pop(path, None)
+                continue
+
+            current = (stat.st_size, stat.st_mtime)
+            previous = self.candidates.get(path)
+            self.candidates[path] = current
+
+            # Still being written
+            if ((previous != current) or ((now - stat.st_mtime) < self.settleTime)):
+                continue
+
+            # The zip directory is written last, so this only passes once the file is complete
+            if (not zipfile.is_zipfile(path)):
+                continue
+
+            del self.candidates[path]
+            self.handled.add(path)
+            ready.append(path)
+
+        return ready
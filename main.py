@@ -1,90 +1,79 @@
 import argparse
+import asyncio
 from dataclasses import dataclass, field
-from datetime import date, datetime, timedelta
+from datetime import datetime, timedelta
 import json
 import os
 import sys
 import time
-from typing import List
+from typing import Dict,List,Set,Tuple
 
 import dpsReport
 import encounterDb
 import encounterSet as es
+import evtc
+import logScanner
 import logUtils
+import logWatcher
+import metrics
+import pipeline
 import postUtils
 
-def getLogs(logFolderPath:str, startTime:timedelta, logParser:dpsReport.dpsReport, encounterSet:es.encounterSet) -> List[dpsReport.dpsReportObj]:
+def getLogs(scanner:logScanner.logScanner, startTime:datetime, logParser:dpsReport.dpsReport, shortNames:Set[str],
+            rescan:bool=False, db:encounterDb.encounterDb=None, triage:evtc.triageRules=None) -> Tuple[List[dpsReport.dpsReportObj], Set[str]]:
+    ''' Uploads the new logs and returns them, along with the paths that are done with: uploaded, rejected by
+        dps.report or skipped by triage. Logs that failed to upload are left out so the next run tries them again
+    '''
     # Find all the logs we want to parse
-    logsToParse = []
-
-    with os.scandir(logFolderPath) as logFolder:
-        # First directory in logs are the boss directories
-        for bossDir in logFolder:
-            bossDirStat = os.stat(bossDir.path)
-            modifiedTS   = bossDirStat.st_mtime
-
-            # Filter out bosses that haven't been done after the cutoff
-            if (modifiedTS < startTime.timestamp()):
-                continue
-
-            # Filter out bosses that aren't in the encounterSet
-            encounterFilterList = encounterSet.getEncounterShortNames()
-
-            try:
-                bossSN = dpsReport.dpsReportIds.folderNameToShortName(bossDir.name)
-            except:
-                print('Folder {:s} did not match known boss'.format(bossDir.name))
-                continue
-
-            if (bossSN not in encounterFilterList):
-                continue
-
-            print(bossDir.name)
-            # Go through the boss folder now and look for logs
-            with os.scandir(bossDir.path) as bossFolder:
-                for log in bossFolder:
-                    logStat = os.stat(log.path)
-                    logModifiedTS = logStat.st_mtime
-                    logModifiedTime = date.fromtimestamp(logModifiedTS)
-
-                    # Filter out logs that are older than the cutoff
-                    if (logModifiedTS < startTime.timestamp()):
-                        continue
-
-                    # Filter non-zevtc files in case something else has parsed the logs
-                    logName, logExtension = os.path.splitext(log)
-                    if logExtension != '.zevtc':
-                        continue
+    # Unless a rescan is requested, anything processed by a previous run is skipped
+    with logParser.metrics.span('scan'):
+        logsToParse = scanner.scan(startTime=startTime, shortNames=shortNames, useWatermark=(not rescan))
+    logParser.metrics.inc('logs_found_total', len(logsToParse))
+
+    # Drop short pulls and resets before they are uploaded
+    if (triage is not None):
+        with logParser.metrics.span('triage'):
+            (logsToParse, skipped) = triage.triage(logsToParse)
+
+        for (logName, reason) in skipped:
+            print('Log {:s} was skipped before upload, {:s}'.format(logName, reason))
+            logParser.metrics.inc('logs_triaged_total', reason=reason)
+    else:
+        skipped = []
 
-                    print('--> {}, {}'.format(logName, logModifiedTime))
-                    logsToParse.append(log.path)
+    processed = set(logName for (logName, _) in skipped)
 
-    # Parse all the logs through dps.report
-    uploadedLogs = logParser.uploadLogs(logsToParse)
+    # Parse all the logs through dps.report. Each upload goes on to have its summary fetched and to be imported
+    # into the db while the rest are still uploading
+    logPipeline = pipeline.logPipeline(logParser=logParser, db=db)
+    uploadedLogs = logPipeline.run(logsToParse)
 
     # Grab only the log object out of the response, notifiy if it failed to upload
     parsedLogs = []
     for (logName, obj) in uploadedLogs:
         if obj is not None:
             parsedLogs.append(obj)
+            processed.add(logName)
+        elif (logName in logPipeline.failed):
+            print('Log {:s} could not be uploaded, it will be tried again next run'.format(logName))
+            logParser.metrics.inc('logs_upload_failed_total')
         else:
             print('Log {:s} was skipped because it was too short'.format(logName))
+            logParser.metrics.inc('logs_rejected_total')
+            processed.add(logName)
 
-    return parsedLogs
+    return (parsedLogs, processed)
 
-def postLogs(configName:str, cutoffTime:float=2, successTitle:str=None, failureTitle:str=None, file:str=None):
+def loadConfig(configName:str, successTitle:str=None, failureTitle:str=None) -> Tuple[Dict, Dict]:
+    ''' Opens the configuration file and grabs the selected configuration out of it.
+        Returns both the full configuration and the selected one.
+    '''
     # Open Configuration
     with open('config.json', mode='r') as f:
         config_json = f.read()
 
     config = json.loads(config_json)
 
-    logFolderPath = config['log_folder']
-    dpsReportUserToken = config['dpsReport']['userToken']
-
-    # Set the Global Configuration
-    globalConfig = config['globalConfig']
-
     # Grab the selected configuration
     try:
         configSettings = config['configs'][configName]
@@ -102,26 +91,80 @@ def postLogs(configName:str, cutoffTime:float=2, successTitle:str=None, failureT
     if (failureTitle is not None):
         configSettings['defaultFail'] = failureTitle
 
-    includeFailures = configSettings['includeFails']
+    return (config, configSettings)
 
-    # Load / Create the Encounter Database
+def openDb(configSettings:Dict) -> encounterDb.encounterDb:
+    ''' Load / Create the Encounter Database if the configuration has one
+    '''
     if ('encounterDb' in configSettings):
-        db = encounterDb.encounterDb(filename=configSettings['encounterDb'])
+        return encounterDb.encounterDb(filename=configSettings['encounterDb'])
     else:
-        db = None
+        return None
 
-    # Search back the past X hours
-    logCutoff = datetime.now() - timedelta(hours=cutoffTime)
-    print('Cutoff time: {}'.format(logCutoff))
+def createLogParser(config:Dict, runMetrics:metrics.runMetrics=None) -> dpsReport.dpsReport:
+    dpsReportUserToken = config['dpsReport']['userToken']
+
+    # The EI JSON cache lives on disk between runs. Allow the location and size cap to be overridden
+    cacheDir = config['dpsReport'].get('cacheDir', 'cache')
+    cacheMaxBytes = int(config['dpsReport'].get('cacheMaxMB', 1024) * 1024 * 1024)
+
+    # Upper bound on the number of requests to dps.report in flight at once. The client finds the actual
+    # limit the server is happy with at runtime
+    maxConcurrency = config['dpsReport'].get('maxConcurrency', 16)
+
+    # Only changed for testing against a stand-in server
+    baseUrl = config['dpsReport'].get('baseUrl', 'https://dps.report/')
+
+    return dpsReport.dpsReport(token=dpsReportUserToken, cacheDir=cacheDir, cacheMaxBytes=cacheMaxBytes,
+                               maxConcurrency=maxConcurrency, baseUrl=baseUrl, runMetrics=runMetrics)
+
+def writeMetrics(config:Dict, runMetrics:metrics.runMetrics):
+    ''' Writes the timings of the run to a JSON report (by default next to the cache), and to a Prometheus
+        textfile if one is configured
+    '''
+    metricsConfig = config.get('metrics', {})
+
+    cacheDir = config['dpsReport'].get('cacheDir', 'cache')
+    defaultReport = os.path.join(cacheDir, 'lastRun.json') if (cacheDir is not None) else None
+
+    reportFile = metricsConfig.get('reportFile', defaultReport)
+    if (reportFile is not None):
+        runMetrics.writeReport(reportFile)
+
+    prometheusFile = metricsConfig.get('prometheusFile', None)
+    if (prometheusFile is not None):
+        runMetrics.writePrometheus(prometheusFile)
+
+def createTriage(config:Dict) -> evtc.triageRules:
+    ''' Rules for skipping logs before they are uploaded. On unless the config turns it off
+    '''
+    triageConfig = config.get('triage', {})
+    if (not triageConfig.get('enabled', True)):
+        return None
+
+    return evtc.triageRules(minDuration=int(triageConfig.get('minDurationSeconds', 2.2) * 1000),
+                            skipUntouched=triageConfig.get('skipUntouched', True),
+                            untouchedMaxDuration=int(triageConfig.get('untouchedMaxSeconds', 60) * 1000))
+
+def createScanner(config:Dict, configNames:List[str]) -> logScanner.logScanner:
+    # Remember which logs have been processed so the next run only looks at new ones. Each config keeps its own
+    # watermarks, so posting the session to one config doesn't hide its logs from another
+    cacheDir = config['dpsReport'].get('cacheDir', 'cache')
+    if (cacheDir is not None):
+        scanStateFile = os.path.join(cacheDir, 'scan.json')
+    else:
+        scanStateFile = None
 
-    logParser = dpsReport.dpsReport(token=dpsReportUserToken)
+    return logScanner.logScanner(logFolderPath=config['log_folder'], stateFile=scanStateFile, keys=list(configNames))
 
-    # Load the output format specified by the selected config.
-    # This builds the encounterSet that the logs are parsed into and used for final formatting
+def loadEncounterSet(config:Dict, configSettings:Dict) -> es.encounterSet:
+    ''' Load the output format specified by the selected config.
+        This builds the encounterSet that the logs are parsed into and used for final formatting
+    '''
     selectedEncounterSet = configSettings['encounterSet']
     if (selectedEncounterSet in config['encounterSets']):
         print('Using {:s} encounter set'.format(selectedEncounterSet))
-        encounterSet = es.encounterSet.fromFormat(format=config['encounterSets'][selectedEncounterSet])
+        return es.encounterSet.fromFormat(format=config['encounterSets'][selectedEncounterSet])
     else:
         print('Encounter Sets {:s} not defined in config file.'.format(selectedEncounterSet))
         print('Defined Encounter Sets:')
@@ -129,10 +172,51 @@ def postLogs(configName:str, cutoffTime:float=2, successTitle:str=None, failureT
             print('--> {:s}'.format(k))
         sys.exit()
 
+def postLogs(configNames:List[str], cutoffTime:float=2, successTitle:str=None, failureTitle:str=None, file:str=None,
+             rescan:bool=False):
+    ''' Posts the session to every config given. The logs are scanned, uploaded and fetched once, then sorted into
+        each config's encounter set and the posts are all sent at the same time
+    '''
+    configs = [loadConfig(configName=n, successTitle=successTitle, failureTitle=failureTitle) for n in configNames]
+
+    # Everything outside of the selected configs is the same file, so take it from the first
+    config = configs[0][0]
+    settings = [configSettings for (_, configSettings) in configs]
+
+    # Set the Global Configuration
+    globalConfig = config['globalConfig']
+
+    # Configs that use the same database share the connection
+    dbs = {}
+    for configSettings in settings:
+        if (configSettings.get('encounterDb') not in dbs):
+            db = openDb(configSettings)
+            if (db is not None):
+                dbs[configSettings['encounterDb']] = db
+
+    # Search back the past X hours
+    logCutoff = datetime.now() - timedelta(hours=cutoffTime)
+    print('Cutoff time: {}'.format(logCutoff))
+
+    # Stage timings, request latencies and counts for the run report
+    runMetrics = metrics.runMetrics()
+
+    logParser = createLogParser(config, runMetrics=runMetrics)
+
+    encounterSets = [loadEncounterSet(config, configSettings) for configSettings in settings]
+
     # Upload source determination
     # Either grab the raw files from the session, or upload from the input text file
     if (file is None):
-        parsed_logs = getLogs(logFolderPath=logFolderPath, startTime=logCutoff, logParser=logParser, encounterSet=encounterSet)
+        scanner = createScanner(config, configNames)
+
+        # One scan and upload covers the bosses of every config. Logs are only imported while they upload if
+        # there is a single database to import them into
+        shortNames = set().union(*(e.getEncounterShortNames() for e in encounterSets))
+        pipelineDb = next(iter(dbs.values())) if (len(dbs) == 1) else None
+        (parsed_logs, processed) = getLogs(scanner=scanner, startTime=logCutoff, logParser=logParser,
+                                           shortNames=shortNames, rescan=rescan, db=pipelineDb,
+                                           triage=createTriage(config))
 
         for log in parsed_logs:
             print(log.permalink)
@@ -152,41 +236,267 @@ def postLogs(configName:str, cutoffTime:float=2, successTitle:str=None, failureT
 
     if (len(parsed_logs) == 0):
         print('No logs found after criteria applied, bailing early')
+        if (file is None):
+            scanner.commit(processed=processed)
+        writeMetrics(config, runMetrics)
+        logParser.close()
         return
 
-    # Import into the db if it exists
-    if (db is not None):
-        db.importLogs(logs=parsed_logs, parser=logParser)
+    # Import into the dbs if there are any. Uploaded logs may already have been imported as they came in, this
+    # picks up links from a file, anything whose summary couldn't be fetched then, and any other databases
+    for db in dbs.values():
+        with runMetrics.span('db import'):
+            db.importLogs(logs=parsed_logs, parser=logParser)
 
 
-    #db.replayHistory(postConfig=configSettings, encounterSet=encounterSet)
-    #db.replayHistory(postConfig=configSettings, encounterSet=encounterSet,
+    #db.replayHistory(postConfig=configSettings, encounterSet=encounterSet, globalConfig=globalConfig)
+    #db.replayHistory(postConfig=configSettings, encounterSet=encounterSet, globalConfig=globalConfig,
     #                 startDate=datetime(year=2020, month=10, day=19, tzinfo=datetime.utcnow().astimezone().tzinfo))
     #sys.exit()
 
-    # Sort the logs into the encounters we care about
-    encounterSet.fillFromLogs(logs=parsed_logs, includeFailures=includeFailures)
+    posts = []
+    for (configName, configSettings, encounterSet) in zip(configNames, settings, encounterSets):
+        db = dbs.get(configSettings.get('encounterDb'))
+
+        # Sort the logs into the encounters this config cares about
+        with runMetrics.span('sort logs'):
+            encounterSet.fillFromLogs(logs=parsed_logs, includeFailures=configSettings['includeFails'])
+
+        print(encounterSet)
+
+        if (encounterSet.isEmpty()):
+            print('No logs for {:s}, not posting'.format(configName))
+            continue
+
+        # Pre-cache the JSONs to speed up posting
+        # This allows us to fetch in bulk rather than one at a time, since we end up needing all of the JSONs anyway.
+        # The logs are shared between the configs, so anything fetched for one is there for the rest
+        postUtils.prefetchLogJson(logParser=logParser, encounterSet=encounterSet, db=db)
+
+        posts.append(postUtils.postLogsAsync(logParser=logParser, globalConfig=globalConfig, config=configSettings,
+                                             encounterSet=encounterSet, db=db))
+
+    # Upload to the webhooks, all at once
+    async def postAll():
+        return await asyncio.gather(*posts, return_exceptions=True)
+
+    failed = [r for r in logParser.run(postAll()) if isinstance(r, Exception)]
+    for e in failed:
+        print('Posting failed: {}'.format(e))
+
+    # Everything was posted, so the scanned logs don't need to be looked at again. If a post failed, they are
+    # picked up again next run
+    if ((file is None) and (len(failed) == 0)):
+        scanner.commit(processed=processed)
+
+    writeMetrics(config, runMetrics)
+
+    logParser.close()
+
+def previewLogs(configNames:List[str], cutoffTime:float=2, rescan:bool=False):
+    ''' Reads the session's logs locally and prints what would be posted for each config, without uploading
+        anything. The scanned logs are left for the next real run
+    '''
+    configs = [loadConfig(configName=n) for n in configNames]
+    config = configs[0][0]
+
+    # Search back the past X hours
+    logCutoff = datetime.now() - timedelta(hours=cutoffTime)
+    print('Cutoff time: {}'.format(logCutoff))
+
+    encounterSets = [loadEncounterSet(config, configSettings) for (_, configSettings) in configs]
+
+    scanner = createScanner(config, configNames)
+    logsToParse = scanner.scan(startTime=logCutoff, shortNames=set().union(*(e.getEncounterShortNames() for e in encounterSets)),
+                               useWatermark=(not rescan))
+
+    triage = createTriage(config)
+    if (triage is not None):
+        (logsToParse, skipped) = triage.triage(logsToParse)
+        for (logName, reason) in skipped:
+            print('Log {:s} would be skipped before upload, {:s}'.format(logName, reason))
+
+    parsedLogs = [obj for (_, obj) in evtc.loadLogs(logsToParse) if obj is not None]
+    parsedLogs.sort(key=lambda l: l.encounterTime)
+
+    for log in parsedLogs:
+        print('{:s} {:s} {} {:s}'.format(log.encounter.boss, 'Kill' if log.encounter.success else 'Fail',
+                                         logUtils.logTime.fromMs(log.encounter.accurateDuration), log.permalink))
+
+    # Sort the logs into the encounters each config cares about
+    for ((_, configSettings), encounterSet) in zip(configs, encounterSets):
+        encounterSet.fillFromLogs(logs=parsedLogs, includeFailures=configSettings['includeFails'])
+
+        print(encounterSet)
+
+def watchLogs(configName:str, cutoffTime:float=2, successTitle:str=None, failureTitle:str=None, idleTime:float=30):
+    ''' Runs until interrupted, uploading logs and fetching their JSON as soon as arcDPS finishes writing
+        them. The session is posted once no new logs have shown up for idleTime minutes (0 disables this),
+        or when the watcher is stopped with Ctrl+C.
+    '''
+    (config, configSettings) = loadConfig(configName=configName, successTitle=successTitle, failureTitle=failureTitle)
+
+    # Set the Global Configuration
+    globalConfig = config['globalConfig']
+
+    includeFailures = configSettings['includeFails']
+
+    db = openDb(configSettings)
+
+    # Logs from the past X hours are picked up as well, in case the watcher was started late
+    logCutoff = datetime.now() - timedelta(hours=cutoffTime)
+    print('Cutoff time: {}'.format(logCutoff))
+
+    # The report is rewritten after every session, so it covers the whole time the watcher has been running
+    runMetrics = metrics.runMetrics()
+
+    logParser = createLogParser(config, runMetrics=runMetrics)
+
+    encounterSet = loadEncounterSet(config, configSettings)
+
+    scanner = createScanner(config, [configName])
+    watcher = logWatcher.logWatcher(scanner=scanner, shortNames=set(encounterSet.getEncounterShortNames()), startTime=logCutoff)
+
+    # Logs that are done for the current session, and the ones still being worked on
+    sessionLogs = []
+    pending = set()
+
+    # Paths that are completely done with: uploaded and summarized, rejected by dps.report or skipped by triage.
+    # Only these move the scan watermarks, anything else is picked up again by the next run
+    finished = set()
 
-    print(encounterSet)
+    triage = createTriage(config)
 
-    # Pre-cache the JSONs to speed up posting
-    # This allows us to fetch in bulk rather than one at a time, since we end up needing all of the JSONs anyway
-    postUtils.prefetchLogJson(logParser=logParser, encounterSet=encounterSet)
+    async def processLog(path:str):
+        try:
+            # Drop short pulls and resets before they are uploaded
+            if (triage is not None):
+                reason = await asyncio.to_thread(triage.check, path)
+                if (reason is not None):
+                    print('Log {:s} was skipped before upload, {:s}'.format(path, reason))
+                    runMetrics.inc('logs_triaged_total', reason=reason)
+                    finished.add(path)
+                    return
 
-    # Upload to webhook
-    postUtils.postLogs(logParser=logParser, globalConfig=globalConfig, config=configSettings, encounterSet=encounterSet, db=db)
+            obj = await logParser.uploadLogAsync(path)
+            if (obj is None):
+                print('Log {:s} was skipped because it was too short'.format(path))
+                finished.add(path)
+                return
+
+            print(obj.permalink)
+
+            # Grab the JSON right away, so the post at the end of the session is all local
+            await logParser.getSummariesAsync([obj])
+            if (obj.encounter.summary is None):
+                print('Log {:s} has no summary, it will be tried again next run'.format(path))
+                return
+
+            sessionLogs.append(obj)
+            finished.add(path)
+        except Exception as e:
+            print('Log {:s} failed: {}'.format(path, e))
+
+    async def finishSession():
+        # Wait on anything still uploading
+        if (pending):
+            await asyncio.gather(*pending)
+
+        if (len(sessionLogs) == 0):
+            scanner.commit(processed=finished)
+            return
+
+        # Logs can keep finishing while the post is sent, so only what is in the session now is posted and committed
+        logs = sorted(sessionLogs, key=lambda l: l.encounterTime)
+        done = set(finished)
+
+        # Import into the db if it exists
+        if (db is not None):
+            with runMetrics.span('db import'):
+                db.importLogs(logs=logs, parser=logParser)
+
+        # Sort the logs into the encounters we care about
+        encounterSet.clear()
+        encounterSet.fillFromLogs(logs=logs, includeFailures=includeFailures)
+
+        print(encounterSet)
+
+        # Upload to webhook. If it fails the session is kept as it is, so the next idle check or Ctrl+C posts it
+        if (not encounterSet.isEmpty()):
+            try:
+                await postUtils.postLogsAsync(logParser=logParser, globalConfig=globalConfig, config=configSettings,
+                                              encounterSet=encounterSet, db=db)
+            except Exception as e:
+                print('Posting failed, keeping the session to try again: {}'.format(e))
+                writeMetrics(config, runMetrics)
+                return
+
+        # Everything was posted, so the logs that finished don't need to be looked at again. Files still being
+        # written and logs that failed are left for the next run
+        posted = set(id(l) for l in logs)
+        sessionLogs[:] = [l for l in sessionLogs if (id(l) not in posted)]
+        scanner.commit(processed=done)
+
+        writeMetrics(config, runMetrics)
+
+    async def watch():
+        watcher.start()
+        print('Watching {:s}, press Ctrl+C to post the session and stop'.format(config['log_folder']))
+
+        lastActivity = time.monotonic()
+        while True:
+            for path in watcher.poll():
+                task = asyncio.create_task(processLog(path))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+
+            if (pending):
+                lastActivity = time.monotonic()
+
+            # Post the session if things have been quiet for long enough
+            if ((idleTime > 0) and (len(sessionLogs) > 0) and ((time.monotonic() - lastActivity) > (idleTime * 60))):
+                await finishSession()
+
+                # A failed post is tried again after another idle period rather than on every poll
+                lastActivity = time.monotonic()
+
+            await watcher.wait()
+
+    watchTask = logParser.loop.create_task(watch())
+    try:
+        logParser.run(watchTask)
+    except KeyboardInterrupt:
+        print('Stopping, posting the current session')
+        watchTask.cancel()
+        logParser.run(finishSession())
+    finally:
+        watcher.stop()
+        logParser.close()
 
 # Main Entry Point
 if __name__ == '__main__':
     # Build Argument Parser
     parser = argparse.ArgumentParser(description='OtterLogger GW2 ArcDPS Log Uploader')
-    parser.add_argument('config', help='The config name to use')
+    parser.add_argument('config', nargs='+', help='The config names to use, the session is posted to each of them. Use "watch <config>" to upload logs as they are written')
     parser.add_argument('-t', dest='time', type=float, default=3, help="Hours to go back for start of logs. Can be fractional hours.")
     parser.add_argument('--title', help='Custom title of post. Overrides config default')
     parser.add_argument('--fails', help='Custom failure title. Overrides config default')
     parser.add_argument('-f', '--file', help='Use logs from file')
+    parser.add_argument('--rescan', action='store_true', help='Include logs that were already processed by a previous run')
+    parser.add_argument('--idle', type=float, default=30, help='Watch mode: minutes without new logs before the session is posted. 0 waits for Ctrl+C')
+    parser.add_argument('--offline', action='store_true', help='Read the logs locally and print the session without uploading or posting')
 
     args = parser.parse_args()
 
     # Run the parser
-    postLogs(configName=args.config, cutoffTime=args.time, successTitle=args.title, failureTitle=args.fails, file=args.file)
\ No newline at end of file
+    if (args.config[0] == 'watch'):
+        if (len(args.config) != 2):
+            parser.error('watch takes exactly one config name')
+
+        watchLogs(configName=args.config[1], cutoffTime=args.time, successTitle=args.title, failureTitle=args.fails, idleTime=args.idle)
+    else:
+        if (args.offline):
+            previewLogs(configNames=args.config, cutoffTime=args.time, rescan=args.rescan)
+            sys.exit()
+
+        postLogs(configNames=args.config, cutoffTime=args.time, successTitle=args.title, failureTitle=args.fails, file=args.file, rescan=args.rescan)
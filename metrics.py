@@ -0,0 +1,176 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+import json
+import os
+import time
+from typing import Dict,List,Tuple
+
+'''
+Upper bounds (seconds) of the latency histogram buckets. Requests to dps.report range from a few hundred
+milliseconds for metadata to minutes for a large upload on a bad night.
+'''
+latencyBuckets = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# Labels are stored as a sorted tuple of (name, value) so they can be used as a key
+Labels = Tuple[Tuple[str, str], ...]
+
+def _labels(labels:Dict) -> Labels:
+    return tuple(sorted((k, str(v)) for (k, v) in labels.items()))
+
+@dataclass
+class histogram():
+    ''' A cumulative histogram, in the same shape Prometheus uses
+    '''
+    buckets:Tuple[float, ...] = latencyBuckets
+    counts:List[int] = field(default=None)
+    sum:float = 0.0
+    count:int = 0
+
+    def __post_init__(self):
+        if (self.counts is None):
+            # The last count is for everything above the largest bucket
+            self.counts = [0] * (len(self.buckets) + 1)
+
+    def observe(self, value:float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        ''' Returns (upper bound, observations at or below it) for every bucket, ending with +Inf
+        '''
+        rtn = []
+        total = 0
+        for (bound, count) in zip((*self.buckets, float('inf')), self.counts):
+            total += count
+            rtn.append(('+Inf' if (bound == float('inf')) else repr(bound), total))
+
+        return rtn
+
+@dataclass
+class runMetrics():
+    ''' Timings and counts for a single run of the uploader.
+
+        Stages of the run are timed with span(), requests to dps.report are recorded as latency histograms and
+        byte counts, and anything else worth knowing about (retries, malformed JSON, cache hits...) is a
+        counter. At the end of the run the whole thing can be written out as a JSON report, and as a
+        Prometheus textfile for the node exporter to pick up.
+    '''
+    # (name, start time, seconds) of each finished span, in the order they finished
+    spans:List[Tuple[str, datetime, float]] = field(default_factory=list)
+
+    counters:Dict[Tuple[str, Labels], float] = field(default_factory=dict)
+    histograms:Dict[Tuple[str, Labels], histogram] = field(default_factory=dict)
+
+    startTime:datetime = field(default_factory=datetime.now)
+
+    @contextmanager
+    def span(self, name:str, verbose:bool=True):
+        ''' Times the enclosed block as a named stage of the run. Works around sync and async code alike
+        '''
+        start = datetime.now()
+        startCounter = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - startCounter
+            self.spans.append((name, start, seconds))
+
+            if (verbose):
+                print('{:s} took {:.3f}s'.format(name, seconds))
+
+    def inc(self, name:str, value:float=1, **labels):
+        key = (name, _labels(labels))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name:str, value:float, **labels):
+        key = (name, _labels(labels))
+        if (key not in self.histograms):
+            self.histograms[key] = histogram()
+
+        self.histograms[key].observe(value)
+
+    def stageTimes(self) -> Dict[str, float]:
+        ''' Total seconds spent in each span name
+        '''
+        totals = {}
+        for (name, _, seconds) in self.spans:
+            totals[name] = totals.get(name, 0) + seconds
+
+        return totals
+
+    def report(self) -> Dict:
+        ''' Everything recorded so far as a JSON friendly dictionary
+        '''
+        def labelled(key:Tuple[str, Labels]) -> Dict:
+            (name, labels) = key
+            return {'name': name, 'labels': dict(labels)}
+
+        return {
+            'start': self.startTime.isoformat(timespec='seconds'),
+            'seconds': (datetime.now() - self.startTime).total_seconds(),
+            'stages': self.stageTimes(),
+            'spans': [{'name': n, 'start': s.isoformat(timespec='milliseconds'), 'seconds': sec} for (n, s, sec) in self.spans],
+            'counters': [dict(labelled(k), value=v) for (k, v) in sorted(self.counters.items())],
+            'histograms': [dict(labelled(k), count=h.count, sum=h.sum, buckets=dict(h.cumulative()))
+                           for (k, h) in sorted(self.histograms.items())],
+        }
+
+    def writeReport(self, filename:str):
+        _writeAtomic(filename, json.dumps(self.report(), indent=2))
+
+    def prometheus(self, prefix:str='otterlogger_') -> str:
+        ''' Everything recorded so far in the Prometheus text exposition format
+        '''
+        def fmtLabels(labels:Labels, extra:Labels=()) -> str:
+            allLabels = labels + extra
+            if (len(allLabels) == 0):
+                return ''
+
+            return '{' + ','.join('{:s}="{:s}"'.format(k, v.replace('\\', '\\\\').replace('"', '\\"')) for (k, v) in allLabels) + '}'
+
+        lines = []
+
+        lines.append('# HELP {:s}stage_seconds Seconds spent in each stage of the last run'.format(prefix))
+        lines.append('# TYPE {:s}stage_seconds gauge'.format(prefix))
+        for (name, seconds) in self.stageTimes().items():
+            lines.append('{:s}stage_seconds{:s} {!r}'.format(prefix, fmtLabels((('stage', name), )), seconds))
+
+        lines.append('# HELP {:s}last_run_timestamp_seconds Time the last run started'.format(prefix))
+        lines.append('# TYPE {:s}last_run_timestamp_seconds gauge'.format(prefix))
+        lines.append('{:s}last_run_timestamp_seconds {!r}'.format(prefix, self.startTime.timestamp()))
+
+        typed = set()
+        for ((name, labels), value) in sorted(self.counters.items()):
+            if (name not in typed):
+                lines.append('# TYPE {:s}{:s} counter'.format(prefix, name))
+                typed.add(name)
+            lines.append('{:s}{:s}{:s} {!r}'.format(prefix, name, fmtLabels(labels), value))
+
+        for ((name, labels), h) in sorted(self.histograms.items()):
+            if (name not in typed):
+                lines.append('# TYPE {:s}{:s} histogram'.format(prefix, name))
+                typed.add(name)
+            for (bound, count) in h.cumulative():
+                lines.append('{:s}{:s}_bucket{:s} {:d}'.format(prefix, name, fmtLabels(labels, (('le', bound), )), count))
+            lines.append('{:s}{:s}_sum{:s} {!r}'.format(prefix, name, fmtLabels(labels), h.sum))
+            lines.append('{:s}{:s}_count{:s} {:d}'.format(prefix, name, fmtLabels(labels), h.count))
+
+        return '\n'.join(lines) + '\n'
+
+    def writePrometheus(self, filename:str):
+        # The node exporter may read the file at any moment, so it has to be swapped in whole
+        _writeAtomic(filename, self.prometheus())
+
+def _writeAtomic(filename:str, text:str):
+    directory = os.path.dirname(filename)
+    if (directory != ''):
+        os.makedirs(directory, exist_ok=True)
+
+    tmpName = filename + '.tmp'
+    with open(tmpName, mode='w') as f:
+        f.write(text)
+
+    os.replace(tmpName, filename)
@@ -0,0 +1,133 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import Dict,List,Set,Tuple
+
+import dpsReport
+import encounterDb
+
+@dataclass
+class logPipeline():
+    ''' Uploads logs and gets them ready to post as a stream rather than in lock step.
+
+        Each log goes through three stages connected by bounded queues:
+            upload   -> uploadWindow workers upload the file to dps.report
+            summary  -> summaryWindow workers fetch the EI summary of the upload
+            database -> a single worker imports finished logs into the encounterDb in small batches
+
+        A log moves on to the next stage as soon as it is done with the previous one, so summaries are being
+        fetched while other files are still uploading. The queues are bounded, so if a later stage falls behind
+        the earlier ones wait on it instead of piling up results. Only the logs currently in a stage are held
+        open, so file handles and memory stay the same no matter how many logs are passed in.
+    '''
+    logParser:dpsReport.dpsReport
+    db:encounterDb.encounterDb = None
+
+    # Defaults to the client's maxConcurrency, the limiter decides how many of these actually run at once
+    uploadWindow:int = None
+    summaryWindow:int = None
+
+    queueSize:int = 16
+    dbBatchSize:int = 32
+
+    # Path -> uploaded log (None if it wasn't uploaded), filled in as the uploads finish
+    results:Dict[str, dpsReport.dpsReportObj] = field(init=False, default_factory=dict)
+
+    # Paths that didn't get through to dps.report at all, as opposed to being rejected by it
+    failed:Set[str] = field(init=False, default_factory=set)
+
+    def __post_init__(self):
+        if (self.uploadWindow is None):
+            self.uploadWindow = self.logParser.maxConcurrency
+        if (self.summaryWindow is None):
+            self.summaryWindow = self.logParser.maxConcurrency
+
+    async def _upload(self, paths:asyncio.Queue, uploaded:asyncio.Queue):
+        while True:
+            path = await paths.get()
+            if (path is None):
+                return
+
+            try:
+                obj = await self.logParser.uploadLogAsync(path)
+            except Exception as e:
+                print('Log {:s} failed to upload: {}'.format(path, e))
+                self.failed.add(path)
+                obj = None
+
+            self.results[path] = obj
+            if (obj is not None):
+                await uploaded.put(obj)
+
+    async def _summarize(self, uploaded:asyncio.Queue, summarized:asyncio.Queue):
+        while True:
+            log = await uploaded.get()
+            if (log is None):
+                return
+
+            try:
+                await self.logParser.getSummaryAsync(log)
+            except Exception as e:
+                # Left without a summary, it gets fetched again when the post is prepared
+                print('Log {:s} summary could not be fetched: {}'.format(log.permalink, e))
+                self.logParser.metrics.inc('pipeline_summary_failures_total')
+
+            if (log.encounter.summary is not None):
+                await summarized.put(log)
+
+    async def _insert(self, summarized:asyncio.Queue):
+        done = False
+        while (not done):
+            # Wait for one log, then take whatever else is already waiting so the inserts are batched
+            batch = []
+            log = await summarized.get()
+            while (log is not None):
+                batch.append(log)
+                if ((len(batch) >= self.dbBatchSize) or summarized.empty()):
+                    break
+                log = summarized.get_nowait()
+
+            done = (log is None)
+
+            # Every log here has a summary, so importLogs doesn't need to go back out to the network
+            # A failure here must not stop the worker, or the stages before it would block on the full queue
+            if ((self.db is not None) and (len(batch) > 0)):
+                try:
+                    self.db.importLogs(logs=batch, parser=self.logParser)
+                except Exception as e:
+                    print('Importing {:d} logs failed: {}'.format(len(batch), e))
+
+    async def runAsync(self, paths:List[str]) -> List[Tuple[str, dpsReport.dpsReportObj]]:
+        ''' Async version of run
+        '''
+        pathQueue = asyncio.Queue(maxsize=self.queueSize)
+        uploadedQueue = asyncio.Queue(maxsize=self.queueSize)
+        summarizedQueue = asyncio.Queue(maxsize=self.queueSize)
+
+        with self.logParser.metrics.span('pipeline'):
+            uploaders = [asyncio.create_task(self._upload(pathQueue, uploadedQueue)) for _ in range(self.uploadWindow)]
+            summarizers = [asyncio.create_task(self._summarize(uploadedQueue, summarizedQueue)) for _ in range(self.summaryWindow)]
+            inserter = asyncio.create_task(self._insert(summarizedQueue))
+
+            # Feed the paths in as room frees up, then shut each stage down once the one before it has drained
+            for p in paths:
+                await pathQueue.put(p)
+            for _ in uploaders:
+                await pathQueue.put(None)
+
+            await asyncio.gather(*uploaders)
+            for _ in summarizers:
+                await uploadedQueue.put(None)
+
+            await asyncio.gather(*summarizers)
+            await summarizedQueue.put(None)
+
+            await inserter
+
+        return [(p, self.results.get(p)) for p in paths]
+
+    def run(self, paths:List[str]) -> List[Tuple[str, dpsReport.dpsReportObj]]:
+        ''' Uploads the logs, fetches their summaries and imports them into the database. Returns (path, log)
+            for every path in the order given, with None for the logs that weren't uploaded. Those that
+            failed to upload rather than being rejected are in failed.
+        '''
+        return self.logParser.run(self.runAsync(paths))
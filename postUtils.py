@@ -1,7 +1,6 @@
 import aiohttp
-import asyncio
 from disnake import Colour, Embed, Webhook
-from datetime import datetime,timezone
+from datetime import datetime,timedelta,timezone
 from typing import Dict,List
 
 import dpsReport
@@ -81,13 +80,28 @@ def extrapolateTitle(encounterSet:es.encounterSet) -> str:
     finalStr = '{:s} {:s}'.format(longest_pre, numberStr)
     return finalStr
 
-def prefetchLogJson(logParser:dpsReport.dpsReport, encounterSet:es.encounterSet):
+def prefetchLogJson(logParser:dpsReport.dpsReport, encounterSet:es.encounterSet, db=None):
     ''' Since we need detailed JSONs for the logs to extract the correct data, more than the standard
-        metadata would provide, this function prefetches the JSONs from the server and caches them
+        metadata would provide, this function prefetches the JSONs from the server and caches them.
+        Only the summary of each JSON is kept in memory. Logs that already have a summary in the database
+        don't need their JSON at all.
     '''
-    logParser.getJsons(logs=encounterSet.getLogs())
+    logs = encounterSet.getLogs()
+
+    if (isinstance(db, edb.encounterDb)):
+        db.loadSummaries(logs)
+
+    missing = [l for l in logs if (l.encounter.summary is None) and (l.encounter.json is None)]
+    if (len(missing) > 0):
+        logParser.getSummaries(logs=missing)
+
+        if (isinstance(db, edb.encounterDb)):
+            db.storeSummaries(missing)
 
 def prepareMessage(logParser:dpsReport.dpsReport, globalConfig:Dict, config:Dict, encounterSet:es.encounterSet, db=None) -> Embed:
+    ''' Builds the post for the session. The summaries should already be fetched with prefetchLogJson, since this
+        also runs on the client's event loop where nothing can be fetched. Logs without one are left out.
+    '''
     # Only edit the success title if there is no override
     if ((config['useTitleExtrapolate']) and ('overrideSuccessTitle' not in config)):
         successTitle = extrapolateTitle(encounterSet=encounterSet)
@@ -96,6 +110,10 @@ def prepareMessage(logParser:dpsReport.dpsReport, globalConfig:Dict, config:Dict
 
     title_str = '{:s} - {:s}'.format(encounterSet.date.strftime('%m/%d'), successTitle)
 
+    # Anything summarized in the database can be posted without fetching the EI JSON
+    if (isinstance(db, edb.encounterDb)):
+        db.loadSummaries(encounterSet.getLogs())
+
     # Create the rich embded
     message = Embed(title=title_str,
                     type="rich",
@@ -112,6 +130,11 @@ def prepareMessage(logParser:dpsReport.dpsReport, globalConfig:Dict, config:Dict
         success_str = ''
         for b in e.encounters.values():
             for s in b.success_logs:
+                # A log dps.report couldn't give a JSON for has nothing to show
+                if ((s.encounter.summary is None) and (s.encounter.json is None)):
+                    print('Log {:s} has no summary, leaving it out'.format(s.permalink))
+                    continue
+
                 # Get the start and end times of the log
                 # Update the session start and end times as needed
                 (logStartTime, logendTime) = logUtils.getStartAndEndTimes(logParser=logParser, log=s)
@@ -149,13 +172,24 @@ def prepareMessage(logParser:dpsReport.dpsReport, globalConfig:Dict, config:Dict
                     endTime = endTime.replace(hour=0, minute=0, second=0, microsecond=0)
 
                     # See if this kill time is faster than any before
-                    compTime = db.compareTime(compTime=time, boss=b.id, isCm=s.encounter.isCm, endDate=endTime)
+                    compTime = db.compareTime(compTime=time, boss=s.encounter.bossId, isCm=s.encounter.isCm, endDate=endTime)
                     if (compTime.negative):
                         pbStr = '{}: ({})'.format(globalConfig['pbEmote'], config['compTime'])
 
+                    # Where the kill places among all the kills so far, IE: 3rd fastest of 214
+                    if (config.get('includeRank', False) and isinstance(db, edb.encounterDb)):
+                        stats = db.getKillStats(boss=s.encounter.bossId, isCm=s.encounter.isCm,
+                                                endDate=datetime.fromtimestamp(s.encounterTime, tz=timezone.utc),
+                                                compTime=time)
+                        pbStr += ' ({:s})'.format(stats.rankStr())
+
                 success_str += '{:s} - {:s}{:s} {:s}{:s}\n'.format(str(time), cmStr, s.permalink, emStr, pbStr)
 
             for f in b.fail_logs:
+                if ((f.encounter.summary is None) and (f.encounter.json is None)):
+                    print('Log {:s} has no summary, leaving it out'.format(f.permalink))
+                    continue
+
                 # Get the start and end times of the log
                 # Update the session start and end times as needed
                 (logStartTime, logendTime) = logUtils.getStartAndEndTimes(logParser=logParser, log=f)
@@ -178,7 +212,7 @@ def prepareMessage(logParser:dpsReport.dpsReport, globalConfig:Dict, config:Dict
                     emStr = ''
 
                 # Get Encounter Time
-                time = logUtils.logTime.fromLog(logParser=logParser, log=s)
+                time = logUtils.logTime.fromLog(logParser=logParser, log=f)
 
                 # Get fail percentages for this log
                 healthLeft = logUtils.getPercentage(logParser=logParser, log=f, allowedIDs=b.ids)
@@ -228,8 +262,11 @@ def prepareMessage(logParser:dpsReport.dpsReport, globalConfig:Dict, config:Dict
             else:
                 message.add_field(name='{:s}, continued'.format(failureTitle), value=fs, inline=False)
 
-    # Calculate Total Session Time
-    sessionTotalTime = (sessionEndTime - sessionStartTime)
+    # Calculate Total Session Time. It's zero if none of the logs could be summarized
+    if (sessionStartTime is None):
+        sessionTotalTime = timedelta()
+    else:
+        sessionTotalTime = (sessionEndTime - sessionStartTime)
     print('Session Start Time: {}'.format(sessionStartTime))
     print('Session End Time: {}'.format(sessionEndTime))
     print('Total Time: {}'.format(sessionTotalTime))
@@ -243,19 +280,38 @@ def prepareMessage(logParser:dpsReport.dpsReport, globalConfig:Dict, config:Dict
 
     return message
 
-async def sendMessage(config:Dict, message:Embed):
-    async with aiohttp.ClientSession() as session:
-        # Fetch the webhook object
-        webhook = Webhook.from_url(config['webhook'], session=session)
+async def sendMessage(config:Dict, message:Embed, session:aiohttp.ClientSession=None):
+    ''' Sends the message to the configured webhook. If a session is given (IE: the dpsReport client's),
+        it is reused, otherwise a temporary one is created.
+    '''
+    if (session is None):
+        async with aiohttp.ClientSession() as session:
+            await sendMessage(config=config, message=message, session=session)
+        return
 
-        # Upload to webhook
-        await webhook.send(embed=message, username=config['botName'])
+    # Fetch the webhook object
+    webhook = Webhook.from_url(config['webhook'], session=session)
 
-def postLogs(logParser:dpsReport.dpsReport, globalConfig:Dict, config:Dict, encounterSet:es.encounterSet, db=None):
+    # Upload to webhook
+    await webhook.send(embed=message, username=config['botName'])
 
+async def postLogsAsync(logParser:dpsReport.dpsReport, globalConfig:Dict, config:Dict, encounterSet:es.encounterSet, db=None):
+    ''' Async version of postLogs, for use from code that is already running on the client's event loop.
+        The summaries of the logs should already be fetched, since prepareMessage runs synchronously.
+    '''
     # Prepare the message we will send
-    message = prepareMessage(logParser=logParser, globalConfig=globalConfig,
-                             config=config, encounterSet=encounterSet, db=db)
+    with logParser.metrics.span('prepare message'):
+        message = prepareMessage(logParser=logParser, globalConfig=globalConfig,
+                                 config=config, encounterSet=encounterSet, db=db)
+
+    # Share the dps.report client's loop and connection pool
+    with logParser.metrics.span('webhook'):
+        session = await logParser.getSession()
+        await sendMessage(config=config, message=message, session=session)
+
+def postLogs(logParser:dpsReport.dpsReport, globalConfig:Dict, config:Dict, encounterSet:es.encounterSet, db=None):
+    # prepareMessage can't fetch anything once it's running on the client's loop, so get the summaries first
+    prefetchLogJson(logParser=logParser, encounterSet=encounterSet, db=db)
 
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(sendMessage(config=config, message=message))
+    logParser.run(postLogsAsync(logParser=logParser, globalConfig=globalConfig, config=config,
+                                encounterSet=encounterSet, db=db))